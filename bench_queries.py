@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark de las consultas frecuentes de los comandos con y sin sentencias preparadas.
+Por defecto usa una base SQLite temporal; con --database-url usa una base PostgreSQL
+de pruebas (se insertan datos sintéticos, no usar la base de producción).
+
+    python bench_queries.py --reclutadores 50 --miembros 5000 --repeticiones 500
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import database
+from storage import SQLiteBackend, PostgresBackend
+from workload import Workload
+
+def medir(nombre, func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        'consulta': nombre,
+        'p50': statistics.median(tiempos),
+        'p95': tiempos[int(len(tiempos) * 0.95) - 1],
+        'media': statistics.fmean(tiempos),
+    }
+
+def consultas(carga, ids):
+    """Consultas de /ver_reclutado, /ver_reclutador y /ver_staff, sin pasar por la caché"""
+    def miembro():
+        reclutado = random.choice(carga.reclutados)
+        database.get_miembro_by_etiqueta.uncached(carga.guild.id, str(reclutado), reclutado.id)
+
+    def actividades():
+        id_miembro = random.choice(ids)
+        database.count_actividades_by_miembro.uncached(id_miembro)
+        database.get_actividades_page(id_miembro)
+
+    def reclutados():
+        reclutador = random.choice(carga.reclutadores)
+        database.count_reclutados.uncached(carga.guild.id, str(reclutador), reclutador.id)
+        database.get_reclutados_page(carga.guild.id, str(reclutador), reclutador.id)
+
+    def stats():
+        reclutador = random.choice(carga.reclutadores)
+        database.get_reclutador_stats.uncached(carga.guild.id, str(reclutador), reclutador.id)
+
+    return [
+        ('miembro por etiqueta', miembro),
+        ('actividades (conteo + página)', actividades),
+        ('reclutados (conteo + página)', reclutados),
+        ('estadísticas de reclutador', stats),
+        ('estadísticas de todos', lambda: database.get_reclutadores_stats.uncached(carga.guild.id)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Base PostgreSQL de pruebas (por defecto SQLite temporal)')
+    parser.add_argument('--reclutadores', type=int, default=50)
+    parser.add_argument('--miembros', type=int, default=5000)
+    parser.add_argument('--actividades', type=int, default=5, help='Actividades por miembro')
+    parser.add_argument('--repeticiones', type=int, default=500)
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp()
+    ruta = os.path.join(carpeta, 'bench.db')
+
+    def crear_backend(preparadas):
+        if args.database_url:
+            return PostgresBackend(args.database_url)
+        # Sin caché de sentencias SQLite vuelve a compilar cada consulta, como antes del registro
+        return SQLiteBackend(ruta, cached_statements=256 if preparadas else 0)
+
+    database.set_backend(crear_backend(True))
+    database.create_tables()
+    carga = Workload(args.reclutadores, args.miembros, args.miembros * args.actividades)
+    ids = carga.sembrar()
+    print(f'Base {database.get_backend().dialect}: {args.reclutadores} reclutadores, {args.miembros} miembros, '
+          f'{args.miembros * args.actividades} actividades\n')
+
+    resultados = {}
+    for preparadas in (False, True):
+        database.set_backend(crear_backend(preparadas))
+        database.DB_PREPARED_STATEMENTS = preparadas
+        random.seed(2)
+        for nombre, func in consultas(carga, ids):
+            func()  # Calentamiento: la primera llamada prepara la sentencia
+            resultados[(nombre, preparadas)] = medir(nombre, func, args.repeticiones)
+
+    print(f'{"consulta":<32} {"texto p50":>10} {"prep. p50":>10} {"texto p95":>10} {"prep. p95":>10} {"mejora":>8}')
+    for nombre, _ in consultas(carga, ids):
+        antes, despues = resultados[(nombre, False)], resultados[(nombre, True)]
+        mejora = (1 - despues['media'] / antes['media']) * 100
+        print(f'{nombre:<32} {antes["p50"]:>8.3f}ms {despues["p50"]:>8.3f}ms '
+              f'{antes["p95"]:>8.3f}ms {despues["p95"]:>8.3f}ms {mejora:>7.1f}%')
+
+    database.close_pool()
+    shutil.rmtree(carpeta, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los comandos del bot sobre un servidor y una base de datos sintéticos.
+Siembra una base (SQLite temporal por defecto, o --database-url para una base PostgreSQL
+de pruebas), construye un servidor falso con workload.py y ejecuta los handlers de
+bot.py con interacciones simuladas. Reporta latencia p50/p95/p99, consultas y solicitudes
+de miembros a Discord por comando (--lazy simula MEMBER_LOADING=lazy).
+
+    python benchmark.py --reclutadores 500 --reclutados 50000 --actividades 500000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import io
+import argparse
+import contextlib
+import tempfile
+import threading
+from collections import Counter
+
+carpeta = tempfile.mkdtemp(prefix='bench_')
+# La cola de escrituras de bot.py guarda su archivo al importarse el módulo
+os.environ.setdefault('WRITE_SPILL_PATH', os.path.join(carpeta, 'escrituras_pendientes.jsonl'))
+os.environ.setdefault('WRITE_DEAD_LETTER_PATH', os.path.join(carpeta, 'escrituras_descartadas.jsonl'))
+
+import database
+from storage import SQLiteBackend, PostgresBackend
+from workload import Workload, FakeRole
+
+
+class _CursorContado:
+    def __init__(self, cursor, contador):
+        self._cursor = cursor
+        self._contador = contador
+
+    def execute(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._contador.sumar()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class ContadorConsultas:
+    """Cuenta las sentencias enviadas a la base envolviendo los cursores del motor"""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def sumar(self):
+        with self._lock:
+            self.total += 1
+
+    def instalar(self, backend):
+        cursor_original = backend.cursor
+        backend.cursor = lambda conn: _CursorContado(cursor_original(conn), self)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.mensajes.append(content)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.mensajes.append(content)
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.mensajes.append(content)
+
+
+class FakeInteraction:
+    """Interacción simulada: guarda los mensajes enviados en lugar de llamar a Discord"""
+
+    def __init__(self, user, guild):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.mensajes = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+async def medir(nombre, preparar, ejecutar, repeticiones, contador, con_cache, guild):
+    tiempos = []
+    consultas = 0
+    solicitudes = guild.solicitudes
+    for n in range(repeticiones):
+        args = preparar(n)
+        if not con_cache:
+            database.cache.clear()
+        antes = contador.total
+        inicio = time.perf_counter()
+        await ejecutar(*args)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        consultas += contador.total - antes
+    return {
+        'comando': nombre,
+        'n': len(tiempos),
+        'p50': percentil(tiempos, 50),
+        'p95': percentil(tiempos, 95),
+        'p99': percentil(tiempos, 99),
+        'consultas': consultas / len(tiempos),
+        'discord': (guild.solicitudes - solicitudes) / len(tiempos),
+    }
+
+
+async def correr(args, carga, bot):
+    rng = random.Random(args.seed)
+    contador = ContadorConsultas()
+    contador.instalar(database.get_backend())
+    guild = carga.guild
+    usuario = carga.reclutadores[0]
+    # Reclutadores ordenados de más a menos reclutados para poder elegir los grandes
+    tamanos = Counter(reclutador.id for _, reclutador, _ in carga.altas)
+    por_tamano = sorted(carga.reclutadores, key=lambda r: -tamanos[r.id])
+    if bot.MIEMBROS_DIFERIDOS:
+        # Como con chunk_guilds_at_startup=False: los miembros se piden a medida que hacen falta
+        guild.cache_completa = False
+    else:
+        # Igual que on_ready: el índice de miembros se construye antes de atender comandos
+        bot.member_index.build(guild)
+
+    def interaccion():
+        return FakeInteraction(usuario, guild)
+
+    async def ver_staff():
+        await bot.ver_staff.callback(interaccion())
+
+    async def ver_reclutador(reclutador):
+        await bot.ver_reclutador.callback(interaccion(), reclutador)
+
+    async def ver_reclutado(miembro):
+        await bot.ver_reclutado.callback(interaccion(), miembro)
+
+    async def actividad_grupal(rol):
+        await bot.agregar_actividad_grupal.callback(interaccion(), 'Benchmark', rol=rol)
+
+    async def clear_reclutador(reclutador):
+        # Igual que el botón "Limpiar Reclutador" de la vista de /ver_reclutador
+        view = bot.ReclutadorView(str(reclutador), None, None, reclutador.id)
+        await view.clear_reclutador.callback(interaccion())
+
+    # Rol con una muestra de reclutados para la actividad grupal
+    grupo = guild.add_role(FakeRole(99, 'Grupo benchmark'))
+    for miembro in rng.sample(carga.reclutados, min(len(carga.reclutados), args.grupo)):
+        miembro.roles.append(grupo)
+        grupo.members.append(miembro)
+
+    escenarios = [
+        ('/ver_staff', lambda n: (), ver_staff),
+        ('/ver_reclutador (grande)', lambda n: (por_tamano[n % 5],), ver_reclutador),
+        ('/ver_reclutador', lambda n: (rng.choice(carga.reclutadores),), ver_reclutador),
+        ('/ver_reclutado', lambda n: (rng.choice(carga.reclutados),), ver_reclutado),
+        ('/agregar_actividad_grupal', lambda n: (grupo,), actividad_grupal),
+    ]
+    resultados = []
+    for nombre, preparar, ejecutar in escenarios:
+        resultados.append(await medir(nombre, preparar, ejecutar, args.repeticiones, contador, args.cache, guild))
+
+    # Limpiar es destructivo: se mide una vez por reclutador, empezando por los más chicos
+    limpiar = list(reversed(por_tamano))[:min(args.repeticiones, len(por_tamano))]
+    resultados.append(await medir('clear_reclutador', lambda n: (limpiar[n],), clear_reclutador,
+                                  len(limpiar), contador, args.cache, guild))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Base PostgreSQL de pruebas (por defecto SQLite temporal)')
+    parser.add_argument('--reclutadores', type=int, default=200)
+    parser.add_argument('--reclutados', type=int, default=20000)
+    parser.add_argument('--actividades', type=int, default=100000)
+    parser.add_argument('--extra', type=int, default=5000, help='Miembros del servidor que no son reclutados')
+    parser.add_argument('--grupo', type=int, default=25, help='Miembros del rol usado en /agregar_actividad_grupal')
+    parser.add_argument('--repeticiones', type=int, default=100)
+    parser.add_argument('--cache', action='store_true', help='Mantener la caché de lecturas entre llamadas')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--lazy', action='store_true', help='Simular MEMBER_LOADING=lazy (miembros pedidos por ID)')
+    args = parser.parse_args()
+    if args.lazy:
+        os.environ['MEMBER_LOADING'] = 'lazy'
+
+    if args.database_url:
+        database.set_backend(PostgresBackend(args.database_url))
+    else:
+        database.set_backend(SQLiteBackend(os.path.join(carpeta, 'bench.db')))
+
+    inicio = time.perf_counter()
+    carga = Workload(args.reclutadores, args.reclutados, args.actividades, args.extra, args.seed)
+    database.create_tables()
+    carga.sembrar()
+    print(f'Base {database.get_backend().dialect} sembrada en {time.perf_counter() - inicio:.1f}s: '
+          f'{args.reclutadores} reclutadores, {args.reclutados} reclutados, {args.actividades} actividades, '
+          f'{len(carga.guild.members)} miembros en el servidor\n')
+
+    import bot
+    try:
+        # Los handlers imprimen cada comando ejecutado; no mezclarlo con el reporte
+        with contextlib.redirect_stdout(io.StringIO()):
+            resultados = asyncio.run(correr(args, carga, bot))
+    finally:
+        database.close_pool()
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    print(f'{"comando":<28} {"n":>5} {"p50":>10} {"p95":>10} {"p99":>10} {"consultas":>10} {"discord":>8}')
+    for r in resultados:
+        print(f'{r["comando"]:<28} {r["n"]:>5} {r["p50"]:>8.2f}ms {r["p95"]:>8.2f}ms {r["p99"]:>8.2f}ms '
+              f'{r["consultas"]:>10.1f} {r["discord"]:>8.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,17 +2,30 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import os
-import sqlite3
 from dotenv import load_dotenv
-from database import create_tables, add_miembro, add_actividad, get_miembro_by_etiqueta, get_reclutados_by_reclutador, get_actividades_by_miembro, count_actividades_by_miembro, delete_miembro, clear_reclutador, get_reclutadores_with_count, get_all_reclutadores_with_count, get_reclutadores_last_activity, get_reclutadores_stats, initialize_reclutadores_table
+from member_index import MemberIndex
+from member_cache import MemberCache
+from write_queue import WriteBehindQueue
+from metrics import instrumentar, marcar_error, exportar_periodicamente, registro
+from health import HealthReporter
+import loop_monitor
+import shards
+from exit_codes import EXIT_DATABASE, EXIT_RATE_LIMITED, EXIT_CONFIG
+from database import run_db, close_pool, apply_escrituras, es_error_transitorio, purge_escrituras_aplicadas, preparar_base_de_datos, get_miembro_by_etiqueta, get_miembro_by_id, delete_miembros, add_actividades_bulk, get_actividades_page, count_actividades_by_miembro, count_reclutados, get_reclutados_page, clear_reclutador, get_reclutadores_stats, get_etiquetas_sin_id, backfill_discord_ids, get_servidor_config, set_rol_staff, asignar_datos_sin_servidor, get_ranking, get_resumen_actividad, get_reclutados_inactivos, ping, get_backend, get_executor_stats
 import logging
 import sys
+import math
+import time
+from collections import deque
 from datetime import datetime
+from typing import Optional
 
 # Configurar logging
+# Con varios procesos (SHARD_IDS) cada línea indica qué shards la escribieron
+ETIQUETA_PROCESO = f"[shards {os.environ[shards.SHARD_IDS_ENV]}] " if os.environ.get(shards.SHARD_IDS_ENV) else ''
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=f'%(asctime)s - {ETIQUETA_PROCESO}%(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('bot.log'),
         logging.StreamHandler(sys.stdout)
@@ -23,54 +36,226 @@ logger = logging.getLogger('discord_bot')
 
 load_dotenv()
 
+def formatear_fecha(fecha):
+    """Devuelve solo el día de una fecha (acepta datetime o texto)"""
+    if fecha is None:
+        return 'Nunca'
+    if isinstance(fecha, datetime):
+        return fecha.strftime('%Y-%m-%d')
+    fecha = str(fecha)
+    return fecha.split(' ')[0] if ' ' in fecha else fecha
+
+# Rol de /ver_staff en los servidores que no lo configuraron con /configurar_rol_staff
+ROL_STAFF_POR_DEFECTO = int(os.getenv('STAFF_ROLE_ID', 1404279446780772422))
+
+# Índice de miembros por etiqueta, mantenido con los eventos de miembros
+member_index = MemberIndex()
+
+# MEMBER_LOADING=lazy: no se descargan todos los miembros al conectar; se piden por ID
+# cuando un comando los necesita y se guardan en una caché LRU acotada
+MIEMBROS_DIFERIDOS = os.getenv('MEMBER_LOADING', 'full').lower() == 'lazy'
+member_cache = MemberCache(maxsize=int(os.getenv('MEMBER_CACHE_SIZE', 5000)),
+                           chunk=int(os.getenv('MEMBER_CHUNK_SIZE', 100)),
+                           limite_rol=int(os.getenv('MEMBER_ROLE_SCAN_LIMIT', 1000)))
+
+registro.add_collector(lambda: [
+    ('bot_member_cache_entries', 'Miembros en la caché de carga diferida', len(member_cache)),
+    ('bot_member_index_entries', 'Miembros en el índice por etiqueta', len(member_index)),
+])
+
+async def precargar_miembros(guild, ids_discord):
+    """En modo diferido, trae de Discord los miembros que una página va a mostrar"""
+    if MIEMBROS_DIFERIDOS and guild is not None:
+        await member_cache.fetch(guild, ids_discord)
+
 # Función helper para obtener el nombre actual de un reclutado
-def get_reclutado_display_name(etiqueta_guardada, guild):
+def get_reclutado_display_name(etiqueta_guardada, guild, id_discord=None):
     """Intenta obtener el nickname actual del reclutado, si no está disponible usa la etiqueta guardada"""
     try:
-        # Buscar el miembro en el servidor por diferentes métodos
-        for member in guild.members:
-            member_str = str(member)  # Formato completo: Usuario#1234 o @usuario
-            
-            # Comparar etiqueta completa
-            if member_str == etiqueta_guardada:
-                # Si tiene un nickname diferente al username, mostrar ambos
-                if member.display_name != member.name:
-                    return f"{member.display_name} ({etiqueta_guardada})"
-                else:
-                    # Si no tiene nickname especial, mostrar solo el display_name
-                    return member.display_name
-            
-            # También buscar por nombre de usuario si no tiene discriminador
-            if member.name == etiqueta_guardada:
-                if member.display_name != member.name:
-                    return f"{member.display_name} ({etiqueta_guardada})"
-                else:
-                    return member.display_name
-                    
-            # Buscar por username si la etiqueta tiene formato Usuario#1234
-            if '#' in etiqueta_guardada:
-                username = etiqueta_guardada.split('#')[0]
-                if member.name == username:
-                    if member.display_name != member.name:
-                        return f"{member.display_name} ({etiqueta_guardada})"
-                    else:
-                        return member.display_name
-                        
+        if MIEMBROS_DIFERIDOS:
+            member = member_cache.get(guild, id_discord)
+        elif id_discord is not None:
+            # El ID no cambia con los renombres; la etiqueta solo para filas antiguas sin ID
+            member = member_index.get(guild, id_discord)
+        else:
+            member = member_index.find(guild, etiqueta_guardada)
+        if member is not None:
+            # Si tiene un nickname diferente al username, mostrar ambos
+            if member.display_name != member.name:
+                return f"{member.display_name} ({etiqueta_guardada})"
+            # Si no tiene nickname especial, mostrar solo el display_name
+            return member.display_name
     except Exception as e:
         print(f"Error obteniendo display name para {etiqueta_guardada}: {e}")
-        pass
     return etiqueta_guardada
 
+# Cola de escrituras diferidas: los comandos responden sin esperar el commit
+MENSAJE_ESCRITURAS_PENDIENTES = ('Hay registros pendientes de guardar por un problema con la base de datos; '
+                                 'intenta de nuevo en unos segundos')
+cola_escrituras = WriteBehindQueue(
+    aplicar=lambda lote: run_db(apply_escrituras, lote),
+    es_transitorio=es_error_transitorio,
+    spill_path=os.getenv('WRITE_SPILL_PATH', 'escrituras_pendientes.jsonl'),
+    intervalo=float(os.getenv('WRITE_FLUSH_INTERVAL', 0.5)),
+    descartadas_path=os.getenv('WRITE_DEAD_LETTER_PATH', 'escrituras_descartadas.jsonl'),
+)
+registro.add_collector(lambda: [
+    ('bot_write_queue_pending', 'Escrituras diferidas sin aplicar', len(cola_escrituras)),
+    ('bot_write_queue_discarded', 'Escrituras diferidas rechazadas por la base desde el arranque',
+     cola_escrituras.stats['descartadas']),
+])
+
+# Momento (time.monotonic) en que cada shard perdió la conexión con el gateway (None sin sharding)
+desconectado_desde = {}
+# Lag del event loop y perfilador de bloqueos (LOOP_PROFILE_THRESHOLD)
+monitor_loop = loop_monitor.desde_entorno()
+# Muestras (momento, comandos, errores) para calcular la tasa de errores de los últimos 5 minutos
+muestras_comandos = deque()
+
+async def estado_salud(lag):
+    """Reporte de salud que se envía a run_bot.py por el canal de health.py"""
+    ahora = time.monotonic()
+    comandos = registro.total('bot_command_duration_seconds')
+    errores = registro.total('bot_command_errors_total')
+    muestras_comandos.append((ahora, comandos, errores))
+    while muestras_comandos[0][0] < ahora - 300:
+        muestras_comandos.popleft()
+    _, comandos_antes, errores_antes = muestras_comandos[0]
+
+    # La desconexión más antigua es la que decide si el proceso sigue vivo
+    desde = min(desconectado_desde.values(), default=None)
+    estado = {
+        'pid': os.getpid(),
+        'gateway_conectado': bot.is_ready() and not bot.is_closed() and desde is None,
+        'desconectado_s': round(ahora - desde, 1) if desde is not None else None,
+        'latencia_gateway': round(bot.latency, 3) if math.isfinite(bot.latency) else None,
+        'lag_loop': round(max(lag, monitor_loop.tomar_lag_maximo()), 3),
+        'bloqueos_loop': monitor_loop.bloqueos,
+        'cola_db': get_executor_stats()['queued'],
+        'comandos': comandos,
+        'errores': errores,
+        'comandos_5m': comandos - comandos_antes,
+        'tasa_errores_5m': round((errores - errores_antes) / (comandos - comandos_antes), 3) if comandos > comandos_antes else 0,
+        'escrituras_pendientes': len(cola_escrituras),
+        'escrituras_descartadas': cola_escrituras.stats['descartadas'],
+    }
+    inicio = time.monotonic()
+    try:
+        await run_db(ping, timeout=2)
+        estado['db_ok'] = True
+        estado['db_ms'] = round((time.monotonic() - inicio) * 1000, 1)
+    except Exception as e:
+        estado['db_ok'] = False
+        estado['db_error'] = str(e)[:200] or type(e).__name__
+    stats = get_backend().stats()
+    estado['pool_en_uso'] = stats.get('pool_in_use')
+    estado['pool_max'] = stats.get('pool_max')
+    if USA_SHARDS:
+        estado['servidores'] = len(bot.guilds)
+        # Por shard: [id, conectado, latencia]; compacto para que el reporte quepa en el pipe
+        estado['shards'] = [
+            [shard_id, not info.is_closed() and shard_id not in desconectado_desde,
+             round(info.latency, 3) if math.isfinite(info.latency) else None]
+            for shard_id, info in sorted(bot.shards.items())
+        ]
+    return estado
+
+# SHARD_COUNT: AutoShardedBot con los shards de SHARD_IDS (run_bot.py los reparte entre procesos)
+USA_SHARDS = shards.usa_shards()
+SHARD_COUNT, SHARD_IDS = shards.desde_entorno() if USA_SHARDS else (None, None)
+
+class ReclutadorBot(commands.AutoShardedBot if USA_SHARDS else commands.Bot):
+    async def setup_hook(self):
+        cola_escrituras.cargar_spill()
+        cola_escrituras.start()
+        # Archivo de métricas que run_bot.py sirve en /metrics
+        self.loop.create_task(exportar_periodicamente(os.getenv('METRICS_PATH', 'bot_metrics.prom'),
+                                                      float(os.getenv('METRICS_INTERVAL', 5))))
+        self.loop.create_task(monitor_loop.ejecutar())
+        # Reporte de salud para /health y /ready (solo si lo lanzó run_bot.py)
+        self.loop.create_task(HealthReporter(estado_salud, float(os.getenv('HEALTH_INTERVAL', 5))).ejecutar())
+
+    async def close(self):
+        # Aplicar lo pendiente antes de cerrar; lo que no se pueda queda en el archivo local
+        await cola_escrituras.stop()
+        await super().close()
+
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+opciones_bot = {}
+if USA_SHARDS:
+    opciones_bot = {'shard_count': SHARD_COUNT, 'shard_ids': SHARD_IDS}
+if MIEMBROS_DIFERIDOS:
+    # Sin chunk al conectar; discord.py solo guarda los miembros en canales de voz
+    bot = ReclutadorBot(command_prefix='!', intents=intents, chunk_guilds_at_startup=False,
+                        member_cache_flags=discord.MemberCacheFlags(voice=True, joined=False), **opciones_bot)
+else:
+    bot = ReclutadorBot(command_prefix='!', intents=intents, **opciones_bot)
 
 # Clases de UI para los componentes interactivos
-class ReclutadorView(discord.ui.View):
-    def __init__(self, reclutador_etiqueta, reclutados):
+TAMANO_PAGINA = 15
+# Puestos que muestra /ranking
+TAMANO_RANKING = int(os.getenv('RANKING_SIZE', 50))
+
+class PaginadorView(discord.ui.View):
+    """Vista con botones Anterior/Siguiente que carga cada página por cursor.
+    cargar(despues, limite) devuelve las filas siguientes a la clave despues,
+    clave(fila) da la clave de cursor de una fila y render(filas, pagina) arma el texto."""
+
+    def __init__(self, cargar, clave, render, tamano=TAMANO_PAGINA):
         super().__init__(timeout=300)  # 5 minutos de timeout
+        self.cargar = cargar
+        self.clave = clave
+        self.render = render
+        self.tamano = tamano
+        # Cursor con el que empieza cada página visitada (None = primera página)
+        self.cursores = [None]
+        self.filas = []
+        self.hay_siguiente = False
+
+    async def pagina_actual(self):
+        """Carga la página actual (pidiendo una fila extra para saber si hay más) y devuelve su texto"""
+        filas = await self.cargar(self.cursores[-1], self.tamano + 1)
+        self.hay_siguiente = len(filas) > self.tamano
+        self.filas = filas[:self.tamano]
+        self.anterior.disabled = len(self.cursores) == 1
+        self.siguiente.disabled = not self.hay_siguiente
+        return self.render(self.filas, len(self.cursores))
+
+    @discord.ui.button(label="Anterior", style=discord.ButtonStyle.secondary, emoji="⬅️")
+    async def anterior(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursores) > 1:
+            self.cursores.pop()
+        mensaje = await self.pagina_actual()
+        await interaction.response.edit_message(content=mensaje, view=self)
+
+    @discord.ui.button(label="Siguiente", style=discord.ButtonStyle.secondary, emoji="➡️")
+    async def siguiente(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.hay_siguiente and self.filas:
+            self.cursores.append(self.clave(self.filas[-1]))
+        mensaje = await self.pagina_actual()
+        await interaction.response.edit_message(content=mensaje, view=self)
+
+def paginar_lineas(encabezado, lineas, pie='', tamano=TAMANO_PAGINA):
+    """Crea un PaginadorView sobre una lista de líneas ya calculada en memoria"""
+    total_paginas = max(1, -(-len(lineas) // tamano))
+
+    async def cargar(despues, limite):
+        inicio = 0 if despues is None else despues + 1
+        return [(i, lineas[i]) for i in range(inicio, min(len(lineas), inicio + limite))]
+
+    def render(filas, pagina):
+        cuerpo = ''.join(linea for _, linea in filas)
+        return f'{encabezado}{cuerpo}{pie}\n*Página {pagina}/{total_paginas}*'
+
+    return PaginadorView(cargar, lambda fila: fila[0], render, tamano)
+
+class ReclutadorView(PaginadorView):
+    def __init__(self, guild_id, reclutador_etiqueta, cargar, render, reclutador_id=None):
+        super().__init__(cargar, lambda rec: (rec['fecha_registro'], rec['id']), render)
+        self.guild_id = guild_id
         self.reclutador_etiqueta = reclutador_etiqueta
-        self.reclutados = reclutados
+        self.reclutador_id = reclutador_id
 
     @discord.ui.button(label="Limpiar Reclutador", style=discord.ButtonStyle.danger, emoji="🗑️")
     async def clear_reclutador(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -78,29 +263,32 @@ class ReclutadorView(discord.ui.View):
         button.disabled = True
         await interaction.response.edit_message(view=self)
         
-        # Ejecutar la limpieza
-        deleted_count = clear_reclutador(self.reclutador_etiqueta)
+        # Ejecutar la limpieza (después de aplicar las altas pendientes, para que no vuelvan a aparecer)
+        if not await cola_escrituras.flush(esperar=True):
+            await interaction.followup.send(MENSAJE_ESCRITURAS_PENDIENTES, ephemeral=True)
+            return
+        deleted_count = await run_db(clear_reclutador, self.guild_id, self.reclutador_etiqueta, self.reclutador_id)
         
         await interaction.followup.send(f"EXITO: Se eliminaron {deleted_count} reclutados y todas sus actividades del reclutador {self.reclutador_etiqueta}", ephemeral=True)
 
     @discord.ui.button(label="Eliminar Reclutado", style=discord.ButtonStyle.secondary, emoji="👤")
     async def delete_reclutado(self, interaction: discord.Interaction, button: discord.ui.Button):
         try:
-            if not self.reclutados:
-                await interaction.followup.send("No hay reclutados para eliminar", ephemeral=True)
+            if not self.filas:
+                await interaction.response.send_message("No hay reclutados para eliminar", ephemeral=True)
                 return
             
             # Deshabilitar el botón para evitar múltiples clics
             button.disabled = True
             await interaction.response.edit_message(view=self)
             
-            # Crear opciones para el select menu
+            # Crear opciones para el select menu con los reclutados de la página visible
             options = []
-            for rec in self.reclutados:
-                id_miembro, etiqueta, fecha = rec
-                count_act = count_actividades_by_miembro(id_miembro)
+            for rec in self.filas:
+                id_miembro = rec['id']
+                etiqueta = rec['etiqueta_miembro']
                 label = f"{etiqueta[:25]}..." if len(etiqueta) > 25 else etiqueta
-                description = f"Ingreso: {fecha}, Actividades: {count_act}"
+                description = f"Ingreso: {formatear_fecha(rec['fecha_registro'])}, Actividades: {rec['actividades']}"
                 options.append(discord.SelectOption(
                     label=label,
                     description=description,
@@ -131,16 +319,17 @@ class ReclutadoSelect(discord.ui.Select):
             await interaction.response.defer(ephemeral=True)
 
             # Obtener la información del reclutado seleccionado
-            conn = sqlite3.connect('reclutador.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT etiqueta_miembro FROM miembros WHERE id = ?', (int(self.values[0]),))
-            result = cursor.fetchone()
-            conn.close()
+            id_miembro = int(self.values[0])
+            result = await run_db(get_miembro_by_id, id_miembro)
 
-            if result:
-                etiqueta_miembro = result[0]
-                # Eliminar el reclutado
-                deleted = delete_miembro(etiqueta_miembro)
+            # Solo se eliminan reclutados del servidor donde se abrió el menú
+            if result and result['guild_id'] == interaction.guild_id:
+                etiqueta_miembro = result['etiqueta_miembro']
+                # Eliminar el reclutado (después de aplicar lo encolado)
+                if not await cola_escrituras.flush(esperar=True):
+                    await interaction.followup.send(MENSAJE_ESCRITURAS_PENDIENTES, ephemeral=True)
+                    return
+                deleted = await run_db(delete_miembros, [id_miembro])
 
                 if deleted:
                     await interaction.followup.send(f"EXITO: Reclutado {etiqueta_miembro} y todas sus actividades han sido eliminados", ephemeral=True)
@@ -151,29 +340,135 @@ class ReclutadoSelect(discord.ui.Select):
         except Exception as e:
             # Log del error pero no intentar responder para evitar más errores
             logger.error(f"Error en eliminacion de reclutado: {e}")
-            # No intentar followup aquí para evitar cascada de errores@bot.event
+            # No intentar followup aquí para evitar cascada de errores
+
+async def asignar_datos_antiguos():
+    """Asigna los datos guardados antes de separarlos por servidor al servidor DEFAULT_GUILD_ID,
+    o al único servidor del bot si no está definido"""
+    guild_id = os.getenv('DEFAULT_GUILD_ID')
+    if guild_id is not None:
+        # Con varios procesos solo lo hace el que tiene ese servidor
+        if bot.get_guild(int(guild_id)) is None:
+            return
+    elif SHARD_IDS is None and len(bot.guilds) == 1:
+        guild_id = bot.guilds[0].id
+    else:
+        return
+    try:
+        asignados = await run_db(asignar_datos_sin_servidor, int(guild_id))
+        if asignados:
+            logger.info(f'{asignados} miembros sin servidor asignados al servidor {guild_id}')
+    except Exception as e:
+        logger.error(f'Error asignando datos sin servidor: {e}')
+
+async def completar_ids_discord():
+    """Completa los IDs de Discord de filas antiguas usando el índice de miembros de cada servidor"""
+    try:
+        actualizados = 0
+        for guild in bot.guilds:
+            etiquetas = await run_db(get_etiquetas_sin_id, guild.id)
+            ids_por_etiqueta = {}
+            for etiqueta in etiquetas:
+                if MIEMBROS_DIFERIDOS:
+                    member = await member_cache.buscar_etiqueta(guild, etiqueta)
+                else:
+                    member = member_index.find(guild, etiqueta)
+                if member is not None:
+                    ids_por_etiqueta[etiqueta] = member.id
+            if ids_por_etiqueta:
+                actualizados += await run_db(backfill_discord_ids, guild.id, ids_por_etiqueta)
+        if actualizados:
+            logger.info(f'IDs de Discord completados en {actualizados} filas')
+    except Exception as e:
+        logger.error(f'Error completando IDs de Discord: {e}')
+
+@bot.event
 async def on_ready():
-    logger.info(f'Bot conectado como {bot.user}')
+    desconectado_desde.clear()
+    logger.info(f'Bot conectado como {bot.user}' + (f' (shards {shards.formatear_ids(bot.shards)} de {bot.shard_count})' if USA_SHARDS else ''))
+    if MIEMBROS_DIFERIDOS:
+        logger.info('Carga diferida de miembros: no se construye el índice completo')
+    else:
+        for guild in bot.guilds:
+            member_index.build(guild)
+        logger.info(f'Índice de miembros construido ({len(member_index)} miembros)')
+    await asignar_datos_antiguos()
+    await completar_ids_discord()
+    # Los comandos son globales: con varios procesos los sincroniza solo el del shard 0
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        return
     try:
         synced = await bot.tree.sync()
         logger.info(f'Sincronizados {len(synced)} comandos')
     except Exception as e:
         logger.error(f'Error sincronizando comandos: {e}')
 
+@bot.event
+async def on_member_join(member):
+    # Con carga diferida no hay índice que mantener
+    if not MIEMBROS_DIFERIDOS:
+        member_index.add(member)
+
+@bot.event
+async def on_member_update(before, after):
+    if not MIEMBROS_DIFERIDOS:
+        member_index.update(before, after)
+    member_cache.update(after)
+
+@bot.event
+async def on_user_update(before, after):
+    if not MIEMBROS_DIFERIDOS:
+        member_index.update_user(before, after, bot.guilds)
+
+@bot.event
+async def on_member_remove(member):
+    member_index.remove(member)
+    member_cache.remove(member)
+
+@bot.event
+async def on_guild_remove(guild):
+    member_index.forget_guild(guild)
+    member_cache.forget_guild(guild)
+
+@bot.event
+async def on_guild_role_delete(rol):
+    member_index.remove_role(rol)
+
 @bot.event
 async def on_disconnect():
-    logger.warning('Bot desconectado de Discord')
+    # Con shards cada uno avisa en on_shard_disconnect
+    if not USA_SHARDS:
+        desconectado_desde.setdefault(None, time.monotonic())
+        logger.warning('Bot desconectado de Discord')
 
 @bot.event
 async def on_resumed():
-    logger.info('Bot reconectado a Discord')
+    if not USA_SHARDS:
+        desconectado_desde.pop(None, None)
+        logger.info('Bot reconectado a Discord')
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    desconectado_desde.setdefault(shard_id, time.monotonic())
+    logger.warning(f'Shard {shard_id} desconectado de Discord')
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    if desconectado_desde.pop(shard_id, None) is not None:
+        logger.info(f'Shard {shard_id} reconectado a Discord')
+
+@bot.event
+async def on_shard_connect(shard_id):
+    desconectado_desde.pop(shard_id, None)
 
 @bot.event
 async def on_error(event, *args, **kwargs):
     logger.error(f'Error en evento {event}: {args} {kwargs}')
 
 @bot.tree.command(name='nuevo_miembro', description='Registra un nuevo miembro reclutado')
+@app_commands.guild_only()
 @app_commands.describe(miembro='Etiqueta del nuevo miembro', reclutador='Etiqueta del reclutador')
+@instrumentar
 async def nuevo_miembro(interaction: discord.Interaction, miembro: discord.Member, reclutador: discord.Member):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -182,11 +477,19 @@ async def nuevo_miembro(interaction: discord.Interaction, miembro: discord.Membe
 
     etiqueta_miembro = str(miembro)
     etiqueta_reclutador = str(reclutador)
-    add_miembro(etiqueta_miembro, etiqueta_reclutador)
+    cola_escrituras.enqueue('miembro', {
+        'guild_id': interaction.guild_id,
+        'etiqueta_miembro': etiqueta_miembro,
+        'etiqueta_reclutador': etiqueta_reclutador,
+        'id_discord_miembro': miembro.id,
+        'id_discord_reclutador': reclutador.id,
+    })
     await interaction.response.send_message(f'Nuevo miembro registrado: {etiqueta_miembro} por {etiqueta_reclutador}')
 
 @bot.tree.command(name='agregar_actividad', description='Agrega una actividad a un reclutado')
+@app_commands.guild_only()
 @app_commands.describe(miembro='Etiqueta del reclutado', detalle='Detalle de la actividad')
+@instrumentar
 async def agregar_actividad(interaction: discord.Interaction, miembro: discord.Member, detalle: str):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -194,15 +497,111 @@ async def agregar_actividad(interaction: discord.Interaction, miembro: discord.M
     print(f"[{timestamp}] {user_name} ejecutó comando: /agregar_actividad")
 
     etiqueta_miembro = str(miembro)
-    miembro_data = get_miembro_by_etiqueta(etiqueta_miembro)
-    if miembro_data:
-        add_actividad(miembro_data[0], detalle)
+    miembro_data = await run_db(get_miembro_by_etiqueta, interaction.guild_id, etiqueta_miembro, miembro.id)
+    if miembro_data or cola_escrituras.miembro_pendiente(interaction.guild_id, etiqueta_miembro, miembro.id):
+        cola_escrituras.enqueue('actividad', {
+            'guild_id': interaction.guild_id,
+            'etiqueta_miembro': etiqueta_miembro,
+            'id_discord_miembro': miembro.id,
+            'detalle': detalle,
+        })
         await interaction.response.send_message(f'Actividad agregada a {etiqueta_miembro}: {detalle}')
     else:
         await interaction.response.send_message('Miembro no encontrado. Regístralo primero con /nuevo_miembro')
 
+async def registrar_actividad_grupal(interaction, miembros, detalle, aviso=None):
+    """Registra una actividad para varios miembros con una sola escritura y responde con el resumen"""
+    # Quitar bots y duplicados conservando el orden
+    unicos = {m.id: m for m in miembros if not m.bot}
+    # Los reclutados recién encolados tienen que estar en la base para encontrarlos
+    if not await cola_escrituras.flush(esperar=True):
+        await interaction.followup.send(MENSAJE_ESCRITURAS_PENDIENTES)
+        return
+    registrados, no_encontrados = await run_db(add_actividades_bulk, interaction.guild_id, [(str(m), m.id) for m in unicos.values()], detalle)
+
+    mensaje = f'Actividad "{detalle}" agregada a {len(registrados)} reclutados'
+    if no_encontrados:
+        lista = ', '.join(no_encontrados[:20])
+        if len(no_encontrados) > 20:
+            lista += f' y {len(no_encontrados) - 20} más'
+        mensaje += f'\nNo registrados como reclutados ({len(no_encontrados)}): {lista}'
+    if aviso:
+        mensaje += f'\n{aviso}'
+    await interaction.followup.send(mensaje[:1900])
+
+class ActividadGrupalSelect(discord.ui.UserSelect):
+    def __init__(self, detalle):
+        super().__init__(placeholder="Selecciona los reclutados...", min_values=1, max_values=25)
+        self.detalle = detalle
+
+    async def callback(self, interaction: discord.Interaction):
+        try:
+            await interaction.response.defer()
+            miembros = [m for m in self.values if isinstance(m, discord.Member)]
+            await registrar_actividad_grupal(interaction, miembros, self.detalle)
+        except Exception as e:
+            logger.error(f"Error en actividad grupal: {e}")
+
+@bot.tree.command(name='agregar_actividad_grupal', description='Agrega la misma actividad a varios reclutados a la vez')
+@app_commands.guild_only()
+@app_commands.describe(
+    detalle='Detalle de la actividad',
+    rol='Registrar a todos los miembros con este rol',
+    canal='Registrar a todos los miembros conectados a este canal de voz'
+)
+@instrumentar
+async def agregar_actividad_grupal(interaction: discord.Interaction, detalle: str,
+                                   rol: Optional[discord.Role] = None,
+                                   canal: Optional[discord.VoiceChannel] = None):
+    # Log del comando ejecutado
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    user_name = interaction.user.display_name
+    print(f"[{timestamp}] {user_name} ejecutó comando: /agregar_actividad_grupal")
+
+    try:
+        if rol is None and canal is None:
+            # Sin rol ni canal: dejar elegir a los miembros con un selector múltiple
+            view = discord.ui.View(timeout=300)
+            view.add_item(ActividadGrupalSelect(detalle))
+            await interaction.response.send_message('Selecciona los reclutados que participaron:', view=view, ephemeral=True)
+            return
+
+        miembros = []
+        aviso = None
+        if rol is not None:
+            if MIEMBROS_DIFERIDOS:
+                # Sin caché completa se recorre el servidor por HTTP hasta MEMBER_ROLE_SCAN_LIMIT miembros
+                await interaction.response.defer()
+                miembros_rol, completo = await member_cache.miembros_con_rol(interaction.guild, rol)
+                miembros.extend(miembros_rol)
+                if not completo:
+                    aviso = (f'Aviso: solo se revisaron los primeros {member_cache.limite_rol} miembros del servidor '
+                             f'para el rol **{rol.name}**; usa el selector o un canal de voz para el resto')
+            else:
+                miembros.extend(rol.members)
+        if canal is not None:
+            miembros.extend(canal.members)
+        if not miembros:
+            if interaction.response.is_done():
+                await interaction.followup.send('No hay miembros en el rol o canal indicado')
+            else:
+                await interaction.response.send_message('No hay miembros en el rol o canal indicado')
+            return
+
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+        await registrar_actividad_grupal(interaction, miembros, detalle, aviso)
+    except Exception as e:
+        marcar_error()
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f'Error al registrar actividades: {str(e)}')
+        else:
+            await interaction.followup.send(f'Error al registrar actividades: {str(e)}')
+
 @bot.tree.command(name='ver_reclutador', description='Muestra estadísticas del reclutador')
+@app_commands.guild_only()
 @app_commands.describe(reclutador='Etiqueta del reclutador')
+@instrumentar
 async def ver_reclutador(interaction: discord.Interaction, reclutador: discord.Member):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -212,50 +611,57 @@ async def ver_reclutador(interaction: discord.Interaction, reclutador: discord.M
     etiqueta_reclutador = str(reclutador)
     
     try:
-        reclutados = get_reclutados_by_reclutador(etiqueta_reclutador)
-        if reclutados:
-            # Mostrar nickname actual y etiqueta guardada
-            nickname_actual = reclutador.display_name
-            mensaje = f'Reclutador: {nickname_actual}'
-            if nickname_actual != reclutador.name:
-                mensaje += f' ({etiqueta_reclutador})'
-            mensaje += f'\nCantidad de reclutados: {len(reclutados)}\n\n'
-            
-            for rec in reclutados:
-                id_miembro, etiqueta, fecha = rec
-                count_act = count_actividades_by_miembro(id_miembro)
-                
-                # Obtener el nombre actual del reclutado
-                nombre_actual = get_reclutado_display_name(etiqueta, interaction.guild)
-                # Formatear fecha para mostrar solo el día
-                fecha_formateada = fecha.split(' ')[0] if ' ' in fecha else fecha
-                mensaje += f'- {nombre_actual}: Ingreso {fecha_formateada}, Actividades: {count_act}\n'
-            
-            # Verificar longitud del mensaje
-            if len(mensaje) > 1900:
-                mensaje = mensaje[:1900] + '\n\n[Mensaje truncado por límite de caracteres]'
-            
-            # Crear la vista con botones
-            view = ReclutadorView(etiqueta_reclutador, reclutados)
+        total_reclutados = await run_db(count_reclutados, interaction.guild_id, etiqueta_reclutador, reclutador.id)
+
+        # Mostrar nickname actual y etiqueta guardada
+        nickname_actual = reclutador.display_name
+        encabezado = f'Reclutador: {nickname_actual}'
+        if nickname_actual != reclutador.name:
+            encabezado += f' ({etiqueta_reclutador})'
+
+        if total_reclutados:
+            encabezado += f'\nCantidad de reclutados: {total_reclutados}\n\n'
+            total_paginas = max(1, -(-total_reclutados // TAMANO_PAGINA))
+
+            async def cargar(despues, limite):
+                reclutados = await run_db(get_reclutados_page, interaction.guild_id, etiqueta_reclutador, reclutador.id, despues, limite)
+                await precargar_miembros(interaction.guild, [rec['id_discord_miembro'] for rec in reclutados])
+                return reclutados
+
+            def render(reclutados, pagina):
+                mensaje = encabezado
+                for rec in reclutados:
+                    # Obtener el nombre actual del reclutado
+                    nombre_actual = get_reclutado_display_name(rec['etiqueta_miembro'], interaction.guild, rec['id_discord_miembro'])
+                    # Formatear fecha para mostrar solo el día
+                    fecha_formateada = formatear_fecha(rec['fecha_registro'])
+                    mensaje += f'- {nombre_actual}: Ingreso {fecha_formateada}, Actividades: {rec["actividades"]}'
+                    if rec['ultima_actividad']:
+                        mensaje += f', Última: {formatear_fecha(rec["ultima_actividad"])}'
+                    mensaje += '\n'
+                return mensaje + f'\n*Página {pagina}/{total_paginas}*'
+
+            # Crear la vista con botones de página y de administración
+            view = ReclutadorView(interaction.guild_id, etiqueta_reclutador, cargar, render, reclutador.id)
+            mensaje = await view.pagina_actual()
             
             await interaction.response.send_message(mensaje, view=view)
         else:
             # Mostrar nickname actual incluso si no tiene reclutados
-            nickname_actual = reclutador.display_name
-            mensaje = f'Reclutador: {nickname_actual}'
-            if nickname_actual != reclutador.name:
-                mensaje += f' ({etiqueta_reclutador})'
-            mensaje += '\nNo hay reclutados registrados para este reclutador'
+            mensaje = encabezado + '\nNo hay reclutados registrados para este reclutador'
             
             await interaction.response.send_message(mensaje)
             
     except Exception as e:
+        marcar_error()
         # Solo intentar responder si no se ha respondido aún
         if not interaction.response.is_done():
             await interaction.response.send_message(f'Error al consultar datos: {str(e)}')
 
 @bot.tree.command(name='ver_reclutado', description='Muestra detalles de un reclutado')
+@app_commands.guild_only()
 @app_commands.describe(miembro='Etiqueta del reclutado')
+@instrumentar
 async def ver_reclutado(interaction: discord.Interaction, miembro: discord.Member):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -265,43 +671,60 @@ async def ver_reclutado(interaction: discord.Interaction, miembro: discord.Membe
     etiqueta_miembro = str(miembro)
     
     try:
-        miembro_data = get_miembro_by_etiqueta(etiqueta_miembro)
+        miembro_data = await run_db(get_miembro_by_etiqueta, interaction.guild_id, etiqueta_miembro, miembro.id)
         if miembro_data:
-            id_miembro, etiqueta_guardada, reclutador, fecha_ingreso = miembro_data
-            actividades = get_actividades_by_miembro(id_miembro)
-            count_act = len(actividades)
+            id_miembro = miembro_data['id']
+            etiqueta_guardada = miembro_data['etiqueta_miembro']
+            fecha_ingreso = miembro_data['fecha_registro']
+            count_act = await run_db(count_actividades_by_miembro, id_miembro)
             
             # Mostrar nickname actual y etiqueta guardada
             nickname_actual = miembro.display_name
-            mensaje = f'Reclutado: {nickname_actual}'
+            encabezado = f'Reclutado: {nickname_actual}'
             if nickname_actual != miembro.name:
-                mensaje += f' ({etiqueta_guardada})'
+                encabezado += f' ({etiqueta_guardada})'
             # Formatear fecha para mostrar solo el día
-            fecha_formateada = fecha_ingreso.split(' ')[0] if ' ' in fecha_ingreso else fecha_ingreso
-            mensaje += f'\nFecha de ingreso: {fecha_formateada}\nCantidad de actividades: {count_act}\n\n'
+            fecha_formateada = formatear_fecha(fecha_ingreso)
+            encabezado += f'\nFecha de ingreso: {fecha_formateada}\nCantidad de actividades: {count_act}\n'
             
-            if actividades:
-                mensaje += 'Actividades:\n'
+            if not count_act:
+                await interaction.response.send_message(encabezado)
+                return
+
+            # Resumen por ventanas de días desde actividad_diaria, sin leer las actividades
+            ultimo_dia, por_ventana = await run_db(get_resumen_actividad, id_miembro)
+            recientes = ' - '.join(f'{dias} días: {cantidad}' for dias, cantidad in por_ventana.items())
+            encabezado += f'Actividades recientes: {recientes} - último día activo: {formatear_fecha(ultimo_dia)}\n\n'
+
+            total_paginas = max(1, -(-count_act // TAMANO_PAGINA))
+
+            async def cargar(despues, limite):
+                return await run_db(get_actividades_page, id_miembro, despues, limite)
+
+            def render(actividades, pagina):
+                mensaje = encabezado + 'Actividades:\n'
                 for act in actividades:
-                    detalle, fecha = act
-                    # Formatear fecha para mostrar solo el día
-                    fecha_formateada = fecha.split(' ')[0] if ' ' in fecha else fecha
-                    mensaje += f'- {fecha_formateada}: {detalle}\n'
-            
-            # Verificar longitud del mensaje (límite de Discord: 2000 caracteres)
-            if len(mensaje) > 1900:  # Margen de seguridad
-                mensaje = mensaje[:1900] + '\n\n[Mensaje truncado por límite de caracteres]'
+                    # Formatear fecha para mostrar solo el día y acotar detalles largos
+                    detalle = act['detalle'] if len(act['detalle']) <= 100 else act['detalle'][:97] + '...'
+                    mensaje += f'- {formatear_fecha(act["fecha"])}: {detalle}\n'
+                return mensaje + f'\n*Página {pagina}/{total_paginas}*'
+
+            view = PaginadorView(cargar, lambda act: (act['fecha'], act['id']), render)
+            mensaje = await view.pagina_actual()
             
-            await interaction.response.send_message(mensaje)
+            await interaction.response.send_message(mensaje, view=view)
         else:
             await interaction.response.send_message('Miembro no encontrado')
             
     except Exception as e:
+        marcar_error()
         # Solo intentar responder si no se ha respondido aún
         if not interaction.response.is_done():
             await interaction.response.send_message(f'Error al consultar datos: {str(e)}')
 
 @bot.tree.command(name='ver_staff', description='Ver miembros con rol específico que tienen actividad registrada')
+@app_commands.guild_only()
+@instrumentar
 async def ver_staff(interaction: discord.Interaction):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -314,89 +737,207 @@ async def ver_staff(interaction: discord.Interaction):
             await interaction.response.send_message('Este comando solo funciona en un servidor')
             return
 
-        # ID del rol específico
-        rol_id = 1404279446780772422
+        # Rol configurado para este servidor con /configurar_rol_staff
+        config = await run_db(get_servidor_config, interaction.guild.id)
+        rol_id = config['rol_staff_id'] if config and config['rol_staff_id'] else ROL_STAFF_POR_DEFECTO
 
         # Buscar el rol por ID
         rol = interaction.guild.get_role(rol_id)
         if not rol:
-            await interaction.response.send_message(f'Rol con ID {rol_id} no encontrado en este servidor')
+            await interaction.response.send_message(f'Rol con ID {rol_id} no encontrado en este servidor. Configúralo con /configurar_rol_staff')
             return
         
-        # Obtener estadísticas completas de reclutadores
-        reclutadores_stats = get_reclutadores_stats()
+        # Obtener estadísticas completas de reclutadores del servidor
+        reclutadores_stats = await run_db(get_reclutadores_stats, interaction.guild.id)
         
-        # Crear diccionarios para búsqueda rápida
+        # Crear diccionarios para búsqueda rápida (por ID de Discord y, solo para filas antiguas sin ID, por etiqueta)
+        stats_por_id = {}
         stats_dict = {}
-        for etiqueta, activos, total_historico, ultimo_reclutamiento, fecha_creacion in reclutadores_stats:
-            stats_dict[etiqueta] = {
-                'activos': activos,
-                'total_historico': total_historico,
-                'ultimo_reclutamiento': ultimo_reclutamiento,
-                'fecha_creacion': fecha_creacion
+        for fila in reclutadores_stats:
+            stats = {
+                'activos': fila['reclutados_activos'],
+                'total_historico': fila['total_historico'],
+                'ultimo_reclutamiento': fila['ultimo_reclutamiento'],
+                'fecha_creacion': fila['fecha_creacion'],
+                'total_actividades': fila['total_actividades']
             }
+            if fila['id_discord'] is not None:
+                stats_por_id[fila['id_discord']] = stats
+            else:
+                stats_dict[fila['etiqueta_reclutador']] = stats
         
         # Obtener TODOS los miembros con el rol específico
         miembros_con_rol = []
         
         # Procesar todos los miembros del servidor que tienen el rol
         # interaction.guild ya está verificado como no-None al inicio de la función
-        for member in interaction.guild.members:  # type: ignore
-            if rol in member.roles:
+        if MIEMBROS_DIFERIDOS:
+            # Solo importan los miembros con estadísticas: se piden a Discord por ID
+            # (las filas antiguas sin ID de Discord se completan en on_ready)
+            candidatos = (await member_cache.fetch(interaction.guild, list(stats_por_id))).values()
+        else:
+            # Índice rol -> miembros: solo se recorren los que tienen el rol
+            candidatos = member_index.members_with_role(interaction.guild, rol.id)
+        for member in candidatos:
+            if member.get_role(rol.id) is not None:
                 # Buscar si este miembro es reclutador en la BD
                 reclutados_activos = 0
                 total_historico = 0
+                total_actividades = 0
                 ultima_actividad = 'Nunca'
                 
-                # Buscar por diferentes formatos de etiqueta
-                posibles_etiquetas = [
-                    str(member),  # Usuario#1234
-                    member.name,  # Usuario
-                    member.display_name  # Nickname
-                ]
+                # Buscar por ID y, si no hay, por diferentes formatos de etiqueta
+                stats = stats_por_id.get(member.id)
+                if stats is None:
+                    posibles_etiquetas = [
+                        str(member),  # Usuario#1234
+                        member.name,  # Usuario
+                        member.display_name  # Nickname
+                    ]
+                    stats = next((stats_dict[e] for e in posibles_etiquetas if e in stats_dict), None)
                 
-                for etiqueta in posibles_etiquetas:
-                    if etiqueta in stats_dict:
-                        stats = stats_dict[etiqueta]
-                        reclutados_activos = stats['activos']
-                        total_historico = stats['total_historico']
-                        ultima_actividad = stats['ultimo_reclutamiento'] or 'Nunca'
-                        break
+                if stats is not None:
+                    reclutados_activos = stats['activos']
+                    total_historico = stats['total_historico']
+                    total_actividades = stats['total_actividades'] or 0
+                    ultima_actividad = stats['ultimo_reclutamiento'] or 'Nunca'
                 
                 # Agregar el miembro a la lista con toda la información SOLO si tiene actividad registrada
                 if ultima_actividad != 'Nunca':
-                    miembros_con_rol.append((member, reclutados_activos, total_historico, ultima_actividad))
+                    miembros_con_rol.append((member, reclutados_activos, total_historico, total_actividades, ultima_actividad))
         
         if not miembros_con_rol:
             await interaction.response.send_message(f'No se encontraron miembros con el rol **{rol.name}** que tengan actividad registrada')
             return
         
-        mensaje = f'**Miembros con rol {rol.name} (con actividad registrada):**\n\n'
+        encabezado = f'**Miembros con rol {rol.name} (con actividad registrada):**\n\n'
+        lineas = []
         
-        for member, reclutados_activos, total_historico, ultima_actividad in miembros_con_rol:
+        for member, reclutados_activos, total_historico, total_actividades, ultima_actividad in miembros_con_rol:
             # Obtener el display name
             display_name = member.display_name if member.display_name != member.name else member.name
             discord_nick = f'{member.name}'
             
             # Formatear fecha para mostrar solo el día
             if ultima_actividad != 'Nunca':
-                ultima_actividad = ultima_actividad.split(' ')[0] if ' ' in ultima_actividad else ultima_actividad
+                ultima_actividad = formatear_fecha(ultima_actividad)
             
-            mensaje += f'{display_name} ({discord_nick}) - reclutados activos: {reclutados_activos} - total histórico: {total_historico} - última actividad: {ultima_actividad}\n'
+            lineas.append(f'{display_name} ({discord_nick}) - reclutados activos: {reclutados_activos} - total histórico: {total_historico} - actividades: {total_actividades} - última actividad: {ultima_actividad}\n')
         
-        # Verificar longitud del mensaje (límite de Discord: 2000 caracteres)
-        if len(mensaje) > 1900:  # Margen de seguridad
-            mensaje = mensaje[:1900] + '\n\n[Mensaje truncado por límite de caracteres]'
+        # Paginar en lugar de truncar (límite de Discord: 2000 caracteres)
+        view = paginar_lineas(encabezado, lineas)
+        mensaje = await view.pagina_actual()
         
-        await interaction.response.send_message(mensaje)
+        await interaction.response.send_message(mensaje, view=view)
         
     except ValueError:
         await interaction.response.send_message('El ID del rol debe ser un número válido')
     except Exception as e:
+        marcar_error()
         if not interaction.response.is_done():
             await interaction.response.send_message(f'Error al consultar datos: {str(e)}')
 
+@bot.tree.command(name='ranking', description='Ranking de reclutadores de la semana o del mes')
+@app_commands.guild_only()
+@app_commands.describe(periodo='Semana (desde el lunes) o mes', criterio='Cómo ordenar el ranking',
+                       anteriores='0 para el período actual, 1 para el anterior, etc.')
+@app_commands.choices(
+    periodo=[app_commands.Choice(name='Semana', value='semana'), app_commands.Choice(name='Mes', value='mes')],
+    criterio=[app_commands.Choice(name='Reclutados', value='reclutados'),
+              app_commands.Choice(name='Reclutados que siguen', value='retenidos'),
+              app_commands.Choice(name='Actividades por reclutado del período', value='actividades')])
+@instrumentar
+async def ranking(interaction: discord.Interaction, periodo: app_commands.Choice[str],
+                  criterio: Optional[app_commands.Choice[str]] = None, anteriores: app_commands.Range[int, 0, 52] = 0):
+    # Log del comando ejecutado
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    user_name = interaction.user.display_name
+    print(f"[{timestamp}] {user_name} ejecutó comando: /ranking {periodo.value}")
+
+    try:
+        orden = criterio.value if criterio else 'reclutados'
+        # Se lee de la tabla materializada: no recorre miembros ni actividades
+        inicio, filas = await run_db(get_ranking, interaction.guild_id, periodo.value, orden, anteriores, limite=TAMANO_RANKING)
+        titulo = f'semana del {inicio.isoformat()}' if periodo.value == 'semana' else f'mes {inicio.strftime("%Y-%m")}'
+        if not filas:
+            await interaction.response.send_message(f'No hay reclutadores con datos en la {titulo}')
+            return
+
+        await precargar_miembros(interaction.guild, [fila['id_discord'] for fila in filas if fila['id_discord']])
+        encabezado = f'**Ranking de la {titulo} ({criterio.name if criterio else "Reclutados"}):**\n\n'
+        lineas = []
+        for posicion, fila in enumerate(filas, 1):
+            nombre = get_reclutado_display_name(fila['etiqueta_reclutador'], interaction.guild, fila['id_discord'])
+            linea = f"**{posicion}.** {nombre} - reclutados: {fila['reclutados']} - siguen: {fila['retenidos']} - actividades: {fila['actividades']}"
+            if fila['actividades_por_reclutado'] is not None:
+                linea += f" ({fila['actividades_por_reclutado']:.1f} por reclutado del período)"
+            lineas.append(linea + '\n')
+
+        view = paginar_lineas(encabezado, lineas)
+        mensaje = await view.pagina_actual()
+        await interaction.response.send_message(mensaje, view=view)
+
+    except Exception as e:
+        marcar_error()
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f'Error al consultar el ranking: {str(e)}')
+
+@bot.tree.command(name='inactivos', description='Reclutados sin actividad en los últimos días')
+@app_commands.guild_only()
+@app_commands.describe(dias='Días sin actividad (por ejemplo 7, 14 o 30)', reclutador='Solo los reclutados de este reclutador')
+@instrumentar
+async def inactivos(interaction: discord.Interaction, dias: app_commands.Range[int, 1, 365] = 7,
+                    reclutador: Optional[discord.Member] = None):
+    # Log del comando ejecutado
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    user_name = interaction.user.display_name
+    print(f"[{timestamp}] {user_name} ejecutó comando: /inactivos {dias}")
+
+    try:
+        # Se responde desde actividad_diaria: no recorre la tabla de actividades
+        if reclutador is None:
+            filas = await run_db(get_reclutados_inactivos, interaction.guild_id, dias)
+        else:
+            filas = await run_db(get_reclutados_inactivos, interaction.guild_id, dias, str(reclutador), reclutador.id)
+        de_quien = f' de {reclutador.display_name}' if reclutador else ''
+        if not filas:
+            await interaction.response.send_message(f'No hay reclutados{de_quien} sin actividad en los últimos {dias} días')
+            return
+
+        encabezado = f'**Reclutados{de_quien} sin actividad en los últimos {dias} días: {len(filas)}**\n\n'
+        total_paginas = max(1, -(-len(filas) // TAMANO_PAGINA))
+
+        async def cargar(despues, limite):
+            inicio = 0 if despues is None else despues + 1
+            pagina = list(enumerate(filas[inicio:inicio + limite], inicio))
+            # En modo diferido solo se piden a Discord los miembros de la página
+            ids = {fila['id_discord_miembro'] for _, fila in pagina} | {fila['id_discord_reclutador'] for _, fila in pagina}
+            await precargar_miembros(interaction.guild, [id_discord for id_discord in ids if id_discord])
+            return pagina
+
+        def render(pagina, numero):
+            mensaje = encabezado
+            for _, fila in pagina:
+                nombre = get_reclutado_display_name(fila['etiqueta_miembro'], interaction.guild, fila['id_discord_miembro'])
+                mensaje += f'- {nombre}: Ingreso {formatear_fecha(fila["fecha_registro"])}, Última actividad: {formatear_fecha(fila["ultimo_dia"])}'
+                if reclutador is None:
+                    nombre_reclutador = get_reclutado_display_name(fila['etiqueta_reclutador'], interaction.guild, fila['id_discord_reclutador'])
+                    mensaje += f', Reclutador: {nombre_reclutador}'
+                mensaje += '\n'
+            return mensaje + f'\n*Página {numero}/{total_paginas}*'
+
+        view = PaginadorView(cargar, lambda fila: fila[0], render)
+        mensaje = await view.pagina_actual()
+        await interaction.response.send_message(mensaje, view=view)
+
+    except Exception as e:
+        marcar_error()
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f'Error al consultar reclutados inactivos: {str(e)}')
+
 @bot.tree.command(name='listar_roles', description='Lista todos los roles del servidor con sus IDs')
+@app_commands.guild_only()
+@instrumentar
 async def listar_roles(interaction: discord.Interaction):
     # Log del comando ejecutado
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -408,30 +949,67 @@ async def listar_roles(interaction: discord.Interaction):
             await interaction.response.send_message('Este comando solo funciona en un servidor')
             return
         
-        mensaje = '**Lista de roles del servidor:**\n\n'
+        lineas = []
         
         for rol in interaction.guild.roles:  # type: ignore
             # Excluir @everyone ya que no es útil para este caso
             if rol.name != '@everyone':
-                mensaje += f'**{rol.name}** - ID: `{rol.id}`\n'
+                lineas.append(f'**{rol.name}** - ID: `{rol.id}`\n')
         
-        mensaje += '\n*Usa el ID del rol que quieres consultar en el comando /ver_staff*'
+        pie = '\n*Elige el rol que muestra /ver_staff con el comando /configurar_rol_staff*'
         
-        # Verificar longitud del mensaje (límite de Discord: 2000 caracteres)
-        if len(mensaje) > 1900:
-            mensaje = mensaje[:1900] + '\n\n[Mensaje truncado por límite de caracteres]'
+        # Paginar en lugar de truncar (límite de Discord: 2000 caracteres)
+        view = paginar_lineas('**Lista de roles del servidor:**\n\n', lineas, pie, tamano=25)
+        mensaje = await view.pagina_actual()
         
-        await interaction.response.send_message(mensaje)
+        await interaction.response.send_message(mensaje, view=view)
         
     except Exception as e:
+        marcar_error()
         if not interaction.response.is_done():
             await interaction.response.send_message(f'Error al listar roles: {str(e)}')
 
+@bot.tree.command(name='configurar_rol_staff', description='Configura el rol que muestra /ver_staff en este servidor')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(rol='Rol del staff de reclutamiento')
+@instrumentar
+async def configurar_rol_staff(interaction: discord.Interaction, rol: discord.Role):
+    # Log del comando ejecutado
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    user_name = interaction.user.display_name
+    print(f"[{timestamp}] {user_name} ejecutó comando: /configurar_rol_staff")
+
+    try:
+        await run_db(set_rol_staff, interaction.guild_id, rol.id)
+        await interaction.response.send_message(f'Rol de staff configurado: **{rol.name}**. /ver_staff mostrará a sus miembros')
+    except Exception as e:
+        marcar_error()
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f'Error al guardar la configuración: {str(e)}')
+
 if __name__ == '__main__':
-    create_tables()
-    initialize_reclutadores_table()
+    # El código de salida le indica a run_bot.py cuánto esperar antes de reiniciar
+    try:
+        preparar_base_de_datos()
+        purge_escrituras_aplicadas()
+    except Exception as e:
+        logger.error(f'No se pudo preparar la base de datos: {e}')
+        close_pool()
+        sys.exit(EXIT_DATABASE)
     token = os.getenv('DISCORD_TOKEN')
     if token:
-        bot.run(token)
+        try:
+            bot.run(token)
+        except (discord.LoginFailure, discord.PrivilegedIntentsRequired) as e:
+            logger.error(f'Configuración de Discord inválida: {e}')
+            sys.exit(EXIT_CONFIG)
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            logger.error(f'Discord limitó el inicio de sesión: {e}')
+            sys.exit(EXIT_RATE_LIMITED)
+        finally:
+            close_pool()
     else:
         print('Por favor, configura la variable de entorno DISCORD_TOKEN con tu token de bot')
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Caché en memoria con expiración (TTL) y política LRU para las consultas de lectura.
+Las funciones de escritura de database.py invalidan las entradas afectadas.
+"""
+
+import time
+import threading
+import functools
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Caché LRU acotada con tiempo de vida por entrada y contadores de aciertos/fallos"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Se incrementa en cada invalidación para no guardar lecturas que empezaron antes de una escritura
+        self._generation = 0
+
+    def get(self, key):
+        """Devuelve (True, valor) si la clave está vigente, (False, None) si no"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expira, valor = entry
+                if expira > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, valor
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, valor, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, valor)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, namespace, ident=None):
+        """Elimina una entrada concreta o, sin ident, todas las de un namespace"""
+        with self._lock:
+            self._generation += 1
+            if ident is not None:
+                if self._data.pop((namespace, ident), None) is not None:
+                    self.invalidations += 1
+                return
+            claves = [k for k in self._data if k[0] == namespace]
+            for clave in claves:
+                del self._data[clave]
+            self.invalidations += len(claves)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+    def cached(self, namespace, key=None):
+        """Decorador de lectura: guarda el resultado bajo (namespace, key(*args))"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                ident = key(*args, **kwargs) if key else args
+                clave = (namespace, ident)
+                encontrado, valor = self.get(clave)
+                if encontrado:
+                    return valor
+                generation = self._generation
+                valor = func(*args, **kwargs)
+                self.set(clave, valor, generation)
+                return valor
+            wrapper.uncached = func
+            return wrapper
+        return decorator
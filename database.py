@@ -1,287 +1,1275 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+import time
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from cache import TTLCache
+from storage import create_backend
+from metrics import registro, medicion_actual, CursorMedido
 
-def get_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL no está configurada en las variables de entorno")
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+logger = logging.getLogger('database')
+
+# Workers del executor de base de datos (igual al máximo del pool de conexiones)
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 5))
+# Caché de lecturas: número máximo de entradas y segundos de vida de cada una
+DB_CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', 2048))
+DB_CACHE_TTL = int(os.environ.get('DB_CACHE_TTL', 60))
+# Executor de base de datos: segundos máximos por llamada y trabajos máximos en espera
+DB_CALL_TIMEOUT = float(os.environ.get('DB_CALL_TIMEOUT', 10))
+DB_QUEUE_MAX = int(os.environ.get('DB_QUEUE_MAX', 100))
+
+_backend = None
+_backend_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix='db')
+_executor_lock = threading.Lock()
+_executor_stats = {
+    'queued': 0,
+    'running': 0,
+    'max_queued': 0,
+    'completed': 0,
+    'errors': 0,
+    'timeouts': 0,
+    'rejected': 0,
+    'wait_seconds_total': 0.0,
+    'run_seconds_total': 0.0,
+}
+
+class DatabaseBusyError(RuntimeError):
+    """La cola de trabajos de base de datos está llena"""
+
+cache = TTLCache(maxsize=DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+
+def get_backend():
+    """Devuelve el motor de almacenamiento configurado (PostgreSQL o SQLite), creándolo la primera vez"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                logger.info(f'Motor de base de datos: {_backend.dialect}')
+    return _backend
+
+def set_backend(backend):
+    """Reemplaza el motor de almacenamiento (cierra el anterior y vacía la caché)"""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        _backend = backend
+    cache.clear()
+
+@contextmanager
+def get_connection(write=False):
+    """Presta una conexión del motor; hace commit al salir o rollback si hay error.
+    write=True en las transacciones que escriben"""
+    with get_backend().connection(write) as conn:
+        yield conn
+
+@contextmanager
+def get_cursor(write=False):
+    """Atajo para obtener un cursor sobre una conexión del motor (write=True si la transacción escribe)"""
+    backend = get_backend()
+    with backend.connection(write) as conn:
+        # Cuenta consultas y filas, también para el comando en curso si lo hay
+        cursor = CursorMedido(backend.cursor(conn), medicion_actual())
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+def close_pool():
+    """Cierra todas las conexiones del motor (usado al apagar el bot)"""
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+
+def ping():
+    """Consulta mínima para comprobar que la base responde (usada por el reporte de salud)"""
+    with get_cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    return True
+
+def _ejecutar(func, encolado):
+    inicio = time.monotonic()
+    with _executor_lock:
+        _executor_stats['queued'] -= 1
+        _executor_stats['running'] += 1
+        _executor_stats['wait_seconds_total'] += inicio - encolado
+    try:
+        return func()
+    except Exception:
+        with _executor_lock:
+            _executor_stats['errors'] += 1
+        raise
+    finally:
+        with _executor_lock:
+            _executor_stats['running'] -= 1
+            _executor_stats['completed'] += 1
+            _executor_stats['run_seconds_total'] += time.monotonic() - inicio
+
+def _descontar_cancelado(future):
+    # Un trabajo cancelado antes de empezar nunca pasa por _ejecutar
+    if future.cancelled():
+        with _executor_lock:
+            _executor_stats['queued'] -= 1
+
+async def run_db(func, *args, timeout=None, **kwargs):
+    """Ejecuta una función de base de datos en el executor dedicado sin bloquear el event loop.
+    Falla con DatabaseBusyError si la cola está llena y con asyncio.TimeoutError si tarda más de timeout"""
+    with _executor_lock:
+        if _executor_stats['queued'] >= DB_QUEUE_MAX:
+            _executor_stats['rejected'] += 1
+            raise DatabaseBusyError(f'Cola de base de datos llena ({DB_QUEUE_MAX} trabajos en espera)')
+        _executor_stats['queued'] += 1
+        _executor_stats['max_queued'] = max(_executor_stats['max_queued'], _executor_stats['queued'])
+
+    # El hilo del executor ve la medición del comando que hizo la llamada
+    contexto = contextvars.copy_context()
+    inicio = time.monotonic()
+    future = _executor.submit(contexto.run, _ejecutar, functools.partial(func, *args, **kwargs), inicio)
+    future.add_done_callback(_descontar_cancelado)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout or DB_CALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        with _executor_lock:
+            _executor_stats['timeouts'] += 1
+        logger.warning(f'Tiempo agotado en {getattr(func, "__name__", func)} tras {timeout or DB_CALL_TIMEOUT}s')
+        raise
+    finally:
+        duracion = time.monotonic() - inicio
+        registro.observe('bot_db_call_duration_seconds', duracion, function=getattr(func, '__name__', 'desconocida'))
+        medicion = medicion_actual()
+        if medicion is not None:
+            medicion.db += duracion
+
+def get_executor_stats():
+    """Devuelve una copia de las métricas del executor de base de datos"""
+    with _executor_lock:
+        stats = dict(_executor_stats)
+    stats['workers'] = DB_POOL_MAX
+    return stats
+
+def _metricas_base_de_datos():
+    """Gauges del executor, del motor y de la caché para /metrics"""
+    executor = get_executor_stats()
+    stats_cache = cache.stats()
+    metricas = [
+        ('bot_db_executor_queued', 'Llamadas a la base de datos esperando un hilo libre', executor['queued']),
+        ('bot_db_executor_running', 'Llamadas a la base de datos en ejecución', executor['running']),
+        ('bot_db_executor_rejected', 'Llamadas rechazadas por cola llena desde el inicio', executor['rejected']),
+        ('bot_db_executor_timeouts', 'Llamadas que superaron DB_CALL_TIMEOUT desde el inicio', executor['timeouts']),
+        ('bot_cache_entries', 'Entradas en la caché de lecturas', stats_cache['entries']),
+        ('bot_cache_hit_ratio', 'Proporción de lecturas servidas desde la caché', stats_cache['hit_ratio']),
+    ]
+    if _backend is not None:
+        metricas.append(('bot_db_connections_in_use', 'Conexiones prestadas por el motor de base de datos',
+                         _backend.stats()['pool_in_use']))
+    return metricas
+
+registro.add_collector(_metricas_base_de_datos)
+
+# Migraciones del esquema en orden; cada una se aplica una sola vez y queda
+# registrada en la tabla schema_version. Las sentencias pueden ser una lista común
+# o un diccionario con una lista por motor cuando la sintaxis difiere
+# Índices de miembros con guild_id al frente: cada comando lee solo la partición de su servidor
+_INDICES_MIEMBROS_POR_SERVIDOR = [
+    'DROP INDEX IF EXISTS idx_miembros_etiqueta',
+    'DROP INDEX IF EXISTS idx_miembros_id_discord',
+    'DROP INDEX IF EXISTS idx_miembros_reclutador',
+    'DROP INDEX IF EXISTS idx_miembros_id_discord_reclutador',
+    'DROP INDEX IF EXISTS idx_miembros_reclutador_fecha',
+    'DROP INDEX IF EXISTS idx_miembros_id_discord_reclutador_fecha',
+    'CREATE INDEX IF NOT EXISTS idx_miembros_guild_etiqueta ON miembros (guild_id, etiqueta_miembro)',
+    'CREATE INDEX IF NOT EXISTS idx_miembros_guild_id_discord ON miembros (guild_id, id_discord_miembro)',
+    'CREATE INDEX IF NOT EXISTS idx_miembros_guild_reclutador_fecha ON miembros (guild_id, etiqueta_reclutador, fecha_registro, id)',
+    'CREATE INDEX IF NOT EXISTS idx_miembros_guild_id_discord_reclutador_fecha ON miembros (guild_id, id_discord_reclutador, fecha_registro, id)',
+]
+
+_TABLA_SERVIDORES = '''CREATE TABLE IF NOT EXISTS servidores (
+    guild_id BIGINT PRIMARY KEY,
+    rol_staff_id BIGINT,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)'''
+
+MIGRATIONS = [
+    (1, 'IDs de Discord e índices para las búsquedas frecuentes', [
+        'ALTER TABLE miembros ADD COLUMN IF NOT EXISTS id_discord_miembro BIGINT',
+        'ALTER TABLE miembros ADD COLUMN IF NOT EXISTS id_discord_reclutador BIGINT',
+        'ALTER TABLE reclutadores ADD COLUMN IF NOT EXISTS id_discord BIGINT',
+        'CREATE INDEX IF NOT EXISTS idx_miembros_etiqueta ON miembros (etiqueta_miembro)',
+        'CREATE INDEX IF NOT EXISTS idx_miembros_id_discord ON miembros (id_discord_miembro)',
+        'CREATE INDEX IF NOT EXISTS idx_miembros_reclutador ON miembros (etiqueta_reclutador)',
+        'CREATE INDEX IF NOT EXISTS idx_miembros_id_discord_reclutador ON miembros (id_discord_reclutador)',
+        'CREATE INDEX IF NOT EXISTS idx_reclutadores_id_discord ON reclutadores (id_discord)',
+        'CREATE INDEX IF NOT EXISTS idx_actividades_miembro_fecha ON actividades (id_miembro, fecha)',
+    ]),
+    (2, 'Borrado en cascada de actividades', {
+        'postgres': [
+            'ALTER TABLE actividades DROP CONSTRAINT IF EXISTS actividades_id_miembro_fkey',
+            '''ALTER TABLE actividades ADD CONSTRAINT actividades_id_miembro_fkey
+               FOREIGN KEY (id_miembro) REFERENCES miembros(id) ON DELETE CASCADE''',
+        ],
+        # SQLite no permite cambiar una foreign key: se reconstruye la tabla
+        'sqlite': [
+            '''CREATE TABLE actividades_nueva (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   id_miembro INTEGER,
+                   detalle TEXT NOT NULL,
+                   fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                   FOREIGN KEY(id_miembro) REFERENCES miembros(id) ON DELETE CASCADE
+               )''',
+            'INSERT INTO actividades_nueva (id, id_miembro, detalle, fecha) SELECT id, id_miembro, detalle, fecha FROM actividades',
+            'DROP TABLE actividades',
+            'ALTER TABLE actividades_nueva RENAME TO actividades',
+            'CREATE INDEX IF NOT EXISTS idx_actividades_miembro_fecha ON actividades (id_miembro, fecha)',
+        ],
+    }),
+    (3, 'Estadísticas incrementales de reclutadores', [
+        'ALTER TABLE reclutadores ADD COLUMN IF NOT EXISTS reclutados_activos INTEGER DEFAULT 0',
+        'ALTER TABLE reclutadores ADD COLUMN IF NOT EXISTS total_actividades INTEGER DEFAULT 0',
+        'ALTER TABLE reclutadores ADD COLUMN IF NOT EXISTS ultima_actividad TIMESTAMP',
+        '''UPDATE reclutadores AS r SET
+               reclutados_activos = s.reclutados_activos,
+               total_actividades = s.total_actividades,
+               ultima_actividad = s.ultima_actividad
+           FROM (
+               SELECT m.etiqueta_reclutador,
+                      COUNT(DISTINCT m.id) as reclutados_activos,
+                      COUNT(a.id) as total_actividades,
+                      MAX(a.fecha) as ultima_actividad
+               FROM miembros m
+               LEFT JOIN actividades a ON a.id_miembro = m.id
+               GROUP BY m.etiqueta_reclutador
+           ) s
+           WHERE r.etiqueta_reclutador = s.etiqueta_reclutador''',
+    ]),
+    (4, 'Índices para paginación por cursor', [
+        'CREATE INDEX IF NOT EXISTS idx_miembros_reclutador_fecha ON miembros (etiqueta_reclutador, fecha_registro, id)',
+        'CREATE INDEX IF NOT EXISTS idx_miembros_id_discord_reclutador_fecha ON miembros (id_discord_reclutador, fecha_registro, id)',
+        'CREATE INDEX IF NOT EXISTS idx_actividades_miembro_fecha_id ON actividades (id_miembro, fecha, id)',
+        'DROP INDEX IF EXISTS idx_actividades_miembro_fecha',
+    ]),
+    (5, 'Registro de escrituras diferidas ya aplicadas', [
+        '''CREATE TABLE IF NOT EXISTS escrituras_aplicadas (
+               id TEXT PRIMARY KEY,
+               fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+    ]),
+    (6, 'Versiones de los datos derivados', [
+        '''CREATE TABLE IF NOT EXISTS datos_version (
+               clave TEXT PRIMARY KEY,
+               version INTEGER NOT NULL,
+               fecha_aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+    ]),
+    # Los datos existentes quedan en guild_id = 0 hasta que asignar_datos_sin_servidor los reclame
+    (7, 'Datos separados por servidor y configuración de cada servidor', {
+        'postgres': [
+            'ALTER TABLE miembros ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0',
+            'ALTER TABLE reclutadores ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0',
+            'ALTER TABLE reclutadores DROP CONSTRAINT IF EXISTS reclutadores_etiqueta_reclutador_key',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_reclutadores_guild_etiqueta ON reclutadores (guild_id, etiqueta_reclutador)',
+            'DROP INDEX IF EXISTS idx_reclutadores_id_discord',
+            'CREATE INDEX IF NOT EXISTS idx_reclutadores_guild_id_discord ON reclutadores (guild_id, id_discord)',
+            *_INDICES_MIEMBROS_POR_SERVIDOR,
+            _TABLA_SERVIDORES,
+        ],
+        # SQLite no permite quitar el UNIQUE de etiqueta_reclutador: se reconstruye la tabla
+        'sqlite': [
+            'ALTER TABLE miembros ADD COLUMN guild_id BIGINT NOT NULL DEFAULT 0',
+            '''CREATE TABLE reclutadores_nueva (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   guild_id BIGINT NOT NULL DEFAULT 0,
+                   etiqueta_reclutador TEXT NOT NULL,
+                   id_discord BIGINT,
+                   ultimo_reclutamiento TIMESTAMP,
+                   total_reclutados INTEGER DEFAULT 0,
+                   fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                   reclutados_activos INTEGER DEFAULT 0,
+                   total_actividades INTEGER DEFAULT 0,
+                   ultima_actividad TIMESTAMP
+               )''',
+            '''INSERT INTO reclutadores_nueva (id, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados,
+                                             fecha_creacion, reclutados_activos, total_actividades, ultima_actividad)
+               SELECT id, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados,
+                      fecha_creacion, reclutados_activos, total_actividades, ultima_actividad
+               FROM reclutadores''',
+            'DROP TABLE reclutadores',
+            'ALTER TABLE reclutadores_nueva RENAME TO reclutadores',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_reclutadores_guild_etiqueta ON reclutadores (guild_id, etiqueta_reclutador)',
+            'CREATE INDEX IF NOT EXISTS idx_reclutadores_guild_id_discord ON reclutadores (guild_id, id_discord)',
+            *_INDICES_MIEMBROS_POR_SERVIDOR,
+            _TABLA_SERVIDORES,
+        ],
+    }),
+    # Una fila por servidor, período, inicio del período y reclutador; se mantiene en cada escritura
+    (8, 'Rankings de reclutadores por semana y por mes', [
+        '''CREATE TABLE IF NOT EXISTS ranking_reclutadores (
+               guild_id BIGINT NOT NULL,
+               periodo TEXT NOT NULL,
+               inicio DATE NOT NULL,
+               etiqueta_reclutador TEXT NOT NULL,
+               reclutados INTEGER NOT NULL DEFAULT 0,
+               retenidos INTEGER NOT NULL DEFAULT 0,
+               actividades INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (guild_id, periodo, inicio, etiqueta_reclutador)
+           )''',
+    ]),
+    # Actividades de cada miembro por día; se borran en cascada con el miembro
+    (9, 'Actividad diaria de cada miembro', [
+        '''CREATE TABLE IF NOT EXISTS actividad_diaria (
+               id_miembro INTEGER NOT NULL REFERENCES miembros(id) ON DELETE CASCADE,
+               dia DATE NOT NULL,
+               actividades INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (id_miembro, dia)
+           )''',
+    ]),
+    # Actividades de los reclutados de cada período (en cualquier fecha), para dividirlas por sus retenidos
+    (10, 'Actividades de los reclutados de cada período del ranking', [
+        'ALTER TABLE ranking_reclutadores ADD COLUMN IF NOT EXISTS actividades_reclutados INTEGER NOT NULL DEFAULT 0',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# Versión de la carga de reclutadores desde miembros; subirla hace que se recalcule en el próximo arranque
+RECLUTADORES_DATA_VERSION = 1
+# Versión de la carga de ranking_reclutadores desde miembros y actividades
+RANKING_DATA_VERSION = 2
+# Versión de la carga de actividad_diaria desde actividades
+ACTIVIDAD_DIARIA_DATA_VERSION = 1
+# Clave del advisory lock que serializa las migraciones entre procesos
+MIGRATION_LOCK_ID = 5_302_117
 
 def create_tables():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS miembros (
-            id SERIAL PRIMARY KEY,
-            etiqueta_miembro TEXT NOT NULL,
-            etiqueta_reclutador TEXT NOT NULL,
-            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS actividades (
-            id SERIAL PRIMARY KEY,
-            id_miembro INTEGER,
-            detalle TEXT NOT NULL,
-            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(id_miembro) REFERENCES miembros(id)
-        )
-    ''')
-    
-    # Nueva tabla para reclutadores
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reclutadores (
-            id SERIAL PRIMARY KEY,
-            etiqueta_reclutador TEXT UNIQUE NOT NULL,
-            ultimo_reclutamiento TIMESTAMP,
-            total_reclutados INTEGER DEFAULT 0,
-            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def add_miembro(etiqueta_miembro, etiqueta_reclutador):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    ddl = get_backend().ddl
+    with get_cursor(write=True) as cursor:
+        cursor.execute(ddl('''
+            CREATE TABLE IF NOT EXISTS miembros (
+                id SERIAL PRIMARY KEY,
+                etiqueta_miembro TEXT NOT NULL,
+                etiqueta_reclutador TEXT NOT NULL,
+                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+
+        cursor.execute(ddl('''
+            CREATE TABLE IF NOT EXISTS actividades (
+                id SERIAL PRIMARY KEY,
+                id_miembro INTEGER,
+                detalle TEXT NOT NULL,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(id_miembro) REFERENCES miembros(id)
+            )
+        '''))
+
+        # Nueva tabla para reclutadores
+        cursor.execute(ddl('''
+            CREATE TABLE IF NOT EXISTS reclutadores (
+                id SERIAL PRIMARY KEY,
+                etiqueta_reclutador TEXT UNIQUE NOT NULL,
+                ultimo_reclutamiento TIMESTAMP,
+                total_reclutados INTEGER DEFAULT 0,
+                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+
+        cursor.execute(ddl('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                descripcion TEXT,
+                fecha_aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+
+        apply_migrations(cursor)
+
+def schema_al_dia():
+    """True si la base ya tiene todas las migraciones aplicadas"""
+    try:
+        with get_cursor() as cursor:
+            return get_schema_version(cursor) >= SCHEMA_VERSION
+    except Exception:
+        # Base nueva sin schema_version; un error de conexión vuelve a aparecer en create_tables
+        return False
+
+def preparar_base_de_datos():
+    """Crea o migra el esquema y carga la tabla de reclutadores, omitiendo lo que ya esté al día.
+    Devuelve True si hizo algún trabajo"""
+    migrado = False
+    if schema_al_dia():
+        logger.info(f'Esquema en la versión {SCHEMA_VERSION}, se omite create_tables')
+    else:
+        create_tables()
+        migrado = True
+    # Solo recalculan si cambió la versión de sus datos (RECLUTADORES_DATA_VERSION, ...); si no, es una consulta cada una
+    recalculado = initialize_reclutadores_table()
+    recalculado = initialize_ranking_table() or recalculado
+    recalculado = initialize_actividad_diaria_table() or recalculado
+    return recalculado or migrado
+
+def get_schema_version(cursor):
+    cursor.execute('SELECT COALESCE(MAX(version), 0) as version FROM schema_version')
+    return cursor.fetchone()['version']
+
+def apply_migrations(cursor):
+    """Aplica las migraciones pendientes dentro de la transacción actual"""
+    backend = get_backend()
+    backend.lock_migrations(cursor, MIGRATION_LOCK_ID)
+    actual = get_schema_version(cursor)
+    for version, descripcion, sentencias in MIGRATIONS:
+        if version <= actual:
+            continue
+        logger.info(f'Aplicando migración {version}: {descripcion}')
+        if isinstance(sentencias, dict):
+            sentencias = sentencias[backend.dialect]
+        for sentencia in sentencias:
+            cursor.execute(backend.ddl(sentencia))
+        cursor.execute('INSERT INTO schema_version (version, descripcion) VALUES (%s, %s)', (version, descripcion))
+
+def _filtro_identidad(guild_id, columna_id, columna_etiqueta, discord_id, etiqueta):
+    """Condición del servidor y del usuario: por ID de Discord, cayendo a la etiqueta solo en filas antiguas sin ID"""
+    # guild_id de la misma tabla (o alias) que la columna del usuario
+    columna_guild = columna_id.rsplit('.', 1)[0] + '.guild_id' if '.' in columna_id else 'guild_id'
+    if discord_id is None:
+        return f'{columna_guild} = %s AND {columna_etiqueta} = %s', (guild_id, etiqueta)
+    # El servidor se repite en cada rama para que el OR use los índices (guild_id, id) en ambas
+    return (f'(({columna_guild} = %s AND {columna_id} = %s) OR '
+            f'({columna_guild} = %s AND {columna_id} IS NULL AND {columna_etiqueta} = %s))',
+            (guild_id, discord_id, guild_id, etiqueta))
+
+def _ident(guild_id, etiqueta, id_discord=None):
+    """Clave de caché de un usuario: su servidor y su ID de Discord si se conoce, si no la etiqueta"""
+    return guild_id, id_discord if id_discord is not None else etiqueta
+
+def _invalidar_reclutador(guild_id, etiqueta_reclutador, id_discord=None):
+    for namespace in ('reclutados_count', 'reclutador_stats'):
+        cache.invalidate(namespace, (guild_id, etiqueta_reclutador))
+        if id_discord is not None:
+            cache.invalidate(namespace, (guild_id, id_discord))
+    cache.invalidate('stats', guild_id)
+
+def _invalidar_miembro(guild_id, id_miembro, etiqueta_miembro, id_discord=None):
+    cache.invalidate('miembro', (guild_id, etiqueta_miembro))
+    if id_discord is not None:
+        cache.invalidate('miembro', (guild_id, id_discord))
+    if id_miembro is not None:
+        cache.invalidate('miembro_id', id_miembro)
+        cache.invalidate('actividades_count', id_miembro)
+
+def get_etiquetas_sin_id(guild_id):
+    """Obtiene las etiquetas de miembros y reclutadores del servidor que todavía no tienen ID de Discord"""
+    with get_cursor() as cursor:
+        cursor.execute('''
+            SELECT etiqueta_miembro as etiqueta FROM miembros WHERE guild_id = %s AND id_discord_miembro IS NULL
+            UNION
+            SELECT etiqueta_reclutador FROM miembros WHERE guild_id = %s AND id_discord_reclutador IS NULL
+            UNION
+            SELECT etiqueta_reclutador FROM reclutadores WHERE guild_id = %s AND id_discord IS NULL
+        ''', (guild_id, guild_id, guild_id))
+        return [row['etiqueta'] for row in cursor.fetchall()]
+
+def backfill_discord_ids(guild_id, ids_por_etiqueta):
+    """Completa los IDs de Discord faltantes del servidor a partir de un diccionario etiqueta -> ID"""
+    if not ids_por_etiqueta:
+        return 0
+    valores = list(ids_por_etiqueta.items())
+    actualizados = 0
+    with get_cursor(write=True) as cursor:
+        for tabla, columna_id, columna_etiqueta in (
+            ('miembros', 'id_discord_miembro', 'etiqueta_miembro'),
+            ('miembros', 'id_discord_reclutador', 'etiqueta_reclutador'),
+            ('reclutadores', 'id_discord', 'etiqueta_reclutador'),
+        ):
+            # Una sentencia preparada ejecutada por cada etiqueta; válida en ambos motores
+            cursor.executemany(f'''
+                UPDATE {tabla} SET {columna_id} = %s
+                WHERE guild_id = %s AND {columna_etiqueta} = %s AND {columna_id} IS NULL
+            ''', [(id_discord, guild_id, etiqueta) for etiqueta, id_discord in valores])
+            actualizados += cursor.rowcount
+    if actualizados:
+        cache.clear()
+    return actualizados
+
+def _insert_miembro(cursor, guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro=None, id_discord_reclutador=None, fecha=None):
     # Agregar el miembro
-    cursor.execute('INSERT INTO miembros (etiqueta_miembro, etiqueta_reclutador) VALUES (%s, %s)', (etiqueta_miembro, etiqueta_reclutador))
-    
-    # Actualizar o crear registro del reclutador
     cursor.execute('''
-        INSERT INTO reclutadores (etiqueta_reclutador, ultimo_reclutamiento, total_reclutados)
-        VALUES (%s, CURRENT_TIMESTAMP, 1)
-        ON CONFLICT(etiqueta_reclutador) DO UPDATE SET
-            ultimo_reclutamiento = CURRENT_TIMESTAMP,
-            total_reclutados = total_reclutados + 1
-    ''', (etiqueta_reclutador,))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def add_actividad(id_miembro, detalle):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO actividades (id_miembro, detalle) VALUES (%s, %s)', (id_miembro, detalle))
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def get_miembro_by_etiqueta(etiqueta):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, etiqueta_miembro, etiqueta_reclutador, fecha_registro FROM miembros WHERE etiqueta_miembro = %s', (etiqueta,))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return result
-
-def get_reclutados_by_reclutador(etiqueta_reclutador):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, etiqueta_miembro, fecha_registro FROM miembros WHERE etiqueta_reclutador = %s', (etiqueta_reclutador,))
-    result = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return result
-
-def get_actividades_by_miembro(id_miembro):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT detalle, fecha FROM actividades WHERE id_miembro = %s ORDER BY fecha', (id_miembro,))
-    result = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return result
+        INSERT INTO miembros (guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro, id_discord_reclutador, fecha_registro)
+        VALUES (%s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+        RETURNING fecha_registro
+    ''', (guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro, id_discord_reclutador, fecha))
+    fecha_registro = cursor.fetchone()['fecha_registro']
 
-def count_actividades_by_miembro(id_miembro):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) as count FROM actividades WHERE id_miembro = %s', (id_miembro,))
-    result = cursor.fetchone()
-    count = result['count'] if result else 0
-    cursor.close()
-    conn.close()
-    return count
-
-def delete_miembro(etiqueta_miembro):
-    """Elimina un miembro y todas sus actividades"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Primero obtener el ID del miembro
-    cursor.execute('SELECT id FROM miembros WHERE etiqueta_miembro = %s', (etiqueta_miembro,))
+    # Actualizar o crear registro del reclutador; una escritura reintentada con fecha anterior no
+    # hace retroceder el último reclutamiento
+    cursor.execute('''
+        INSERT INTO reclutadores (guild_id, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados, reclutados_activos)
+        VALUES (%s, %s, %s, %s, 1, 1)
+        ON CONFLICT(guild_id, etiqueta_reclutador) DO UPDATE SET
+            id_discord = COALESCE(EXCLUDED.id_discord, reclutadores.id_discord),
+            ultimo_reclutamiento = CASE
+                WHEN reclutadores.ultimo_reclutamiento IS NULL OR reclutadores.ultimo_reclutamiento < EXCLUDED.ultimo_reclutamiento
+                THEN EXCLUDED.ultimo_reclutamiento ELSE reclutadores.ultimo_reclutamiento END,
+            total_reclutados = reclutadores.total_reclutados + 1,
+            reclutados_activos = reclutadores.reclutados_activos + 1
+    ''', (guild_id, etiqueta_reclutador, id_discord_reclutador, fecha_registro))
+    _sumar_ranking(cursor, [(guild_id, etiqueta_reclutador, fecha_registro, 1, 1, 0, 0)])
+
+def add_miembro(guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro=None, id_discord_reclutador=None, fecha=None):
+    with get_cursor(write=True) as cursor:
+        _insert_miembro(cursor, guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro, id_discord_reclutador, fecha)
+
+    _invalidar_miembro(guild_id, None, etiqueta_miembro, id_discord_miembro)
+    _invalidar_reclutador(guild_id, etiqueta_reclutador, id_discord_reclutador)
+
+def _insert_actividad(cursor, id_miembro, detalle, fecha=None):
+    """Inserta una actividad y actualiza las estadísticas del reclutador; devuelve el reclutador del miembro"""
+    cursor.execute('INSERT INTO actividades (id_miembro, detalle, fecha) VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP)) RETURNING fecha',
+                   (id_miembro, detalle, fecha))
+    fecha = cursor.fetchone()['fecha']
+
+    cursor.execute('SELECT guild_id, etiqueta_reclutador, id_discord_reclutador, fecha_registro FROM miembros WHERE id = %s', (id_miembro,))
     miembro = cursor.fetchone()
-    
+
+    # Mantener las estadísticas del reclutador del miembro con la fecha de la actividad
     if miembro:
-        id_miembro = miembro['id']
-        # Eliminar actividades primero (por la foreign key)
-        cursor.execute('DELETE FROM actividades WHERE id_miembro = %s', (id_miembro,))
-        # Luego eliminar el miembro
-        cursor.execute('DELETE FROM miembros WHERE id = %s', (id_miembro,))
-        conn.commit()
-        deleted = True
+        cursor.execute(f'''
+            UPDATE reclutadores SET
+                total_actividades = total_actividades + 1,
+                ultima_actividad = {_ULTIMA_ACTIVIDAD}
+            WHERE guild_id = %s AND etiqueta_reclutador = %s
+        ''', (fecha, fecha, miembro['guild_id'], miembro['etiqueta_reclutador']))
+        # La actividad cuenta en su período y, para el promedio por reclutado, en el período de registro del miembro
+        _sumar_ranking(cursor, [(miembro['guild_id'], miembro['etiqueta_reclutador'], fecha, 0, 0, 1, 0),
+                                (miembro['guild_id'], miembro['etiqueta_reclutador'], miembro['fecha_registro'], 0, 0, 0, 1)])
+        _sumar_actividad_diaria(cursor, [(id_miembro, fecha, 1)])
+    return miembro
+
+# La última actividad solo avanza: las escrituras reintentadas pueden llegar con fechas anteriores
+_ULTIMA_ACTIVIDAD = 'CASE WHEN ultima_actividad IS NULL OR ultima_actividad < %s THEN %s ELSE ultima_actividad END'
+
+def add_actividad(id_miembro, detalle, fecha=None):
+    with get_cursor(write=True) as cursor:
+        miembro = _insert_actividad(cursor, id_miembro, detalle, fecha)
+
+    cache.invalidate('actividades_count', id_miembro)
+    if miembro:
+        _invalidar_reclutador(miembro['guild_id'], miembro['etiqueta_reclutador'], miembro['id_discord_reclutador'])
+
+def es_error_transitorio(error):
+    """Indica si un error de base de datos puede resolverse reintentando más tarde"""
+    if isinstance(error, (DatabaseBusyError, asyncio.TimeoutError)):
+        return True
+    return get_backend().is_transient(error)
+
+def apply_escrituras(escrituras):
+    """Aplica en una sola transacción un lote de escrituras diferidas de la cola.
+    Cada escritura es {'id', 'tipo': 'miembro' | 'actividad', 'datos': {'guild_id', ...}}; las que ya
+    se aplicaron (según escrituras_aplicadas) se omiten para que reintentar sea seguro.
+    Devuelve la cantidad aplicada y lanza ValueError si una actividad no tiene miembro"""
+    if not escrituras:
+        return 0
+    ids = [e['id'] for e in escrituras]
+    invalidar_miembros = []
+    invalidar_reclutadores = set()
+    aplicadas = 0
+    with get_cursor(write=True) as cursor:
+        cursor.execute(f'SELECT id FROM escrituras_aplicadas WHERE id IN ({_placeholders(ids)})', ids)
+        ya_aplicadas = {fila['id'] for fila in cursor.fetchall()}
+
+        for escritura in escrituras:
+            if escritura['id'] in ya_aplicadas:
+                continue
+            datos = escritura['datos']
+            # Escrituras guardadas antes de separar los datos por servidor
+            guild_id = datos.get('guild_id', 0)
+            if escritura['tipo'] == 'miembro':
+                _insert_miembro(cursor, guild_id, datos['etiqueta_miembro'], datos['etiqueta_reclutador'],
+                                datos.get('id_discord_miembro'), datos.get('id_discord_reclutador'), datos.get('fecha'))
+                invalidar_miembros.append((guild_id, None, datos['etiqueta_miembro'], datos.get('id_discord_miembro')))
+                invalidar_reclutadores.add((guild_id, datos['etiqueta_reclutador'], datos.get('id_discord_reclutador')))
+            elif escritura['tipo'] == 'actividad':
+                # El miembro se resuelve al aplicar porque puede venir en el mismo lote
+                filtro, params = _filtro_identidad(guild_id, 'id_discord_miembro', 'etiqueta_miembro',
+                                                   datos.get('id_discord_miembro'), datos['etiqueta_miembro'])
+                cursor.execute(f'SELECT id FROM miembros WHERE {filtro} ORDER BY id LIMIT 1', params)
+                fila = cursor.fetchone()
+                if fila is None:
+                    raise ValueError(f"Miembro {datos['etiqueta_miembro']} no encontrado para la actividad")
+                miembro = _insert_actividad(cursor, fila['id'], datos['detalle'], datos.get('fecha'))
+                invalidar_miembros.append((guild_id, fila['id'], datos['etiqueta_miembro'], datos.get('id_discord_miembro')))
+                if miembro:
+                    invalidar_reclutadores.add((guild_id, miembro['etiqueta_reclutador'], miembro['id_discord_reclutador']))
+            else:
+                raise ValueError(f"Tipo de escritura desconocido: {escritura['tipo']}")
+            cursor.execute('INSERT INTO escrituras_aplicadas (id) VALUES (%s)', (escritura['id'],))
+            aplicadas += 1
+
+    for guild_id, id_miembro, etiqueta, id_discord in invalidar_miembros:
+        _invalidar_miembro(guild_id, id_miembro, etiqueta, id_discord)
+    for guild_id, etiqueta, id_discord in invalidar_reclutadores:
+        _invalidar_reclutador(guild_id, etiqueta, id_discord)
+    return aplicadas
+
+def purge_escrituras_aplicadas(dias=7):
+    """Elimina el registro de escrituras aplicadas más antiguas que dias"""
+    with get_cursor(write=True) as cursor:
+        # fecha es CURRENT_TIMESTAMP, en UTC
+        limite = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=dias)
+        cursor.execute('DELETE FROM escrituras_aplicadas WHERE fecha < %s', (limite,))
+        return cursor.rowcount
+
+def add_actividades_bulk(guild_id, miembros, detalle):
+    """Registra la misma actividad para varios miembros del servidor en una sola transacción.
+    Recibe pares (etiqueta, id_discord) y devuelve (etiquetas registradas, etiquetas no encontradas)"""
+    miembros = list(miembros)
+    if not miembros:
+        return [], []
+    etiquetas = [etiqueta for etiqueta, _ in miembros]
+    ids_discord = [id_discord for _, id_discord in miembros if id_discord is not None]
+
+    with get_cursor(write=True) as cursor:
+        # Resolver todos los miembros en una sola consulta
+        condiciones = [f'(id_discord_miembro IS NULL AND etiqueta_miembro IN ({_placeholders(etiquetas)}))']
+        params = list(etiquetas)
+        if ids_discord:
+            condiciones.append(f'id_discord_miembro IN ({_placeholders(ids_discord)})')
+            params.extend(ids_discord)
+        cursor.execute(f'''
+            SELECT id, etiqueta_miembro, id_discord_miembro, etiqueta_reclutador, id_discord_reclutador, fecha_registro
+            FROM miembros
+            WHERE guild_id = %s AND ({' OR '.join(condiciones)})
+            ORDER BY id
+        ''', [guild_id] + params)
+
+        por_id = {}
+        por_etiqueta = {}
+        for fila in cursor.fetchall():
+            if fila['id_discord_miembro'] is not None:
+                por_id.setdefault(fila['id_discord_miembro'], fila)
+            por_etiqueta.setdefault(fila['etiqueta_miembro'], fila)
+
+        encontrados = {}
+        no_encontrados = []
+        for etiqueta, id_discord in miembros:
+            fila = por_id.get(id_discord) if id_discord is not None else None
+            fila = fila or por_etiqueta.get(etiqueta)
+            if fila is None:
+                no_encontrados.append(etiqueta)
+            else:
+                encontrados[fila['id']] = fila
+
+        if encontrados:
+            # Una sola fecha para todo el lote, la misma que usan el ranking y la actividad diaria
+            ahora = _ahora(cursor)
+            get_backend().execute_values(cursor, 'INSERT INTO actividades (id_miembro, detalle, fecha) VALUES %s',
+                                         [(id_miembro, detalle, ahora) for id_miembro in encontrados])
+
+            # Mantener las estadísticas de cada reclutador afectado
+            por_reclutador = {}
+            for fila in encontrados.values():
+                por_reclutador[fila['etiqueta_reclutador']] = por_reclutador.get(fila['etiqueta_reclutador'], 0) + 1
+            cursor.executemany(f'''
+                UPDATE reclutadores SET
+                    total_actividades = total_actividades + %s,
+                    ultima_actividad = {_ULTIMA_ACTIVIDAD}
+                WHERE guild_id = %s AND etiqueta_reclutador = %s
+            ''', [(cantidad, ahora, ahora, guild_id, etiqueta) for etiqueta, cantidad in por_reclutador.items()])
+            _sumar_ranking(cursor, [(guild_id, etiqueta, ahora, 0, 0, cantidad, 0) for etiqueta, cantidad in por_reclutador.items()]
+                           + [(guild_id, f['etiqueta_reclutador'], f['fecha_registro'], 0, 0, 0, 1) for f in encontrados.values()])
+            _sumar_actividad_diaria(cursor, [(id_miembro, ahora, 1) for id_miembro in encontrados])
+
+    for id_miembro in encontrados:
+        cache.invalidate('actividades_count', id_miembro)
+    for etiqueta, id_discord in {(f['etiqueta_reclutador'], f['id_discord_reclutador']) for f in encontrados.values()}:
+        _invalidar_reclutador(guild_id, etiqueta, id_discord)
+
+    return [fila['etiqueta_miembro'] for fila in encontrados.values()], no_encontrados
+
+# Consultas frecuentes de los comandos: cada una se prepara una sola vez por conexión
+# y se reutiliza su plan. Con DB_PREPARED_STATEMENTS=0 se envían como texto (útil para comparar)
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+_STATS_COLUMNS = '''
+    etiqueta_reclutador,
+    id_discord,
+    reclutados_activos,
+    total_reclutados as total_historico,
+    ultimo_reclutamiento,
+    fecha_creacion,
+    total_actividades,
+    ultima_actividad
+'''
+
+_RECLUTADOS_PAGE = '''
+    SELECT
+        p.id,
+        p.etiqueta_miembro,
+        p.id_discord_miembro,
+        p.fecha_registro,
+        COUNT(a.id) as actividades,
+        MAX(a.fecha) as ultima_actividad
+    FROM (
+        SELECT m.id, m.etiqueta_miembro, m.id_discord_miembro, m.fecha_registro
+        FROM miembros m
+        WHERE {filtro}
+        ORDER BY m.fecha_registro, m.id
+        LIMIT %s
+    ) p
+    LEFT JOIN actividades a ON a.id_miembro = p.id
+    GROUP BY p.id, p.etiqueta_miembro, p.id_discord_miembro, p.fecha_registro
+    ORDER BY p.fecha_registro, p.id
+'''
+
+QUERIES = {
+    'miembro_id': 'SELECT id, guild_id, etiqueta_miembro, etiqueta_reclutador, fecha_registro FROM miembros WHERE id = %s',
+    'actividades_count': 'SELECT COUNT(*) as count FROM actividades WHERE id_miembro = %s',
+    'actividades_pagina': 'SELECT id, detalle, fecha FROM actividades WHERE id_miembro = %s ORDER BY fecha, id LIMIT %s',
+    'actividades_pagina_siguiente': '''
+        SELECT id, detalle, fecha FROM actividades
+        WHERE id_miembro = %s AND (fecha, id) > (%s, %s)
+        ORDER BY fecha, id LIMIT %s
+    ''',
+    'reclutadores_stats': f'SELECT {_STATS_COLUMNS} FROM reclutadores WHERE guild_id = %s ORDER BY etiqueta_reclutador',
+}
+
+def _registrar_por_identidad(nombre, plantilla, columna_id, columna_etiqueta):
+    """Registra las dos variantes de una consulta filtrada por usuario: por etiqueta y por ID de Discord"""
+    QUERIES[f'{nombre}_etiqueta'] = plantilla.format(filtro=_filtro_identidad(0, columna_id, columna_etiqueta, None, None)[0])
+    QUERIES[f'{nombre}_id_discord'] = plantilla.format(filtro=_filtro_identidad(0, columna_id, columna_etiqueta, 0, None)[0])
+
+def _nombre_identidad(nombre, id_discord):
+    return f'{nombre}_etiqueta' if id_discord is None else f'{nombre}_id_discord'
+
+_registrar_por_identidad('miembro', 'SELECT id, guild_id, etiqueta_miembro, etiqueta_reclutador, fecha_registro FROM miembros WHERE {filtro}',
+                         'id_discord_miembro', 'etiqueta_miembro')
+_registrar_por_identidad('reclutados_count', 'SELECT COUNT(*) as count FROM miembros WHERE {filtro}',
+                         'id_discord_reclutador', 'etiqueta_reclutador')
+_registrar_por_identidad('reclutados_pagina', _RECLUTADOS_PAGE, 'm.id_discord_reclutador', 'm.etiqueta_reclutador')
+_registrar_por_identidad('reclutados_pagina_siguiente',
+                         _RECLUTADOS_PAGE.replace('{filtro}', '{filtro} AND (m.fecha_registro, m.id) > (%s, %s)'),
+                         'm.id_discord_reclutador', 'm.etiqueta_reclutador')
+_registrar_por_identidad('reclutador_stats', f'SELECT {_STATS_COLUMNS} FROM reclutadores WHERE {{filtro}}',
+                         'id_discord', 'etiqueta_reclutador')
+
+def _execute(cursor, nombre, params=()):
+    """Ejecuta una consulta del registro, preparada si DB_PREPARED_STATEMENTS está activo"""
+    if DB_PREPARED_STATEMENTS:
+        get_backend().execute_prepared(cursor, nombre, QUERIES[nombre], tuple(params))
     else:
-        deleted = False
-    
-    cursor.close()
-    conn.close()
-    return deleted
+        cursor.execute(QUERIES[nombre], tuple(params))
+
+@cache.cached('miembro', key=_ident)
+def get_miembro_by_etiqueta(guild_id, etiqueta, id_discord=None):
+    _, params = _filtro_identidad(guild_id, 'id_discord_miembro', 'etiqueta_miembro', id_discord, etiqueta)
+    with get_cursor() as cursor:
+        _execute(cursor, _nombre_identidad('miembro', id_discord), params)
+        return cursor.fetchone()
+
+@cache.cached('miembro_id', key=lambda id_miembro: id_miembro)
+def get_miembro_by_id(id_miembro):
+    with get_cursor() as cursor:
+        _execute(cursor, 'miembro_id', (id_miembro,))
+        return cursor.fetchone()
+
+@cache.cached('reclutados_count', key=_ident)
+def count_reclutados(guild_id, etiqueta_reclutador, id_discord=None):
+    _, params = _filtro_identidad(guild_id, 'id_discord_reclutador', 'etiqueta_reclutador', id_discord, etiqueta_reclutador)
+    with get_cursor() as cursor:
+        _execute(cursor, _nombre_identidad('reclutados_count', id_discord), params)
+        return cursor.fetchone()['count']
+
+def get_reclutados_page(guild_id, etiqueta_reclutador, id_discord=None, despues=None, limite=15):
+    """Obtiene una página de reclutados con sus actividades, ordenada por (fecha_registro, id).
+    despues es la clave (fecha_registro, id) de la última fila de la página anterior"""
+    _, params = _filtro_identidad(guild_id, 'm.id_discord_reclutador', 'm.etiqueta_reclutador', id_discord, etiqueta_reclutador)
+    nombre = 'reclutados_pagina'
+    if despues is not None:
+        nombre = 'reclutados_pagina_siguiente'
+        params = params + tuple(despues)
+    with get_cursor() as cursor:
+        # Primero se limita la página y después se cuentan solo sus actividades
+        _execute(cursor, _nombre_identidad(nombre, id_discord), params + (limite,))
+        return cursor.fetchall()
+
+def get_actividades_page(id_miembro, despues=None, limite=15):
+    """Obtiene una página de actividades de un miembro ordenada por (fecha, id)"""
+    with get_cursor() as cursor:
+        if despues is None:
+            _execute(cursor, 'actividades_pagina', (id_miembro, limite))
+        else:
+            _execute(cursor, 'actividades_pagina_siguiente', (id_miembro, *despues, limite))
+        return cursor.fetchall()
+
+@cache.cached('actividades_count', key=lambda id_miembro: id_miembro)
+def count_actividades_by_miembro(id_miembro):
+    with get_cursor() as cursor:
+        _execute(cursor, 'actividades_count', (id_miembro,))
+        result = cursor.fetchone()
+        return result['count'] if result else 0
+
+def _placeholders(valores):
+    return ', '.join(['%s'] * len(valores))
+
+def _delete_miembros_where(cursor, filtro, params):
+    """Elimina los miembros que cumplen el filtro y descuenta sus reclutados y actividades
+    de las estadísticas de cada reclutador. Devuelve las filas de los miembros eliminados"""
+    cursor.execute(f'''
+        SELECT m.id, m.guild_id, m.etiqueta_miembro, m.id_discord_miembro, m.etiqueta_reclutador, m.id_discord_reclutador,
+               m.fecha_registro, COUNT(a.id) as actividades
+        FROM miembros m
+        LEFT JOIN actividades a ON a.id_miembro = m.id
+        WHERE {filtro}
+        GROUP BY m.id, m.guild_id, m.etiqueta_miembro, m.id_discord_miembro, m.etiqueta_reclutador, m.id_discord_reclutador,
+                 m.fecha_registro
+    ''', params)
+    eliminados = cursor.fetchall()
+    if not eliminados:
+        return []
+
+    # El ranking descuenta cada reclutado (con sus actividades) de su período de registro y cada actividad del suyo
+    descuentos_ranking = [(f['guild_id'], f['etiqueta_reclutador'], f['fecha_registro'], 0, 1, 0, f['actividades']) for f in eliminados]
+    if any(fila['actividades'] for fila in eliminados):
+        cursor.execute(f'''
+            SELECT m.guild_id, m.etiqueta_reclutador, DATE(a.fecha) AS dia, COUNT(*) AS actividades
+            FROM miembros m
+            JOIN actividades a ON a.id_miembro = m.id
+            WHERE {filtro}
+            GROUP BY m.guild_id, m.etiqueta_reclutador, DATE(a.fecha)
+        ''', params)
+        descuentos_ranking.extend((f['guild_id'], f['etiqueta_reclutador'], f['dia'], 0, 0, f['actividades'], 0)
+                                  for f in cursor.fetchall())
 
-def clear_reclutador(etiqueta_reclutador):
+    # Las actividades se eliminan en cascada por la foreign key
+    cursor.execute(f'DELETE FROM miembros WHERE id IN (SELECT m.id FROM miembros m WHERE {filtro})', params)
+
+    descuentos = {}
+    for fila in eliminados:
+        clave = (fila['guild_id'], fila['etiqueta_reclutador'])
+        reclutados, actividades = descuentos.get(clave, (0, 0))
+        descuentos[clave] = (reclutados + 1, actividades + fila['actividades'])
+    cursor.executemany('''
+        UPDATE reclutadores SET
+            reclutados_activos = CASE WHEN reclutados_activos > %s THEN reclutados_activos - %s ELSE 0 END,
+            total_actividades = CASE WHEN total_actividades > %s THEN total_actividades - %s ELSE 0 END
+        WHERE guild_id = %s AND etiqueta_reclutador = %s
+    ''', [(reclutados, reclutados, actividades, actividades, guild_id, etiqueta)
+          for (guild_id, etiqueta), (reclutados, actividades) in descuentos.items()])
+    _descontar_ranking(cursor, descuentos_ranking)
+    return eliminados
+
+def _invalidar_eliminados(eliminados):
+    for fila in eliminados:
+        _invalidar_miembro(fila['guild_id'], fila['id'], fila['etiqueta_miembro'], fila['id_discord_miembro'])
+    for guild_id, etiqueta, id_discord in {(f['guild_id'], f['etiqueta_reclutador'], f['id_discord_reclutador']) for f in eliminados}:
+        _invalidar_reclutador(guild_id, etiqueta, id_discord)
+
+def delete_miembro(guild_id, etiqueta_miembro, id_discord=None):
+    """Elimina un miembro del servidor y todas sus actividades"""
+    filtro, params = _filtro_identidad(guild_id, 'id_discord_miembro', 'etiqueta_miembro', id_discord, etiqueta_miembro)
+    with get_cursor(write=True) as cursor:
+        cursor.execute(f'SELECT id FROM miembros WHERE {filtro} LIMIT 1', params)
+        miembro = cursor.fetchone()
+        if not miembro:
+            return False
+        eliminados = _delete_miembros_where(cursor, 'm.id = %s', (miembro['id'],))
+    _invalidar_eliminados(eliminados)
+    return len(eliminados) > 0
+
+def delete_miembros(ids_miembro):
+    """Elimina varios miembros (por ID interno) y sus actividades en una sola transacción, devuelve cuántos se eliminaron"""
+    ids_miembro = list(ids_miembro)
+    if not ids_miembro:
+        return 0
+    with get_cursor(write=True) as cursor:
+        eliminados = _delete_miembros_where(cursor, f'm.id IN ({_placeholders(ids_miembro)})', ids_miembro)
+    _invalidar_eliminados(eliminados)
+    return len(eliminados)
+
+def clear_reclutadores(guild_id, reclutadores):
+    """Elimina los reclutados de varios reclutadores del servidor en una sola transacción.
+    Recibe pares (etiqueta, id_discord) y devuelve {etiqueta: reclutados eliminados}"""
+    reclutadores = list(reclutadores)
+    conteos = {}
+    eliminados = []
+    with get_cursor(write=True) as cursor:
+        for etiqueta_reclutador, id_discord in reclutadores:
+            filtro, params = _filtro_identidad(guild_id, 'm.id_discord_reclutador', 'm.etiqueta_reclutador', id_discord, etiqueta_reclutador)
+            # Un único DELETE por reclutador; las actividades caen en cascada
+            filas = _delete_miembros_where(cursor, filtro, params)
+            # El mismo reclutador puede venir por ID y por etiqueta: se suman, no se pisan
+            conteos[etiqueta_reclutador] = conteos.get(etiqueta_reclutador, 0) + len(filas)
+            eliminados.extend(filas)
+
+            # Resetear el conteo de reclutados activos del reclutador (mantener el registro y última fecha)
+            cursor.execute('''
+                UPDATE reclutadores 
+                SET total_reclutados = 0, reclutados_activos = 0, total_actividades = 0
+                WHERE guild_id = %s AND etiqueta_reclutador = %s
+            ''', (guild_id, etiqueta_reclutador))
+            cursor.execute('DELETE FROM ranking_reclutadores WHERE guild_id = %s AND etiqueta_reclutador = %s',
+                           (guild_id, etiqueta_reclutador))
+    _invalidar_eliminados(eliminados)
+    for etiqueta_reclutador, id_discord in reclutadores:
+        _invalidar_reclutador(guild_id, etiqueta_reclutador, id_discord)
+    return conteos
+
+def clear_reclutador(guild_id, etiqueta_reclutador, id_discord=None):
     """Elimina todos los reclutados de un reclutador y sus actividades, pero mantiene el registro del reclutador"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Obtener todos los IDs de miembros del reclutador
-    cursor.execute('SELECT id FROM miembros WHERE etiqueta_reclutador = %s', (etiqueta_reclutador,))
-    miembros = cursor.fetchall()
-    
-    deleted_count = 0
-    for miembro in miembros:
-        id_miembro = miembro['id']
-        # Eliminar actividades
-        cursor.execute('DELETE FROM actividades WHERE id_miembro = %s', (id_miembro,))
-        # Eliminar miembro
-        cursor.execute('DELETE FROM miembros WHERE id = %s', (id_miembro,))
-        deleted_count += 1
-    
-    # Resetear el conteo de reclutados activos del reclutador (mantener el registro y última fecha)
-    cursor.execute('''
-        UPDATE reclutadores 
-        SET total_reclutados = 0 
-        WHERE etiqueta_reclutador = %s
-    ''', (etiqueta_reclutador,))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return deleted_count
-
-def get_reclutadores_with_count():
-    """Obtiene una lista de reclutadores únicos con el conteo de sus reclutados activos"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT etiqueta_reclutador, COUNT(*) as reclutados_activos
-        FROM miembros 
-        GROUP BY etiqueta_reclutador
-        ORDER BY etiqueta_reclutador
-    ''')
-    
-    reclutadores = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return reclutadores
-
-def get_all_reclutadores_with_count():
-    """Obtiene TODOS los reclutadores con su conteo actual de reclutados activos"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Obtener todos los reclutadores únicos con su conteo actual
-    cursor.execute('''
-        SELECT r.etiqueta_reclutador, COUNT(m.id) as reclutados_activos
-        FROM reclutadores r
-        LEFT JOIN miembros m ON r.etiqueta_reclutador = m.etiqueta_reclutador
-        GROUP BY r.etiqueta_reclutador
-        ORDER BY r.etiqueta_reclutador
-    ''')
-    
-    reclutadores = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return reclutadores
-
-def get_reclutadores_last_activity():
-    """Obtiene la última fecha de actividad para cada reclutador desde la tabla reclutadores"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT etiqueta_reclutador, ultimo_reclutamiento
-        FROM reclutadores
-        WHERE ultimo_reclutamiento IS NOT NULL
-        ORDER BY etiqueta_reclutador
-    ''')
-    
-    actividades = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return actividades
-
-def get_reclutadores_stats():
-    """Obtiene estadísticas completas de los reclutadores"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            r.etiqueta_reclutador,
-            COUNT(m.id) as reclutados_activos,
-            r.total_reclutados as total_historico,
-            r.ultimo_reclutamiento,
-            r.fecha_creacion
-        FROM reclutadores r
-        LEFT JOIN miembros m ON r.etiqueta_reclutador = m.etiqueta_reclutador
-        GROUP BY r.etiqueta_reclutador, r.total_reclutados, r.ultimo_reclutamiento, r.fecha_creacion
-        ORDER BY r.etiqueta_reclutador
-    ''')
-    
-    stats = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return stats
+    return clear_reclutadores(guild_id, [(etiqueta_reclutador, id_discord)])[etiqueta_reclutador]
+
+@cache.cached('stats', key=lambda guild_id: guild_id)
+def get_reclutadores_stats(guild_id):
+    """Obtiene estadísticas completas de los reclutadores del servidor (mantenidas en la tabla reclutadores)"""
+    with get_cursor() as cursor:
+        _execute(cursor, 'reclutadores_stats', (guild_id,))
+        return cursor.fetchall()
+
+@cache.cached('reclutador_stats', key=_ident)
+def get_reclutador_stats(guild_id, etiqueta_reclutador, id_discord=None):
+    """Obtiene las estadísticas de un único reclutador"""
+    _, params = _filtro_identidad(guild_id, 'id_discord', 'etiqueta_reclutador', id_discord, etiqueta_reclutador)
+    with get_cursor() as cursor:
+        _execute(cursor, _nombre_identidad('reclutador_stats', id_discord), params)
+        return cursor.fetchone()
+
+def initialize_reclutadores_table(forzar=False):
+    """Inicializa la tabla de reclutadores con datos existentes de la tabla miembros.
+    Solo se ejecuta si datos_version no está en RECLUTADORES_DATA_VERSION (o con forzar=True);
+    devuelve True si recalculó la tabla"""
+    with get_cursor(write=True) as cursor:
+        # Mismo lock que las migraciones: un solo proceso hace la carga
+        get_backend().lock_migrations(cursor, MIGRATION_LOCK_ID)
+        if _version_datos(cursor, 'reclutadores') >= RECLUTADORES_DATA_VERSION and not forzar:
+            return False
 
-def initialize_reclutadores_table():
-    """Inicializa la tabla de reclutadores con datos existentes de la tabla miembros"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Obtener todos los reclutadores existentes con sus estadísticas
+        # Una sola sentencia: agregado por reclutador e inserción o actualización de cada uno.
+        # WHERE true evita que SQLite lea ON CONFLICT como condición de un JOIN
+        cursor.execute('''
+            INSERT INTO reclutadores (guild_id, etiqueta_reclutador, ultimo_reclutamiento, total_reclutados, fecha_creacion, reclutados_activos)
+            SELECT
+                guild_id,
+                etiqueta_reclutador,
+                MAX(fecha_registro),
+                COUNT(*),
+                MIN(fecha_registro),
+                COUNT(*)
+            FROM miembros
+            WHERE true
+            GROUP BY guild_id, etiqueta_reclutador
+            ON CONFLICT(guild_id, etiqueta_reclutador) DO UPDATE SET
+                reclutados_activos = EXCLUDED.reclutados_activos,
+                ultimo_reclutamiento = CASE
+                    WHEN reclutadores.ultimo_reclutamiento IS NULL OR reclutadores.ultimo_reclutamiento < EXCLUDED.ultimo_reclutamiento
+                    THEN EXCLUDED.ultimo_reclutamiento ELSE reclutadores.ultimo_reclutamiento END,
+                total_reclutados = CASE
+                    WHEN reclutadores.total_reclutados < EXCLUDED.total_reclutados
+                    THEN EXCLUDED.total_reclutados ELSE reclutadores.total_reclutados END
+        ''')
+        logger.info(f'Tabla de reclutadores recalculada ({cursor.rowcount} reclutadores)')
+        _marcar_version_datos(cursor, 'reclutadores', RECLUTADORES_DATA_VERSION)
+
+    cache.clear()
+    return True
+
+def _version_datos(cursor, clave):
+    cursor.execute('SELECT version FROM datos_version WHERE clave = %s', (clave,))
+    fila = cursor.fetchone()
+    return fila['version'] if fila else 0
+
+def _marcar_version_datos(cursor, clave, version):
     cursor.execute('''
-        SELECT 
-            etiqueta_reclutador,
-            COUNT(*) as total_reclutados,
-            MAX(fecha_registro) as ultimo_reclutamiento,
-            MIN(fecha_registro) as fecha_creacion
-        FROM miembros
-        GROUP BY etiqueta_reclutador
-    ''')
-    
-    reclutadores_existentes = cursor.fetchall()
-    
-    # Insertar o actualizar cada reclutador
-    for reclutador in reclutadores_existentes:
-        etiqueta = reclutador['etiqueta_reclutador']
-        total = reclutador['total_reclutados']
-        ultimo = reclutador['ultimo_reclutamiento']
-        creacion = reclutador['fecha_creacion']
+        INSERT INTO datos_version (clave, version) VALUES (%s, %s)
+        ON CONFLICT(clave) DO UPDATE SET version = EXCLUDED.version, fecha_aplicada = CURRENT_TIMESTAMP
+    ''', (clave, version))
+
+# Períodos del ranking: las semanas empiezan el lunes y los meses el día 1
+PERIODOS = ('semana', 'mes')
+
+def _dia(fecha):
+    """Convierte una fecha de la base (datetime, date o texto ISO de SQLite) en date"""
+    if isinstance(fecha, datetime):
+        return fecha.date()
+    if isinstance(fecha, date):
+        return fecha
+    return date.fromisoformat(str(fecha)[:10])
+
+def _ahora(cursor):
+    """Fecha y hora según el reloj de la base (en UTC, como todas las fechas guardadas)"""
+    cursor.execute('SELECT CURRENT_TIMESTAMP AS ahora')
+    return cursor.fetchone()['ahora']
+
+def inicio_periodo(periodo, fecha):
+    """Devuelve el primer día de la semana o del mes que contiene fecha"""
+    dia = _dia(fecha)
+    if periodo == 'semana':
+        return dia - timedelta(days=dia.weekday())
+    if periodo == 'mes':
+        return dia.replace(day=1)
+    raise ValueError(f'Período desconocido: {periodo}')
+
+def retroceder_periodo(periodo, inicio, cantidad):
+    """Devuelve el inicio del período que está cantidad períodos antes del que empieza en inicio"""
+    if periodo == 'semana':
+        return inicio - timedelta(weeks=cantidad)
+    meses = inicio.year * 12 + inicio.month - 1 - cantidad
+    return date(meses // 12, meses % 12 + 1, 1)
+
+def _ranking_por_periodo(filas):
+    """Acumula filas (guild_id, etiqueta_reclutador, fecha, reclutados, retenidos, actividades,
+    actividades_reclutados) en la fila de cada período que contiene la fecha"""
+    acumulado = {}
+    for guild_id, etiqueta, fecha, *valores in filas:
+        if fecha is None:
+            continue
+        for periodo in PERIODOS:
+            clave = (guild_id, periodo, inicio_periodo(periodo, fecha).isoformat(), etiqueta)
+            previo = acumulado.get(clave, (0, 0, 0, 0))
+            acumulado[clave] = tuple(a + b for a, b in zip(previo, valores))
+    return acumulado
+
+def _sumar_ranking(cursor, filas):
+    acumulado = _ranking_por_periodo(filas)
+    if not acumulado:
+        return
+    cursor.executemany('''
+        INSERT INTO ranking_reclutadores (guild_id, periodo, inicio, etiqueta_reclutador, reclutados, retenidos, actividades,
+                                          actividades_reclutados)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT(guild_id, periodo, inicio, etiqueta_reclutador) DO UPDATE SET
+            reclutados = ranking_reclutadores.reclutados + EXCLUDED.reclutados,
+            retenidos = ranking_reclutadores.retenidos + EXCLUDED.retenidos,
+            actividades = ranking_reclutadores.actividades + EXCLUDED.actividades,
+            actividades_reclutados = ranking_reclutadores.actividades_reclutados + EXCLUDED.actividades_reclutados
+    ''', [clave + valores for clave, valores in acumulado.items()])
+
+def _descontar_ranking(cursor, filas):
+    acumulado = _ranking_por_periodo(filas)
+    if not acumulado:
+        return
+    cursor.executemany('''
+        UPDATE ranking_reclutadores SET
+            reclutados = CASE WHEN reclutados > %s THEN reclutados - %s ELSE 0 END,
+            retenidos = CASE WHEN retenidos > %s THEN retenidos - %s ELSE 0 END,
+            actividades = CASE WHEN actividades > %s THEN actividades - %s ELSE 0 END,
+            actividades_reclutados = CASE WHEN actividades_reclutados > %s THEN actividades_reclutados - %s ELSE 0 END
+        WHERE guild_id = %s AND periodo = %s AND inicio = %s AND etiqueta_reclutador = %s
+    ''', [(reclutados, reclutados, retenidos, retenidos, actividades, actividades, de_reclutados, de_reclutados) + clave
+          for clave, (reclutados, retenidos, actividades, de_reclutados) in acumulado.items()])
+
+def initialize_ranking_table(forzar=False):
+    """Recalcula ranking_reclutadores desde miembros y actividades si datos_version no está en
+    RANKING_DATA_VERSION (o con forzar=True); devuelve True si la recalculó.
+    Los reclutados que ya no están en la base no se pueden recuperar: su período cuenta solo los retenidos"""
+    with get_cursor(write=True) as cursor:
+        get_backend().lock_migrations(cursor, MIGRATION_LOCK_ID)
+        if _version_datos(cursor, 'ranking') >= RANKING_DATA_VERSION and not forzar:
+            return False
+
+        cursor.execute('DELETE FROM ranking_reclutadores')
+        # Agregados por día en la base; el paso a semanas y meses se hace acá
+        cursor.execute('''
+            SELECT guild_id, etiqueta_reclutador, DATE(fecha_registro) AS dia, COUNT(*) AS cantidad
+            FROM miembros
+            GROUP BY guild_id, etiqueta_reclutador, DATE(fecha_registro)
+        ''')
+        filas = [(f['guild_id'], f['etiqueta_reclutador'], f['dia'], f['cantidad'], f['cantidad'], 0, 0) for f in cursor.fetchall()]
+        cursor.execute('''
+            SELECT m.guild_id, m.etiqueta_reclutador, DATE(a.fecha) AS dia, COUNT(*) AS cantidad
+            FROM actividades a
+            JOIN miembros m ON m.id = a.id_miembro
+            GROUP BY m.guild_id, m.etiqueta_reclutador, DATE(a.fecha)
+        ''')
+        filas.extend((f['guild_id'], f['etiqueta_reclutador'], f['dia'], 0, 0, f['cantidad'], 0) for f in cursor.fetchall())
+        cursor.execute('''
+            SELECT m.guild_id, m.etiqueta_reclutador, DATE(m.fecha_registro) AS dia, COUNT(*) AS cantidad
+            FROM actividades a
+            JOIN miembros m ON m.id = a.id_miembro
+            GROUP BY m.guild_id, m.etiqueta_reclutador, DATE(m.fecha_registro)
+        ''')
+        filas.extend((f['guild_id'], f['etiqueta_reclutador'], f['dia'], 0, 0, 0, f['cantidad']) for f in cursor.fetchall())
+        acumulado = _ranking_por_periodo(filas)
+        if acumulado:
+            get_backend().execute_values(cursor, '''
+                INSERT INTO ranking_reclutadores (guild_id, periodo, inicio, etiqueta_reclutador, reclutados, retenidos, actividades,
+                                                  actividades_reclutados)
+                VALUES %s
+            ''', [clave + valores for clave, valores in acumulado.items()])
+        logger.info(f'Ranking de reclutadores recalculado ({len(acumulado)} filas)')
+        _marcar_version_datos(cursor, 'ranking', RANKING_DATA_VERSION)
+    return True
+
+# Condición y orden de cada criterio del ranking. actividades_por_reclutado divide las actividades de los
+# reclutados del período que siguen entre esos mismos reclutados; sin retenidos no hay promedio
+_RANKING_CRITERIOS = {
+    'reclutados': ('r.reclutados > 0', 'r.reclutados DESC, r.retenidos DESC'),
+    'retenidos': ('r.retenidos > 0', 'r.retenidos DESC, r.reclutados DESC'),
+    'actividades': ('r.retenidos > 0 AND r.actividades_reclutados > 0', 'actividades_por_reclutado DESC, r.actividades_reclutados DESC'),
+}
+
+def get_ranking(guild_id, periodo, criterio='reclutados', anteriores=0, limite=10):
+    """Obtiene el ranking de reclutadores del servidor en la semana o el mes actual (o anteriores
+    períodos atrás) desde ranking_reclutadores. Devuelve (inicio del período, filas)"""
+    if periodo not in PERIODOS:
+        raise ValueError(f'Período desconocido: {periodo}')
+    condicion, orden = _RANKING_CRITERIOS[criterio]
+    with get_cursor() as cursor:
+        inicio = retroceder_periodo(periodo, inicio_periodo(periodo, _ahora(cursor)), anteriores)
+        cursor.execute(f'''
+            SELECT r.etiqueta_reclutador, t.id_discord, r.reclutados, r.retenidos, r.actividades, r.actividades_reclutados,
+                   CASE WHEN r.retenidos > 0 THEN CAST(r.actividades_reclutados AS REAL) / r.retenidos END AS actividades_por_reclutado
+            FROM ranking_reclutadores r
+            LEFT JOIN reclutadores t ON t.guild_id = r.guild_id AND t.etiqueta_reclutador = r.etiqueta_reclutador
+            WHERE r.guild_id = %s AND r.periodo = %s AND r.inicio = %s AND {condicion}
+            ORDER BY {orden}, r.etiqueta_reclutador
+            LIMIT %s
+        ''', (guild_id, periodo, inicio.isoformat(), limite))
+        return inicio, cursor.fetchall()
+
+def _sumar_actividad_diaria(cursor, filas):
+    """Suma filas (id_miembro, fecha, cantidad) a la actividad del día de cada miembro"""
+    por_dia = {}
+    for id_miembro, fecha, cantidad in filas:
+        clave = (id_miembro, _dia(fecha).isoformat())
+        por_dia[clave] = por_dia.get(clave, 0) + cantidad
+    if not por_dia:
+        return
+    cursor.executemany('''
+        INSERT INTO actividad_diaria (id_miembro, dia, actividades) VALUES (%s, %s, %s)
+        ON CONFLICT(id_miembro, dia) DO UPDATE SET actividades = actividad_diaria.actividades + EXCLUDED.actividades
+    ''', [clave + (cantidad,) for clave, cantidad in por_dia.items()])
+
+def initialize_actividad_diaria_table(forzar=False):
+    """Recalcula actividad_diaria desde actividades si datos_version no está en
+    ACTIVIDAD_DIARIA_DATA_VERSION (o con forzar=True); devuelve True si la recalculó"""
+    with get_cursor(write=True) as cursor:
+        get_backend().lock_migrations(cursor, MIGRATION_LOCK_ID)
+        if _version_datos(cursor, 'actividad_diaria') >= ACTIVIDAD_DIARIA_DATA_VERSION and not forzar:
+            return False
+
+        cursor.execute('DELETE FROM actividad_diaria')
+        # El JOIN omite actividades huérfanas de antes del borrado en cascada
+        cursor.execute('''
+            INSERT INTO actividad_diaria (id_miembro, dia, actividades)
+            SELECT a.id_miembro, DATE(a.fecha), COUNT(*)
+            FROM actividades a
+            JOIN miembros m ON m.id = a.id_miembro
+            GROUP BY a.id_miembro, DATE(a.fecha)
+        ''')
+        logger.info(f'Actividad diaria recalculada ({cursor.rowcount} filas)')
+        _marcar_version_datos(cursor, 'actividad_diaria', ACTIVIDAD_DIARIA_DATA_VERSION)
+    return True
+
+# Ventanas (en días) del resumen de actividad de /ver_reclutado
+VENTANAS_ACTIVIDAD = (7, 14, 30)
+
+def _desde(hoy, dias):
+    """Primer día de una ventana de dias días que termina hoy"""
+    return hoy - timedelta(days=dias - 1)
+
+def get_resumen_actividad(id_miembro, ventanas=VENTANAS_ACTIVIDAD):
+    """Resume la actividad del miembro desde actividad_diaria: último día con actividad
+    y actividades en cada una de las últimas ventanas de días. Devuelve (ultimo_dia, {dias: actividades})"""
+    with get_cursor() as cursor:
+        hoy = _dia(_ahora(cursor))
+        columnas = ', '.join(f'COALESCE(SUM(CASE WHEN dia >= %s THEN actividades ELSE 0 END), 0) AS ultimos_{dias}'
+                             for dias in ventanas)
+        cursor.execute(f'SELECT MAX(dia) AS ultimo_dia, {columnas} FROM actividad_diaria WHERE id_miembro = %s',
+                       [_desde(hoy, dias).isoformat() for dias in ventanas] + [id_miembro])
+        fila = cursor.fetchone()
+    ultimo_dia = _dia(fila['ultimo_dia']) if fila['ultimo_dia'] is not None else None
+    return ultimo_dia, {dias: fila[f'ultimos_{dias}'] for dias in ventanas}
+
+def get_reclutados_inactivos(guild_id, dias, etiqueta_reclutador=None, id_discord=None):
+    """Obtiene los reclutados del servidor (o de un reclutador) sin actividad en los últimos dias días,
+    desde actividad_diaria. Solo cuenta a los registrados antes de la ventana; ordenados por reclutador
+    y de los que nunca tuvieron actividad a los que la tuvieron más recientemente"""
+    if etiqueta_reclutador is None:
+        filtro, params = 'm.guild_id = %s', (guild_id,)
+    else:
+        filtro, params = _filtro_identidad(guild_id, 'm.id_discord_reclutador', 'm.etiqueta_reclutador', id_discord, etiqueta_reclutador)
+    with get_cursor() as cursor:
+        desde = _desde(_dia(_ahora(cursor)), dias).isoformat()
+        # Por miembro, una búsqueda en la clave primaria (id_miembro, dia) de actividad_diaria;
+        # el último día solo se busca para los que resultan inactivos. Se ordena en la consulta externa
+        # porque PostgreSQL no acepta un alias de la salida dentro de una expresión del ORDER BY
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT m.id, m.etiqueta_miembro, m.id_discord_miembro, m.etiqueta_reclutador, m.id_discord_reclutador,
+                       m.fecha_registro,
+                       (SELECT MAX(d.dia) FROM actividad_diaria d WHERE d.id_miembro = m.id) AS ultimo_dia
+                FROM miembros m
+                WHERE ({filtro}) AND m.fecha_registro < %s
+                  AND NOT EXISTS (SELECT 1 FROM actividad_diaria d WHERE d.id_miembro = m.id AND d.dia >= %s)
+            ) inactivos
+            ORDER BY etiqueta_reclutador, (ultimo_dia IS NOT NULL), ultimo_dia, id
+        ''', (*params, desde, desde))
+        return cursor.fetchall()
+
+@cache.cached('servidor', key=lambda guild_id: guild_id)
+def get_servidor_config(guild_id):
+    """Obtiene la configuración del servidor (None si nunca se configuró)"""
+    with get_cursor() as cursor:
+        cursor.execute('SELECT guild_id, rol_staff_id FROM servidores WHERE guild_id = %s', (guild_id,))
+        return cursor.fetchone()
+
+def set_rol_staff(guild_id, rol_staff_id):
+    """Guarda el rol de staff que muestra /ver_staff en este servidor"""
+    with get_cursor(write=True) as cursor:
+        cursor.execute('''
+            INSERT INTO servidores (guild_id, rol_staff_id) VALUES (%s, %s)
+            ON CONFLICT(guild_id) DO UPDATE SET rol_staff_id = EXCLUDED.rol_staff_id, fecha_actualizacion = CURRENT_TIMESTAMP
+        ''', (guild_id, rol_staff_id))
+    cache.invalidate('servidor', guild_id)
+
+def asignar_datos_sin_servidor(guild_id):
+    """Asigna al servidor los miembros y reclutadores guardados antes de separar los datos por servidor
+    (guild_id = 0). Devuelve la cantidad de miembros asignados"""
+    with get_cursor(write=True) as cursor:
+        cursor.execute('UPDATE miembros SET guild_id = %s WHERE guild_id = 0', (guild_id,))
+        asignados = cursor.rowcount
+        # Un reclutador que ya tiene fila en el servidor suma sus contadores a esa fila
+        cursor.execute('''
+            INSERT INTO reclutadores (guild_id, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados,
+                                      fecha_creacion, reclutados_activos, total_actividades, ultima_actividad)
+            SELECT %s, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados,
+                   fecha_creacion, reclutados_activos, total_actividades, ultima_actividad
+            FROM reclutadores
+            WHERE guild_id = 0
+            ON CONFLICT(guild_id, etiqueta_reclutador) DO UPDATE SET
+                id_discord = COALESCE(reclutadores.id_discord, EXCLUDED.id_discord),
+                total_reclutados = COALESCE(reclutadores.total_reclutados, 0) + COALESCE(EXCLUDED.total_reclutados, 0),
+                reclutados_activos = COALESCE(reclutadores.reclutados_activos, 0) + COALESCE(EXCLUDED.reclutados_activos, 0),
+                total_actividades = COALESCE(reclutadores.total_actividades, 0) + COALESCE(EXCLUDED.total_actividades, 0),
+                ultimo_reclutamiento = CASE
+                    WHEN reclutadores.ultimo_reclutamiento IS NULL OR reclutadores.ultimo_reclutamiento < EXCLUDED.ultimo_reclutamiento
+                    THEN EXCLUDED.ultimo_reclutamiento ELSE reclutadores.ultimo_reclutamiento END,
+                ultima_actividad = CASE
+                    WHEN reclutadores.ultima_actividad IS NULL OR reclutadores.ultima_actividad < EXCLUDED.ultima_actividad
+                    THEN EXCLUDED.ultima_actividad ELSE reclutadores.ultima_actividad END,
+                fecha_creacion = CASE
+                    WHEN reclutadores.fecha_creacion IS NULL OR reclutadores.fecha_creacion > EXCLUDED.fecha_creacion
+                    THEN EXCLUDED.fecha_creacion ELSE reclutadores.fecha_creacion END
+        ''', (guild_id,))
+        cursor.execute('DELETE FROM reclutadores WHERE guild_id = 0')
         cursor.execute('''
-            INSERT INTO reclutadores (etiqueta_reclutador, ultimo_reclutamiento, total_reclutados, fecha_creacion)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT(etiqueta_reclutador) DO UPDATE SET
-                ultimo_reclutamiento = CASE 
-                    WHEN ultimo_reclutamiento IS NULL OR ultimo_reclutamiento < %s 
-                    THEN %s ELSE ultimo_reclutamiento END,
-                total_reclutados = CASE 
-                    WHEN total_reclutados < %s 
-                    THEN %s ELSE total_reclutados END
-        ''', (etiqueta, ultimo, total, creacion, ultimo, ultimo, total, total))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
\ No newline at end of file
+            INSERT INTO ranking_reclutadores (guild_id, periodo, inicio, etiqueta_reclutador, reclutados, retenidos, actividades,
+                                              actividades_reclutados)
+            SELECT %s, periodo, inicio, etiqueta_reclutador, reclutados, retenidos, actividades, actividades_reclutados
+            FROM ranking_reclutadores
+            WHERE guild_id = 0
+            ON CONFLICT(guild_id, periodo, inicio, etiqueta_reclutador) DO UPDATE SET
+                reclutados = ranking_reclutadores.reclutados + EXCLUDED.reclutados,
+                retenidos = ranking_reclutadores.retenidos + EXCLUDED.retenidos,
+                actividades = ranking_reclutadores.actividades + EXCLUDED.actividades,
+                actividades_reclutados = ranking_reclutadores.actividades_reclutados + EXCLUDED.actividades_reclutados
+        ''', (guild_id,))
+        cursor.execute('DELETE FROM ranking_reclutadores WHERE guild_id = 0')
+    if asignados:
+        cache.clear()
+    return asignados
@@ -0,0 +1,11 @@
+"""
+Códigos de salida de bot.py que run_bot.py usa para elegir la espera antes de reiniciar.
+Siguen los valores de sysexits.h.
+"""
+
+# La base de datos no respondió al arrancar: suele resolverse en segundos o minutos
+EXIT_DATABASE = 75  # EX_TEMPFAIL
+# Discord rechazó el inicio de sesión por exceso de solicitudes
+EXIT_RATE_LIMITED = 69  # EX_UNAVAILABLE
+# Token inválido o intents privilegiados sin habilitar: reiniciar rápido no sirve
+EXIT_CONFIG = 78  # EX_CONFIG
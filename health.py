@@ -0,0 +1,198 @@
+"""
+Estado de salud del bot compartido entre bot.py y run_bot.py.
+El bot envía cada pocos segundos un reporte JSON (gateway, base de datos, lag del event
+loop, errores de comandos) por un pipe que hereda del supervisor. run_bot.py guarda el
+último reporte y responde /health y /ready con ese dato, sin sondear nada en el momento.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger('health')
+
+# Variable de entorno con el descriptor del pipe que recibe el proceso del bot
+HEALTH_FD_ENV = 'BOT_HEALTH_FD'
+# Un reporte que cabe en PIPE_BUF se escribe de forma atómica
+TAMANO_MAXIMO = 4096
+
+
+def crear_canal():
+    """Crea el pipe del reporte de salud; devuelve (lectura, escritura) con la escritura heredable"""
+    lectura, escritura = os.pipe()
+    os.set_inheritable(escritura, True)
+    return lectura, escritura
+
+
+class HealthReporter:
+    """Lado del bot: ejecuta recolectar() periódicamente y envía el resultado al supervisor"""
+
+    def __init__(self, recolectar, intervalo=5.0, fd=None):
+        # recolectar: corrutina que recibe el lag medido del event loop y devuelve un dict
+        self.recolectar = recolectar
+        self.intervalo = intervalo
+        if fd is None and os.environ.get(HEALTH_FD_ENV):
+            fd = int(os.environ[HEALTH_FD_ENV])
+        self.fd = fd
+
+    async def ejecutar(self):
+        if self.fd is None:
+            return
+        # Nunca bloquear el event loop si el supervisor deja de leer
+        os.set_blocking(self.fd, False)
+        loop = asyncio.get_running_loop()
+        while self.fd is not None:
+            inicio = loop.time()
+            await asyncio.sleep(self.intervalo)
+            # Lo que tarda de más en despertar es tiempo que el loop estuvo ocupado
+            lag = max(0.0, loop.time() - inicio - self.intervalo)
+            try:
+                estado = await self.recolectar(lag)
+            except Exception as e:
+                logger.warning(f'Error recolectando el estado de salud: {e}')
+                continue
+            self._enviar(estado)
+
+    def _enviar(self, estado):
+        estado['ts'] = time.time()
+        datos = (json.dumps(estado, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        if len(datos) > TAMANO_MAXIMO:
+            logger.warning(f'Reporte de salud demasiado grande ({len(datos)} bytes), se descarta')
+            return
+        try:
+            os.write(self.fd, datos)
+        except BlockingIOError:
+            # El supervisor no está leyendo: se pierde este reporte, no el bot
+            pass
+        except OSError:
+            logger.warning('El supervisor cerró el canal de salud; se dejan de enviar reportes')
+            os.close(self.fd)
+            self.fd = None
+
+
+class HealthMonitor:
+    """Lado del supervisor: guarda el último reporte del bot y evalúa vida y disponibilidad"""
+
+    def __init__(self, reporte_vencido=30, gracia_inicio=120, gracia_caido=60, gracia_gateway=300,
+                 lag_maximo=1.0, tasa_errores_maxima=0.5):
+        self.reporte_vencido = reporte_vencido
+        self.gracia_inicio = gracia_inicio
+        self.gracia_caido = gracia_caido
+        self.gracia_gateway = gracia_gateway
+        self.lag_maximo = lag_maximo
+        self.tasa_errores_maxima = tasa_errores_maxima
+        self._lock = threading.Lock()
+        self._reporte = None
+        self._recibido = None
+        self._hijo_activo = False
+        self._cambio_hijo = time.monotonic()
+        # Momento (time.monotonic) del próximo reinicio mientras el supervisor espera a propósito, y su causa
+        self._reinicio_en = None
+        self._causa_reinicio = None
+        self._evaluaciones = {}  # shard_id (None = todo el proceso) -> (momento, evaluación)
+
+    def hijo_iniciado(self, lectura):
+        """Registra un nuevo proceso del bot y empieza a leer su canal en un hilo"""
+        with self._lock:
+            self._hijo_activo = True
+            self._cambio_hijo = time.monotonic()
+            self._reporte = None
+            self._recibido = None
+            self._reinicio_en = None
+            self._evaluaciones = {}
+        threading.Thread(target=self._leer, args=(lectura,), daemon=True, name='health-reader').start()
+
+    def hijo_terminado(self):
+        with self._lock:
+            self._hijo_activo = False
+            self._cambio_hijo = time.monotonic()
+            self._evaluaciones = {}
+
+    def reinicio_programado(self, espera, causa=None):
+        """El supervisor espera espera segundos antes de reiniciar (backoff por rate limit, configuración...).
+        Mientras tanto el proceso sigue vivo para /health, así la plataforma no reinicia el contenedor
+        y se saltea la espera; /ready sí falla"""
+        with self._lock:
+            self._reinicio_en = time.monotonic() + espera
+            self._causa_reinicio = causa
+            self._evaluaciones = {}
+
+    def _leer(self, lectura):
+        with os.fdopen(lectura, 'rb') as canal:
+            for linea in canal:
+                try:
+                    reporte = json.loads(linea)
+                except ValueError:
+                    continue
+                with self._lock:
+                    self._reporte = reporte
+                    self._recibido = time.monotonic()
+
+    def evaluar(self, shard_id=None):
+        """Devuelve el estado de vida y disponibilidad del proceso, o de uno de sus shards;
+        se recalcula como mucho una vez por segundo"""
+        ahora = time.monotonic()
+        with self._lock:
+            calculado, evaluacion = self._evaluaciones.get(shard_id, (0.0, None))
+            if evaluacion is not None and ahora - calculado < 1.0:
+                return evaluacion
+            evaluacion = self._calcular(ahora, shard_id)
+            self._evaluaciones[shard_id] = (ahora, evaluacion)
+            return evaluacion
+
+    def _calcular(self, ahora, shard_id=None):
+        problemas = []
+        reporte = self._reporte or {}
+        edad = ahora - self._recibido if self._recibido is not None else None
+        desde_cambio = ahora - self._cambio_hijo
+
+        # Vida: el proceso existe, el event loop sigue reportando y el gateway no está caído hace rato
+        vivo = True
+        if not self._hijo_activo and self._reinicio_en is not None and ahora < self._reinicio_en:
+            causa = f' ({self._causa_reinicio})' if self._causa_reinicio else ''
+            problemas.append(f'reinicio programado en {self._reinicio_en - ahora:.0f}s{causa}')
+        elif not self._hijo_activo:
+            problemas.append('el proceso del bot no está en ejecución')
+            # Tras una espera programada, la gracia cuenta desde el reinicio previsto
+            vivo = ahora - max(self._cambio_hijo, self._reinicio_en or 0) < self.gracia_caido
+        elif edad is None:
+            problemas.append('el bot todavía no envió su primer reporte')
+            vivo = desde_cambio < self.gracia_inicio
+        elif edad > self.reporte_vencido:
+            problemas.append(f'último reporte hace {edad:.0f}s')
+            vivo = False
+        elif (reporte.get('desconectado_s') or 0) > self.gracia_gateway:
+            problemas.append(f'gateway desconectado hace {reporte["desconectado_s"]:.0f}s')
+            vivo = False
+
+        # Disponibilidad: además puede atender comandos ahora mismo
+        listo = vivo and self._hijo_activo and edad is not None and edad <= self.reporte_vencido
+        if reporte and not reporte.get('gateway_conectado'):
+            caidos = [shard for shard, conectado, _ in reporte.get('shards') or [] if not conectado]
+            # Un shard conectado está disponible aunque otro shard del mismo proceso no lo esté
+            if shard_id is None or shard_id in caidos or not caidos:
+                problemas.append(f'shards desconectados: {caidos}' if caidos else 'gateway desconectado')
+                listo = False
+        if reporte and not reporte.get('db_ok'):
+            problemas.append(f'base de datos no disponible: {reporte.get("db_error")}')
+            listo = False
+        if (reporte.get('lag_loop') or 0) > self.lag_maximo:
+            problemas.append(f'event loop con {reporte["lag_loop"]:.2f}s de lag')
+            listo = False
+        if (reporte.get('comandos_5m') or 0) >= 5 and (reporte.get('tasa_errores_5m') or 0) > self.tasa_errores_maxima:
+            problemas.append(f'{reporte["tasa_errores_5m"]:.0%} de comandos con error en 5 minutos')
+            listo = False
+
+        evaluacion = {
+            'vivo': vivo,
+            'listo': listo,
+            'problemas': problemas,
+            'edad_reporte': round(edad, 1) if edad is not None else None,
+            'bot': reporte,
+        }
+        if shard_id is not None:
+            evaluacion['shard'] = next((s for s in reporte.get('shards') or [] if s[0] == shard_id), None)
+        return evaluacion
@@ -0,0 +1,145 @@
+"""
+Lag del event loop y perfilador de bloqueos.
+LoopMonitor mide cada LOOP_LAG_INTERVAL segundos cuánto tarda el loop en despertar una tarea
+dormida (bot_event_loop_lag_seconds en /metrics). Si LOOP_PROFILE_THRESHOLD está definido, un
+hilo vigila el loop y, mientras un callback lo tenga bloqueado más que ese umbral, toma
+muestras de la pila del hilo del loop. Cada bloqueo queda como una línea JSON en
+LOOP_PROFILE_REPORTS y, opcionalmente, las pilas se acumulan en LOOP_PROFILE_STACKS en
+formato "collapsed" (flamegraph.pl, speedscope).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from metrics import registro
+
+logger = logging.getLogger('loop_monitor')
+
+registro.histogram('bot_event_loop_lag_seconds', 'Retraso del event loop al despertar una tarea dormida')
+registro.counter('bot_event_loop_stalls_total', 'Bloqueos del event loop que superaron LOOP_PROFILE_THRESHOLD')
+
+_CARPETA = os.path.dirname(os.path.abspath(__file__))
+
+
+def _marco(frame):
+    codigo = frame.f_code
+    return f'{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{frame.f_lineno})'
+
+
+def _pila(frame):
+    """Devuelve la pila desde la raíz como tupla de 'funcion (archivo:linea)' y el marco
+    más profundo que pertenece al bot (no a discord.py ni a la biblioteca estándar)"""
+    marcos = []
+    while frame is not None:
+        marcos.append(frame)
+        frame = frame.f_back
+    marcos.reverse()
+    return tuple(_marco(f) for f in marcos), next(
+        (_marco(f) for f in reversed(marcos) if f.f_code.co_filename.startswith(_CARPETA) and 'site-packages' not in f.f_code.co_filename), None)
+
+
+class LoopMonitor:
+    """Mide el lag del event loop y, con umbral, perfila los callbacks que lo bloquean"""
+
+    def __init__(self, intervalo=0.25, umbral=None, muestreo=0.005, reportes_path=None, pilas_path=None):
+        self.intervalo = intervalo
+        self.umbral = umbral or None
+        self.muestreo = muestreo
+        self.reportes_path = reportes_path
+        self.pilas_path = pilas_path
+        self.lag_maximo = 0.0
+        self.bloqueos = 0
+        self._latido = None
+        self._hilo_loop = None
+        self._pilas = Counter()
+
+    def tomar_lag_maximo(self):
+        """Devuelve el mayor lag medido desde la llamada anterior y lo reinicia"""
+        lag, self.lag_maximo = self.lag_maximo, 0.0
+        return lag
+
+    async def ejecutar(self):
+        loop = asyncio.get_running_loop()
+        self._hilo_loop = threading.get_ident()
+        self._latido = time.monotonic()
+        if self.umbral:
+            threading.Thread(target=self._vigilar, daemon=True, name='loop-profiler').start()
+            logger.info(f'Perfilador del event loop activo (umbral {self.umbral * 1000:.0f}ms)')
+        while True:
+            inicio = loop.time()
+            self._latido = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+            lag = max(0.0, loop.time() - inicio - self.intervalo)
+            registro.observe('bot_event_loop_lag_seconds', lag)
+            self.lag_maximo = max(self.lag_maximo, lag)
+
+    def _bloqueado_desde(self):
+        # El sampler debería haber despertado en latido + intervalo; si no, el loop está ocupado
+        esperado = self._latido + self.intervalo
+        return esperado if time.monotonic() - esperado > self.umbral else None
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.muestreo)
+            desde = self._bloqueado_desde()
+            if desde is None:
+                continue
+            latido = self._latido
+            muestras = Counter()
+            propias = Counter()
+            # Muestrear la pila del loop hasta que el sampler vuelva a latir
+            while self._latido == latido:
+                frame = sys._current_frames().get(self._hilo_loop)
+                if frame is not None:
+                    pila, propia = _pila(frame)
+                    muestras[pila] += 1
+                    if propia:
+                        propias[propia] += 1
+                del frame
+                time.sleep(self.muestreo)
+            self._registrar(time.monotonic() - desde, muestras, propias)
+
+    def _registrar(self, duracion, muestras, propias):
+        self.bloqueos += 1
+        registro.inc('bot_event_loop_stalls_total')
+        pila, _ = muestras.most_common(1)[0] if muestras else ((), 0)
+        origen = propias.most_common(1)[0][0] if propias else (pila[-1] if pila else 'desconocido')
+        logger.warning(f'Event loop bloqueado {duracion * 1000:.0f}ms en {origen} ({sum(muestras.values())} muestras)')
+        reporte = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'duracion_ms': round(duracion * 1000),
+            'origen': origen,
+            'muestras': sum(muestras.values()),
+            'pila': list(pila[-8:]),
+        }
+        try:
+            if self.reportes_path:
+                with open(self.reportes_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(reporte, ensure_ascii=False) + '\n')
+            if self.pilas_path:
+                self._pilas.update(muestras)
+                temporal = f'{self.pilas_path}.tmp'
+                with open(temporal, 'w', encoding='utf-8') as f:
+                    for pila_muestra, cantidad in self._pilas.items():
+                        f.write(';'.join(pila_muestra) + f' {cantidad}\n')
+                os.replace(temporal, self.pilas_path)
+        except OSError as e:
+            logger.warning(f'No se pudo guardar el reporte de bloqueo: {e}')
+
+
+def desde_entorno():
+    """Crea el monitor con la configuración de las variables LOOP_*"""
+    return LoopMonitor(
+        intervalo=float(os.getenv('LOOP_LAG_INTERVAL', 0.25)),
+        umbral=float(os.getenv('LOOP_PROFILE_THRESHOLD', 0)),
+        muestreo=float(os.getenv('LOOP_PROFILE_SAMPLE', 0.005)),
+        reportes_path=os.getenv('LOOP_PROFILE_REPORTS', 'loop_bloqueos.jsonl'),
+        pilas_path=os.getenv('LOOP_PROFILE_STACKS') or None,
+    )
@@ -0,0 +1,115 @@
+"""
+Caché acotada de miembros para el modo de carga diferida (MEMBER_LOADING=lazy).
+En ese modo el bot no descarga todos los miembros al conectarse: pide a Discord solo los
+IDs que necesita un comando (query_members, de a MEMBER_CHUNK_SIZE) y guarda los más
+usados en una caché LRU de MEMBER_CACHE_SIZE entradas, así la memoria depende del uso y
+no del tamaño del servidor.
+"""
+
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('member_cache')
+
+# Máximo de IDs que acepta Discord en una sola solicitud de miembros
+CHUNK_MAXIMO = 100
+
+
+class MemberCache:
+    """Caché LRU de miembros por (guild_id, user_id), cargados bajo demanda"""
+
+    def __init__(self, maxsize=5000, chunk=CHUNK_MAXIMO, limite_rol=1000):
+        self.maxsize = maxsize
+        self.chunk = max(1, min(chunk, CHUNK_MAXIMO))
+        # Miembros que se recorren como máximo por HTTP para listar un rol (páginas de 1000)
+        self.limite_rol = max(0, limite_rol)
+        self._miembros = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild, user_id):
+        """Devuelve el miembro si está en caché (o en la de discord.py), sin ir a Discord"""
+        if guild is None or user_id is None:
+            return None
+        clave = (guild.id, user_id)
+        member = self._miembros.get(clave)
+        if member is not None:
+            self._miembros.move_to_end(clave)
+            return member
+        member = guild.get_member(user_id)
+        if member is not None:
+            self.put(member)
+        return member
+
+    def put(self, member):
+        clave = (member.guild.id, member.id)
+        self._miembros[clave] = member
+        self._miembros.move_to_end(clave)
+        while len(self._miembros) > self.maxsize:
+            self._miembros.popitem(last=False)
+
+    def update(self, member):
+        """Actualiza un miembro solo si ya estaba en caché (los eventos no la hacen crecer)"""
+        if (member.guild.id, member.id) in self._miembros:
+            self.put(member)
+
+    def remove(self, member):
+        self._miembros.pop((member.guild.id, member.id), None)
+
+    def forget_guild(self, guild):
+        for clave in [clave for clave in self._miembros if clave[0] == guild.id]:
+            del self._miembros[clave]
+
+    async def fetch(self, guild, user_ids):
+        """Devuelve {user_id: miembro} para los IDs que siguen en el servidor, pidiendo a Discord solo los que faltan"""
+        encontrados = {}
+        faltantes = []
+        for user_id in dict.fromkeys(i for i in user_ids if i is not None):
+            member = self.get(guild, user_id)
+            if member is not None:
+                encontrados[user_id] = member
+            else:
+                faltantes.append(user_id)
+        self.hits += len(encontrados)
+        self.misses += len(faltantes)
+        for inicio in range(0, len(faltantes), self.chunk):
+            lote = faltantes[inicio:inicio + self.chunk]
+            for member in await guild.query_members(user_ids=lote, limit=len(lote), cache=False):
+                self.put(member)
+                encontrados[member.id] = member
+        return encontrados
+
+    async def buscar_etiqueta(self, guild, etiqueta):
+        """Busca por nombre un miembro guardado solo con su etiqueta (filas sin ID de Discord)"""
+        nombre = etiqueta.split('#')[0]
+        if not nombre:
+            return None
+        candidatos = await guild.query_members(query=nombre, limit=10, cache=False)
+        member = next((m for m in candidatos if str(m) == etiqueta), None) or \
+            next((m for m in candidatos if m.name == nombre), None)
+        if member is not None:
+            self.put(member)
+        return member
+
+    async def miembros_con_rol(self, guild, rol):
+        """Lista los miembros de un rol y devuelve (miembros, completo).
+        Si discord.py ya tiene todos los miembros del servidor (guild.chunked) es rol.members, sin solicitudes.
+        Si no, une los de la caché LRU con una recorrida por HTTP de a lo sumo limite_rol miembros: una
+        solicitud por cada 1000, que cuenta para el rate limit. completo es False si la recorrida llegó
+        al límite, porque pueden faltar miembros del rol"""
+        if guild.chunked:
+            return list(rol.members), True
+        encontrados = {member.id: member for (guild_id, _), member in self._miembros.items()
+                       if guild_id == guild.id and member.get_role(rol.id) is not None}
+        recorridos = 0
+        if self.limite_rol:
+            async for member in guild.fetch_members(limit=self.limite_rol):
+                recorridos += 1
+                if member.get_role(rol.id) is not None:
+                    encontrados[member.id] = member
+        for member in encontrados.values():
+            self.put(member)
+        return list(encontrados.values()), recorridos < self.limite_rol
+
+    def __len__(self):
+        return len(self._miembros)
@@ -0,0 +1,107 @@
+"""
+Índice en memoria de los miembros de cada servidor.
+Permite resolver una etiqueta guardada en la base de datos a un miembro
+con una búsqueda en diccionario en lugar de recorrer guild.members, y listar
+los miembros de un rol sin revisar los roles de cada miembro del servidor.
+"""
+
+
+class MemberIndex:
+    """Índice de miembros por etiqueta completa, por nombre de usuario y por rol, separado por servidor"""
+
+    def __init__(self):
+        # guild_id -> {'tag': {etiqueta: miembro}, 'name': {username: miembro},
+        #              'id': {user_id: miembro}, 'role': {role_id: {user_id}}, 'roles_de': {user_id: (role_id, ...)}}
+        self._guilds = {}
+
+    def is_built(self, guild):
+        return guild.id in self._guilds
+
+    def build(self, guild):
+        """Construye (o reconstruye) el índice de un servidor desde su caché de miembros"""
+        self._guilds[guild.id] = {'tag': {}, 'name': {}, 'id': {}, 'role': {}, 'roles_de': {}}
+        for member in guild.members:
+            self.add(member)
+
+    def forget_guild(self, guild):
+        self._guilds.pop(guild.id, None)
+
+    def add(self, member):
+        # Los servidores sin índice se construyen completos en la primera búsqueda
+        tablas = self._guilds.get(member.guild.id)
+        if tablas is None:
+            return
+        tablas['tag'][str(member)] = member
+        tablas['name'].setdefault(member.name, member)
+        tablas['id'][member.id] = member
+        roles = tuple(rol.id for rol in member.roles)
+        tablas['roles_de'][member.id] = roles
+        for rol_id in roles:
+            tablas['role'].setdefault(rol_id, set()).add(member.id)
+
+    def remove(self, member, guild_id=None):
+        tablas = self._guilds.get(guild_id if guild_id is not None else member.guild.id)
+        if not tablas:
+            return
+        for tabla, clave in (('tag', str(member)), ('name', member.name)):
+            actual = tablas[tabla].get(clave)
+            if actual is not None and actual.id == member.id:
+                del tablas[tabla][clave]
+        tablas['id'].pop(member.id, None)
+        # Se quitan los roles con los que se indexó, aunque member sea un objeto desactualizado
+        for rol_id in tablas['roles_de'].pop(member.id, ()):
+            ids = tablas['role'].get(rol_id)
+            if ids is not None:
+                ids.discard(member.id)
+
+    def update(self, before, after):
+        self.remove(before)
+        self.add(after)
+
+    def update_user(self, before, after, guilds):
+        """Actualiza las claves de un usuario que cambió de nombre en todos los servidores compartidos"""
+        for guild in guilds:
+            member = guild.get_member(after.id)
+            if member is not None and self.is_built(guild):
+                self.remove(before, guild_id=guild.id)
+                self.add(member)
+
+    def remove_role(self, rol):
+        """Olvida un rol eliminado del servidor"""
+        tablas = self._guilds.get(rol.guild.id)
+        if not tablas:
+            return
+        for user_id in tablas['role'].pop(rol.id, ()):
+            tablas['roles_de'][user_id] = tuple(r for r in tablas['roles_de'][user_id] if r != rol.id)
+
+    def members_with_role(self, guild, rol_id):
+        """Devuelve los miembros que tienen el rol, tocando solo a esos miembros"""
+        if guild is None:
+            return []
+        if not self.is_built(guild):
+            self.build(guild)
+        tablas = self._guilds[guild.id]
+        return [tablas['id'][user_id] for user_id in tablas['role'].get(rol_id, ())]
+
+    def get(self, guild, user_id):
+        """Busca un miembro por su ID de Discord"""
+        if guild is None or user_id is None:
+            return None
+        if not self.is_built(guild):
+            self.build(guild)
+        return self._guilds[guild.id]['id'].get(user_id)
+
+    def find(self, guild, etiqueta):
+        """Busca un miembro por etiqueta completa, nombre de usuario o nombre antes del discriminador"""
+        if guild is None:
+            return None
+        if not self.is_built(guild):
+            self.build(guild)
+        tablas = self._guilds[guild.id]
+        member = tablas['tag'].get(etiqueta) or tablas['name'].get(etiqueta)
+        if member is None and '#' in etiqueta:
+            member = tablas['name'].get(etiqueta.split('#')[0])
+        return member
+
+    def __len__(self):
+        return sum(len(tablas['tag']) for tablas in self._guilds.values())
@@ -0,0 +1,302 @@
+"""
+Métricas de los comandos y de la base de datos en formato de texto de Prometheus.
+Cada comando decorado con @instrumentar registra su latencia total y cuánto de ese tiempo
+se fue en database.py y en la API de Discord, además de las consultas y filas leídas.
+El proceso del bot escribe el resultado en un archivo que run_bot.py sirve en /metrics.
+"""
+
+import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+
+logger = logging.getLogger('metrics')
+
+# Límites superiores (en segundos) de los buckets de los histogramas de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets para cantidades (consultas y filas por comando)
+BUCKETS_CANTIDAD = (1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, valor):
+        self.count += 1
+        self.sum += valor
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.counts[i] += 1
+                break
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(labels, extra=None):
+    pares = list(labels) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+class Registry:
+    """Registro de histogramas, contadores y gauges calculados al exportar"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}  # nombre -> (tipo, ayuda, buckets, {labels: valor o Histogram})
+        self._colectores = []
+
+    def histogram(self, nombre, ayuda, buckets=BUCKETS):
+        self._metricas.setdefault(nombre, ('histogram', ayuda, buckets, {}))
+
+    def counter(self, nombre, ayuda):
+        self._metricas.setdefault(nombre, ('counter', ayuda, None, {}))
+
+    def add_collector(self, colector):
+        """Agrega una función que devuelve [(nombre, ayuda, valor)] con gauges leídos al exportar"""
+        self._colectores.append(colector)
+
+    def observe(self, nombre, valor, **labels):
+        _, _, buckets, series = self._metricas[nombre]
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            histograma = series.get(clave)
+            if histograma is None:
+                histograma = series[clave] = Histogram(buckets)
+            histograma.observe(valor)
+
+    def inc(self, nombre, valor=1, **labels):
+        series = self._metricas[nombre][3]
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            series[clave] = series.get(clave, 0) + valor
+
+    def total(self, nombre):
+        """Suma de un contador, o cantidad de observaciones de un histograma, en todas sus etiquetas"""
+        tipo, _, _, series = self._metricas[nombre]
+        with self._lock:
+            if tipo == 'counter':
+                return sum(series.values())
+            return sum(histograma.count for histograma in series.values())
+
+    def render(self):
+        """Devuelve todas las métricas en formato de texto de Prometheus"""
+        lineas = []
+        with self._lock:
+            for nombre, (tipo, ayuda, buckets, series) in self._metricas.items():
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} {tipo}')
+                for clave, valor in series.items():
+                    if tipo == 'counter':
+                        lineas.append(f'{nombre}{_etiquetas(clave)} {valor}')
+                        continue
+                    acumulado = 0
+                    for limite, cantidad in zip(buckets, valor.counts):
+                        acumulado += cantidad
+                        lineas.append(f'{nombre}_bucket{_etiquetas(clave, ("le", limite))} {acumulado}')
+                    lineas.append(f'{nombre}_bucket{_etiquetas(clave, ("le", "+Inf"))} {valor.count}')
+                    lineas.append(f'{nombre}_sum{_etiquetas(clave)} {valor.sum}')
+                    lineas.append(f'{nombre}_count{_etiquetas(clave)} {valor.count}')
+        for colector in self._colectores:
+            try:
+                for nombre, ayuda, valor in colector():
+                    lineas.append(f'# HELP {nombre} {ayuda}')
+                    lineas.append(f'# TYPE {nombre} gauge')
+                    lineas.append(f'{nombre} {valor}')
+            except Exception as e:
+                logger.warning(f'Error leyendo métricas de {getattr(colector, "__name__", colector)}: {e}')
+        return '\n'.join(lineas) + '\n'
+
+
+registro = Registry()
+registro.histogram('bot_command_duration_seconds', 'Latencia de extremo a extremo de cada comando')
+registro.histogram('bot_command_db_seconds', 'Tiempo de cada comando esperando llamadas a database.py')
+registro.histogram('bot_command_discord_seconds', 'Tiempo de cada comando esperando respuestas de la API de Discord')
+registro.histogram('bot_command_queries', 'Consultas SQL ejecutadas por comando', BUCKETS_CANTIDAD)
+registro.histogram('bot_command_rows', 'Filas leídas de la base de datos por comando', BUCKETS_CANTIDAD)
+registro.counter('bot_command_errors_total', 'Comandos que terminaron con error (excepción o error capturado por el propio comando)')
+registro.histogram('bot_db_call_duration_seconds', 'Duración de cada llamada a database.py (incluye la espera en cola)')
+registro.counter('bot_db_queries_total', 'Consultas SQL ejecutadas')
+registro.counter('bot_db_rows_total', 'Filas leídas de la base de datos')
+
+
+class Medicion:
+    """Acumulador de lo que hace un comando mientras se ejecuta"""
+    __slots__ = ('db', 'discord', 'consultas', 'filas', 'fallido')
+
+    def __init__(self):
+        self.db = 0.0
+        self.discord = 0.0
+        self.consultas = 0
+        self.filas = 0
+        self.fallido = False
+
+
+# Medición del comando en curso; run_db la copia a los hilos del executor
+_medicion = contextvars.ContextVar('medicion', default=None)
+
+
+def medicion_actual():
+    return _medicion.get()
+
+
+def marcar_error():
+    """Cuenta como fallido el comando en curso aunque capture la excepción y responda él mismo"""
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.fallido = True
+
+
+class CursorMedido:
+    """Cursor que cuenta consultas y filas leídas, en total y para el comando en curso"""
+
+    def __init__(self, cursor, medicion=None):
+        self._cursor = cursor
+        self._medicion = medicion
+
+    def _consulta(self):
+        registro.inc('bot_db_queries_total')
+        if self._medicion is not None:
+            self._medicion.consultas += 1
+
+    def _filas(self, cantidad):
+        registro.inc('bot_db_rows_total', cantidad)
+        if self._medicion is not None:
+            self._medicion.filas += cantidad
+
+    def execute(self, *args, **kwargs):
+        self._consulta()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._consulta()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        fila = self._cursor.fetchone()
+        if fila is not None:
+            self._filas(1)
+        return fila
+
+    def fetchall(self):
+        filas = self._cursor.fetchall()
+        self._filas(len(filas))
+        return filas
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class _DiscordMedido:
+    """Envuelve interaction.response o interaction.followup para medir sus llamadas a la API"""
+
+    def __init__(self, objetivo, medicion):
+        self._objetivo = objetivo
+        self._medicion = medicion
+
+    def __getattr__(self, nombre):
+        valor = getattr(self._objetivo, nombre)
+        if not inspect.iscoroutinefunction(valor):
+            return valor
+
+        @functools.wraps(valor)
+        async def medido(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await valor(*args, **kwargs)
+            finally:
+                self._medicion.discord += time.perf_counter() - inicio
+        return medido
+
+
+class _InteraccionMedida:
+    def __init__(self, interaction, medicion):
+        self._interaction = interaction
+        self.response = _DiscordMedido(interaction.response, medicion)
+        self.followup = _DiscordMedido(interaction.followup, medicion)
+
+    def __getattr__(self, nombre):
+        return getattr(self._interaction, nombre)
+
+
+def instrumentar(func):
+    """Decorador para los comandos de bot.tree: mide latencia, base de datos, API de Discord, consultas y filas"""
+    @functools.wraps(func)
+    async def wrapper(interaction, *args, **kwargs):
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            return await func(_InteraccionMedida(interaction, medicion), *args, **kwargs)
+        except Exception:
+            medicion.fallido = True
+            raise
+        finally:
+            _medicion.reset(token)
+            if medicion.fallido:
+                registro.inc('bot_command_errors_total', command=func.__name__)
+            registro.observe('bot_command_duration_seconds', time.perf_counter() - inicio, command=func.__name__)
+            registro.observe('bot_command_db_seconds', medicion.db, command=func.__name__)
+            registro.observe('bot_command_discord_seconds', medicion.discord, command=func.__name__)
+            registro.observe('bot_command_queries', medicion.consultas, command=func.__name__)
+            registro.observe('bot_command_rows', medicion.filas, command=func.__name__)
+    return wrapper
+
+
+def _con_etiqueta(muestra, etiqueta, valor):
+    nombre, _, resto = muestra.partition(' ')
+    extra = f'{etiqueta}="{_escapar(valor)}"'
+    if '{' in nombre:
+        nombre = nombre.replace('{', '{' + extra + ',', 1)
+    else:
+        nombre = f'{nombre}{{{extra}}}'
+    return f'{nombre} {resto}'
+
+
+def combinar(textos, etiqueta='proceso'):
+    """Une las métricas de varios procesos ({valor de etiqueta: texto}) en un solo texto de Prometheus,
+    con cada muestra etiquetada por su proceso y cada métrica agrupada bajo un único HELP/TYPE"""
+    familias = {}  # nombre -> [ayuda, tipo, muestras]
+    for valor, texto in textos.items():
+        familia = None
+        for linea in texto.splitlines():
+            if linea.startswith('# HELP ') or linea.startswith('# TYPE '):
+                clase, nombre = linea.split(' ', 3)[1:3]
+                familia = familias.setdefault(nombre, [None, None, []])
+                familia[0 if clase == 'HELP' else 1] = linea
+            elif linea and not linea.startswith('#') and familia is not None:
+                familia[2].append(_con_etiqueta(linea, etiqueta, valor))
+    lineas = []
+    for ayuda, tipo, muestras in familias.values():
+        lineas.extend(linea for linea in (ayuda, tipo) if linea)
+        lineas.extend(muestras)
+    return '\n'.join(lineas) + '\n' if lineas else ''
+
+
+def _escribir(path, texto):
+    temporal = f'{path}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(temporal, path)
+
+
+async def exportar_periodicamente(path, intervalo=5.0):
+    """Escribe las métricas en path cada intervalo segundos para que run_bot.py las sirva"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, _escribir, path, registro.render())
+        except Exception as e:
+            logger.warning(f'No se pudieron exportar las métricas a {path}: {e}')
+        await asyncio.sleep(intervalo)
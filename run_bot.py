@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Script de inicio para el Bot de Reclutamiento de Discord
-Este script maneja el reinicio automático en caso de errores
+Este script maneja el reinicio automático en caso de errores. Con SHARD_COUNT puede
+repartir los shards entre varios procesos de bot.py, cada uno con su propio reinicio
 """
 
 import subprocess
@@ -9,9 +10,15 @@ import time
 import logging
 import sys
 import os
+import json
+import random
 import threading
 from pathlib import Path
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from health import HealthMonitor, HEALTH_FD_ENV, crear_canal
+from exit_codes import EXIT_DATABASE, EXIT_RATE_LIMITED, EXIT_CONFIG
+from metrics import combinar
+import shards
 
 # Configurar logging
 logging.basicConfig(
@@ -25,14 +32,253 @@ logging.basicConfig(
 
 logger = logging.getLogger('bot_runner')
 
+# Archivo donde bot.py escribe sus métricas (ver metrics.py)
+METRICS_PATH = os.environ.get('METRICS_PATH', 'bot_metrics.prom')
+
+# Con SHARD_COUNT numérico, cantidad de procesos entre los que se reparten los shards,
+# o reparto explícito por proceso en SHARD_RANGES (por ejemplo '0-3;4-7')
+BOT_PROCESSES = int(os.environ.get('BOT_PROCESSES', 1))
+SHARD_RANGES = os.environ.get('SHARD_RANGES', '').strip()
+# Conexiones a la base entre todos los procesos; cada uno recibe su parte como DB_POOL_MAX
+DB_POOL_TOTAL = os.environ.get('DB_POOL_TOTAL')
+
+def crear_monitor():
+    """Guarda el último reporte de salud de un proceso; /health y /ready responden con él sin consultar nada"""
+    return HealthMonitor(
+        reporte_vencido=float(os.environ.get('HEALTH_STALE_SECONDS', 30)),
+        gracia_inicio=float(os.environ.get('HEALTH_STARTUP_GRACE', 120)),
+        gracia_caido=float(os.environ.get('HEALTH_DOWN_GRACE', 60)),
+        gracia_gateway=float(os.environ.get('HEALTH_GATEWAY_GRACE', 300)),
+        lag_maximo=float(os.environ.get('HEALTH_MAX_LOOP_LAG', 1.0)),
+        tasa_errores_maxima=float(os.environ.get('HEALTH_MAX_ERROR_RATE', 0.5)),
+    )
+
+def ruta_por_proceso(ruta, indice):
+    """bot_metrics.prom -> bot_metrics.1.prom"""
+    base, extension = os.path.splitext(ruta)
+    return f'{base}.{indice}{extension}'
+
+# Espera base y máxima (segundos) antes de reiniciar, según la causa de la salida del bot.
+# La espera se duplica con cada fallo consecutivo y se le aplica jitter
+BACKOFF = {
+    'senal': (2, 60),             # Proceso terminado por una señal (OOM, kill)
+    'crash': (5, 300),            # Excepción no controlada
+    'base_de_datos': (15, 600),   # La base no respondió al arrancar
+    'rate_limit': (300, 3600),    # Discord limitó el inicio de sesión
+    'configuracion': (600, 3600), # Token o intents inválidos
+}
+# Segundos de ejecución a partir de los cuales un proceso se considera estable y se reinicia el contador de fallos
+STABLE_SECONDS = float(os.environ.get('BOT_STABLE_SECONDS', 600))
+
+def causa_salida(return_code):
+    """Clasifica el código de salida de bot.py (ver exit_codes.py)"""
+    if return_code < 0:
+        return 'senal'
+    return {
+        EXIT_DATABASE: 'base_de_datos',
+        EXIT_RATE_LIMITED: 'rate_limit',
+        EXIT_CONFIG: 'configuracion',
+    }.get(return_code, 'crash')
+
+def calcular_espera(causa, fallos):
+    """Backoff exponencial por causa, con jitter entre la mitad y el total de la espera
+    pero nunca por debajo de la espera base"""
+    base, maximo = BACKOFF[causa]
+    espera = min(maximo, base * 2 ** (fallos - 1))
+    return random.uniform(max(base, espera / 2), espera)
+
+def fallos_tras_salida(fallos, duracion):
+    """Fallos consecutivos después de una salida con error tras duracion segundos de ejecución.
+    Un fallo después de un rato estable (STABLE_SECONDS) no se suma a los anteriores"""
+    return 1 if duracion >= STABLE_SECONDS else fallos + 1
+
+class ProcesoBot:
+    """Un proceso de bot.py con sus shards, su propio reinicio automático y su estado de salud"""
+
+    def __init__(self, indice=0, shard_ids=None, total_procesos=1):
+        self.indice = indice
+        self.shard_ids = shard_ids
+        self.nombre = 'bot' if shard_ids is None else f'shards {shards.formatear_ids(shard_ids)}'
+        self.prefijo = f'[{self.nombre}] ' if total_procesos > 1 else ''
+        self.monitor = crear_monitor()
+        self.reinicios = 0
+        self.activo = 0
+        self.proceso = None
+        self.metrics_path = ruta_por_proceso(METRICS_PATH, indice) if total_procesos > 1 else METRICS_PATH
+        self.entorno = {}
+        if shard_ids is not None:
+            self.entorno[shards.SHARD_IDS_ENV] = shards.formatear_ids(shard_ids)
+        if DB_POOL_TOTAL:
+            self.entorno['DB_POOL_MAX'] = str(max(1, int(DB_POOL_TOTAL) // total_procesos))
+        if total_procesos > 1:
+            # Cada proceso escribe sus propios archivos locales
+            self.entorno['METRICS_PATH'] = self.metrics_path
+            for variable, defecto in (('WRITE_SPILL_PATH', 'escrituras_pendientes.jsonl'),
+                                      ('WRITE_DEAD_LETTER_PATH', 'escrituras_descartadas.jsonl'),
+                                      ('LOOP_PROFILE_REPORTS', 'loop_bloqueos.jsonl'),
+                                      ('LOOP_PROFILE_STACKS', '')):
+                ruta = os.environ.get(variable, defecto)
+                if ruta:
+                    self.entorno[variable] = ruta_por_proceso(ruta, indice)
+
+    def atiende(self, shard_id):
+        return self.shard_ids is None or shard_id in self.shard_ids
+
+    def metricas(self):
+        """Métricas del proceso en formato Prometheus junto con las del supervisor"""
+        texto = ''
+        edad = -1
+        try:
+            with open(self.metrics_path, encoding='utf-8') as f:
+                texto = f.read()
+            edad = time.time() - os.path.getmtime(self.metrics_path)
+        except OSError:
+            pass
+        return texto + (
+            '# HELP bot_runner_restarts_total Reinicios del bot hechos por run_bot.py\n'
+            '# TYPE bot_runner_restarts_total counter\n'
+            f'bot_runner_restarts_total {self.reinicios}\n'
+            '# HELP bot_runner_child_up 1 si el proceso del bot está en ejecución\n'
+            '# TYPE bot_runner_child_up gauge\n'
+            f'bot_runner_child_up {self.activo}\n'
+            '# HELP bot_metrics_age_seconds Segundos desde que el bot escribió sus métricas (-1 si no hay)\n'
+            '# TYPE bot_metrics_age_seconds gauge\n'
+            f'bot_metrics_age_seconds {edad:.1f}\n'
+        )
+
+    def terminar(self):
+        if self.proceso is not None and self.proceso.poll() is None:
+            self.proceso.terminate()
+
+    def ejecutar(self, detener):
+        """Ejecuta el proceso con manejo de reinicio automático hasta que termine bien o se agoten los reintentos"""
+        max_retries = 10  # Fallos consecutivos antes de rendirse
+        retry_count = 0
+
+        while retry_count < max_retries and not detener.is_set():
+            try:
+                logger.info(f"🚀 {self.prefijo}Iniciando bot (intento {retry_count + 1}/{max_retries})")
+
+                # Ejecutar el bot con un pipe por el que envía su estado de salud
+                lectura, escritura = crear_canal()
+                try:
+                    self.proceso = subprocess.Popen([
+                        sys.executable, 'bot.py'
+                    ], cwd=os.getcwd(), pass_fds=(escritura,),
+                        env={**os.environ, **self.entorno, HEALTH_FD_ENV: str(escritura)})
+                except Exception:
+                    os.close(lectura)
+                    raise
+                finally:
+                    os.close(escritura)
+                self.activo = 1
+                self.monitor.hijo_iniciado(lectura)
+                inicio = time.monotonic()
+
+                # Esperar a que termine
+                try:
+                    return_code = self.proceso.wait()
+                finally:
+                    self.activo = 0
+                    self.monitor.hijo_terminado()
+                duracion = time.monotonic() - inicio
+
+                if return_code == 0 or detener.is_set():
+                    logger.info(f"✅ {self.prefijo}Bot terminó correctamente")
+                    break
+
+                causa = causa_salida(return_code)
+                logger.warning(f"⚠️ {self.prefijo}Bot terminó con código {return_code} ({causa}) tras {duracion:.0f} segundos")
+                retry_count = fallos_tras_salida(retry_count, duracion)
+                self.reinicios += 1
+
+            except KeyboardInterrupt:
+                logger.info("🛑 Interrupción detectada")
+                break
+            except Exception as e:
+                logger.error(f"❌ {self.prefijo}Error ejecutando el bot: {e}")
+                causa = 'crash'
+                retry_count += 1
+                self.reinicios += 1
+
+            if retry_count < max_retries:
+                wait_time = calcular_espera(causa, retry_count)
+                logger.info(f"⏳ {self.prefijo}Esperando {wait_time:.0f} segundos antes de reiniciar...")
+                # La espera es intencional: /health sigue respondiendo que el proceso está vivo
+                self.monitor.reinicio_programado(wait_time, causa)
+                try:
+                    if detener.wait(wait_time):
+                        break
+                except KeyboardInterrupt:
+                    logger.info("🛑 Interrupción detectada")
+                    break
+
+        if retry_count >= max_retries:
+            logger.error(f"❌ {self.prefijo}Máximo número de reintentos alcanzado")
+            return False
+
+        return True
+
+# Procesos del bot, creados en main() según la configuración de shards
+procesos_bot = []
+
+def planificar_procesos():
+    """Crea un ProcesoBot por grupo de shards según SHARD_COUNT, BOT_PROCESSES y SHARD_RANGES"""
+    total = os.environ.get(shards.SHARD_COUNT_ENV, '').strip().lower()
+    if not total or total == 'auto':
+        if BOT_PROCESSES > 1 or SHARD_RANGES:
+            logger.warning("⚠️ BOT_PROCESSES y SHARD_RANGES necesitan un SHARD_COUNT numérico; se usa un solo proceso")
+        return [ProcesoBot()]
+    plan = shards.planificar(int(total), BOT_PROCESSES, SHARD_RANGES)
+    if len(plan) == 1 and len(plan[0]) == int(total):
+        # Un solo proceso con todos los shards
+        return [ProcesoBot()]
+    return [ProcesoBot(i, ids, len(plan)) for i, ids in enumerate(plan)]
+
+def leer_metricas():
+    """Devuelve las métricas de los procesos del bot y del supervisor en formato Prometheus.
+    Con varios procesos cada muestra lleva la etiqueta proceso"""
+    if len(procesos_bot) == 1:
+        return procesos_bot[0].metricas().encode('utf-8')
+    return combinar({p.nombre: p.metricas() for p in procesos_bot}).encode('utf-8')
+
+def evaluar_salud(shard_id=None):
+    """Evaluación de /health y /ready de todos los procesos, o del proceso y estado de un shard"""
+    if shard_id is not None:
+        proceso = next((p for p in procesos_bot if p.atiende(shard_id)), None)
+        return proceso.monitor.evaluar(shard_id) if proceso else None
+    if len(procesos_bot) == 1:
+        return procesos_bot[0].monitor.evaluar()
+    evaluaciones = {p.nombre: p.monitor.evaluar() for p in procesos_bot}
+    return {
+        'vivo': all(e['vivo'] for e in evaluaciones.values()),
+        'listo': all(e['listo'] for e in evaluaciones.values()),
+        'problemas': [f'{nombre}: {problema}' for nombre, e in evaluaciones.items() for problema in e['problemas']],
+        'procesos': evaluaciones,
+    }
+
 class HealthCheckHandler(BaseHTTPRequestHandler):
-    """Handler simple para health checks de Render"""
+    """Handler para health checks de Render: /health (vida), /ready (disponibilidad) y /metrics.
+    /health/shard/N y /ready/shard/N evalúan el proceso que ejecuta el shard N"""
     def do_GET(self):
-        if self.path == '/health':
+        ruta, _, shard = self.path.partition('/shard/')
+        evaluacion = None
+        if ruta in ('/health', '/ready'):
+            try:
+                evaluacion = evaluar_salud(int(shard) if shard else None)
+            except ValueError:
+                pass
+        if evaluacion is not None:
+            ok = evaluacion['vivo'] if ruta == '/health' else evaluacion['listo']
+            self.send_response(200 if ok else 503)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(evaluacion, ensure_ascii=False).encode('utf-8'))
+        elif self.path == '/metrics':
             self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
             self.end_headers()
-            self.wfile.write(b'OK')
+            self.wfile.write(leer_metricas())
         else:
             self.send_response(404)
             self.end_headers()
@@ -89,56 +335,41 @@ def create_env_file():
     return True
 
 def run_bot():
-    """Ejecuta el bot con manejo de reinicio automático"""
-    max_retries = 10  # Más reintentos para Render
-    retry_count = 0
-
-    while retry_count < max_retries:
-        try:
-            logger.info(f"🚀 Iniciando bot (intento {retry_count + 1}/{max_retries})")
-
-            # Ejecutar el bot
-            process = subprocess.Popen([
-                sys.executable, 'bot.py'
-            ], cwd=os.getcwd())
-
-            # Esperar a que termine
-            return_code = process.wait()
-
-            if return_code == 0:
-                logger.info("✅ Bot terminó correctamente")
-                break
-            else:
-                logger.warning(f"⚠️ Bot terminó con código {return_code}")
-                retry_count += 1
-
-                if retry_count < max_retries:
-                    wait_time = min(120 * retry_count, 1800)  # Máximo 30 minutos
-                    logger.info(f"⏳ Esperando {wait_time} segundos antes de reiniciar...")
-                    time.sleep(wait_time)
-
-        except KeyboardInterrupt:
-            logger.info("🛑 Interrupción detectada")
-            break
-        except Exception as e:
-            logger.error(f"❌ Error ejecutando el bot: {e}")
-            retry_count += 1
+    """Ejecuta los procesos del bot, cada uno con su propio reinicio automático"""
+    detener = threading.Event()
+    if len(procesos_bot) == 1:
+        return procesos_bot[0].ejecutar(detener)
 
-            if retry_count < max_retries:
-                wait_time = min(60 * retry_count, 1800)
-                logger.info(f"⏳ Esperando {wait_time} segundos antes de reiniciar...")
-                time.sleep(wait_time)
-
-    if retry_count >= max_retries:
-        logger.error("❌ Máximo número de reintentos alcanzado")
-        return False
-
-    return True
+    logger.info(f"🧩 {len(procesos_bot)} procesos: " + ', '.join(p.nombre for p in procesos_bot))
+    resultados = {}
+    hilos = [threading.Thread(target=lambda p=p: resultados.__setitem__(p.nombre, p.ejecutar(detener)),
+                              name=p.nombre, daemon=True) for p in procesos_bot]
+    for hilo in hilos:
+        hilo.start()
+    try:
+        for hilo in hilos:
+            while hilo.is_alive():
+                hilo.join(1)
+    except KeyboardInterrupt:
+        logger.info("🛑 Interrupción detectada")
+        detener.set()
+        for proceso in procesos_bot:
+            proceso.terminar()
+        for hilo in hilos:
+            hilo.join(30)
+    # Un proceso que agotó sus reintentos no detiene a los demás, pero el runner termina con error
+    return all(resultados.get(p.nombre, True) for p in procesos_bot)
 
 def main():
     """Función principal"""
     logger.info("🤖 Iniciando Discord Recruitment Bot en Render")
 
+    try:
+        procesos_bot.extend(planificar_procesos())
+    except ValueError as e:
+        logger.error(f"❌ Configuración de shards inválida: {e}")
+        return False
+
     # Iniciar servidor de health check en un hilo separado
     health_thread = threading.Thread(target=start_health_server, daemon=True)
     health_thread.start()
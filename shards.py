@@ -0,0 +1,86 @@
+"""
+Reparto de los shards del gateway de Discord entre procesos de bot.py.
+run_bot.py decide qué shards ejecuta cada proceso (SHARD_COUNT, BOT_PROCESSES o SHARD_RANGES)
+y se los pasa a bot.py en SHARD_IDS; bot.py usa AutoShardedBot con esos IDs. Sin SHARD_COUNT
+el bot funciona como siempre, con una sola conexión.
+"""
+
+import os
+
+# Total de shards: vacío sin sharding, 'auto' para el número que recomienda Discord
+SHARD_COUNT_ENV = 'SHARD_COUNT'
+# Shards de un proceso en formato '0-3,8'
+SHARD_IDS_ENV = 'SHARD_IDS'
+
+
+def parsear_ids(texto):
+    """Convierte '0-3,8' en [0, 1, 2, 3, 8]"""
+    ids = []
+    for parte in texto.split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if '-' in parte:
+            inicio, fin = (int(x) for x in parte.split('-', 1))
+            if fin < inicio:
+                raise ValueError(f'Rango de shards inválido: {parte}')
+            ids.extend(range(inicio, fin + 1))
+        else:
+            ids.append(int(parte))
+    if not ids:
+        raise ValueError(f'Lista de shards vacía: {texto!r}')
+    return ids
+
+
+def formatear_ids(ids):
+    """Convierte [0, 1, 2, 3, 8] en '0-3,8'"""
+    partes = []
+    ids = sorted(ids)
+    inicio = anterior = ids[0]
+    for shard_id in ids[1:] + [None]:
+        if shard_id is not None and shard_id == anterior + 1:
+            anterior = shard_id
+            continue
+        partes.append(str(inicio) if inicio == anterior else f'{inicio}-{anterior}')
+        inicio = anterior = shard_id
+    return ','.join(partes)
+
+
+def planificar(total, procesos=1, rangos=None):
+    """Devuelve la lista de shards de cada proceso.
+    Con rangos ('0-3;4-7') se respetan tal cual (pueden no cubrir todos si otro host ejecuta el resto);
+    si no, los total shards se reparten en procesos bloques contiguos"""
+    if rangos:
+        plan = [parsear_ids(grupo) for grupo in rangos.split(';') if grupo.strip()]
+    else:
+        procesos = max(1, min(procesos, total))
+        base, resto = divmod(total, procesos)
+        plan = []
+        inicio = 0
+        for i in range(procesos):
+            cantidad = base + (1 if i < resto else 0)
+            plan.append(list(range(inicio, inicio + cantidad)))
+            inicio += cantidad
+    vistos = set()
+    for ids in plan:
+        for shard_id in ids:
+            if not 0 <= shard_id < total:
+                raise ValueError(f'El shard {shard_id} está fuera de SHARD_COUNT={total}')
+            if shard_id in vistos:
+                raise ValueError(f'El shard {shard_id} está asignado a más de un proceso')
+            vistos.add(shard_id)
+    return plan
+
+
+def desde_entorno():
+    """Devuelve (shard_count, shard_ids) para AutoShardedBot; (None, None) con SHARD_COUNT=auto
+    deja que Discord decida. Solo tiene sentido si usa_shards()"""
+    total = os.getenv(SHARD_COUNT_ENV, '').strip().lower()
+    if not total or total == 'auto':
+        return None, None
+    ids = os.getenv(SHARD_IDS_ENV, '').strip()
+    return int(total), parsear_ids(ids) if ids else None
+
+
+def usa_shards():
+    return bool(os.getenv(SHARD_COUNT_ENV, '').strip())
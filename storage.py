@@ -0,0 +1,331 @@
+"""
+Motores de almacenamiento para database.py.
+PostgresBackend usa un pool de conexiones psycopg2; SQLiteBackend usa un archivo local
+en modo WAL con una conexión compartida por hilo. Ambos exponen la misma interfaz,
+así que las consultas de database.py se escriben una sola vez con marcadores %s.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import weakref
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psycopg2
+    from psycopg2 import pool as pg_pool
+    from psycopg2.extras import RealDictCursor, execute_values
+    from psycopg2.errors import InvalidSqlStatementName
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+except ImportError:  # Solo es obligatorio para el motor PostgreSQL
+    psycopg2 = None
+
+logger = logging.getLogger('storage')
+
+
+class PostgresBackend:
+    """Pool acotado de conexiones a PostgreSQL con verificación de conexiones inactivas"""
+
+    dialect = 'postgres'
+
+    def __init__(self, database_url, pool_min=1, pool_max=5, statement_timeout_ms=5000,
+                 connect_timeout=10, healthcheck_idle=30):
+        if psycopg2 is None:
+            raise ValueError("psycopg2 no está instalado; instálalo o usa DB_BACKEND=sqlite")
+        if not database_url:
+            raise ValueError("DATABASE_URL no está configurada en las variables de entorno (usa DB_BACKEND=sqlite para una base local)")
+        self.database_url = database_url
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.statement_timeout_ms = statement_timeout_ms
+        self.connect_timeout = connect_timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_max)
+        # Por conexión (referencias débiles: la entrada desaparece cuando el pool cierra la conexión,
+        # así una conexión nueva nunca hereda el estado de otra)
+        self._last_used = weakref.WeakKeyDictionary()
+        # Conexiones prestadas; se actualiza desde varios hilos del executor
+        self._en_uso = 0
+        self._en_uso_lock = threading.Lock()
+        # conexión -> nombres de las sentencias ya preparadas en esa sesión
+        self._preparadas = weakref.WeakKeyDictionary()
+
+    def _get_pool(self):
+        """Crea el pool de conexiones la primera vez que se necesita"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = pg_pool.ThreadedConnectionPool(
+                        self.pool_min,
+                        self.pool_max,
+                        self.database_url,
+                        cursor_factory=RealDictCursor,
+                        connect_timeout=self.connect_timeout,
+                        # Sesiones en UTC: CURRENT_TIMESTAMP guarda lo mismo que en SQLite
+                        options=f'-c statement_timeout={self.statement_timeout_ms} -c timezone=UTC',
+                        keepalives=1,
+                        keepalives_idle=30,
+                    )
+                    logger.info(f'Pool de conexiones creado (min={self.pool_min}, max={self.pool_max})')
+        return self._pool
+
+    def _is_healthy(self, conn):
+        """Verifica una conexión reutilizada antes de entregarla"""
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(conn, 0)
+        if idle < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self, write=False):
+        """Presta una conexión del pool; hace commit al salir o rollback si hay error.
+        write no cambia nada: PostgreSQL no bloquea a los lectores"""
+        pool = self._get_pool()
+        self._slots.acquire()
+        with self._en_uso_lock:
+            self._en_uso += 1
+        conn = None
+        try:
+            conn = pool.getconn()
+            if not self._is_healthy(conn):
+                logger.warning('Conexión inválida descartada del pool')
+                self._last_used.pop(conn, None)
+                self._preparadas.pop(conn, None)
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                self._last_used[conn] = time.monotonic()
+                pool.putconn(conn, close=bool(conn.closed))
+            with self._en_uso_lock:
+                self._en_uso -= 1
+            self._slots.release()
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def ddl(self, sql):
+        return sql
+
+    def lock_migrations(self, cursor, lock_id):
+        # Evita que dos procesos migren a la vez
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (lock_id,))
+
+    def execute_values(self, cursor, sql, rows):
+        """Ejecuta un INSERT ... VALUES %s con todas las filas en un solo envío"""
+        execute_values(cursor, sql, rows)
+
+    def execute_prepared(self, cursor, nombre, sql, params=()):
+        """Ejecuta una consulta del registro con PREPARE/EXECUTE para reutilizar su plan.
+        Cada sentencia se prepara una sola vez por conexión del pool"""
+        conn = cursor.connection
+        preparadas = self._preparadas.setdefault(conn, set())
+        if nombre in preparadas:
+            al_inicio = conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            try:
+                self._execute_preparada(cursor, nombre, params)
+                return
+            except InvalidSqlStatementName:
+                # La sesión ya no tiene la sentencia (DISCARD ALL, un pooler externo...): se olvida
+                # lo registrado y, si no había nada más en la transacción, se prepara de nuevo
+                preparadas.clear()
+                if not al_inicio:
+                    raise
+                conn.rollback()
+        cursor.execute(f'PREPARE {nombre} AS {_a_posicionales(sql)}')
+        preparadas.add(nombre)
+        self._execute_preparada(cursor, nombre, params)
+
+    def _execute_preparada(self, cursor, nombre, params):
+        if params:
+            cursor.execute(f'EXECUTE {nombre} ({", ".join(["%s"] * len(params))})', params)
+        else:
+            cursor.execute(f'EXECUTE {nombre}')
+
+    def is_transient(self, error):
+        # InvalidSqlStatementName: execute_prepared ya olvidó la sentencia, el reintento la prepara
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, InvalidSqlStatementName))
+
+    def stats(self):
+        return {'backend': self.dialect, 'pool_max': self.pool_max, 'pool_in_use': self._en_uso,
+                'prepared': sum(len(nombres) for nombres in list(self._preparadas.values()))}
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+                self._preparadas.clear()
+
+
+@functools.lru_cache(maxsize=512)
+def _traducir_marcadores(sql):
+    return sql.replace('%s', '?')
+
+
+def _a_posicionales(sql):
+    """Convierte los marcadores %s en $1, $2, ... para PREPARE"""
+    partes = sql.split('%s')
+    return partes[0] + ''.join(f'${i}{parte}' for i, parte in enumerate(partes[1:], start=1))
+
+
+class _SQLiteCursor:
+    """Cursor que acepta las consultas con marcadores %s y devuelve filas como dict"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_traducir_marcadores(sql), tuple(params))
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(_traducir_marcadores(sql), [tuple(p) for p in seq_params])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+def _fila_como_dict(cursor, fila):
+    return {columna[0]: valor for columna, valor in zip(cursor.description, fila)}
+
+
+class SQLiteBackend:
+    """Base de datos SQLite local en modo WAL con una conexión por hilo"""
+
+    dialect = 'sqlite'
+
+    def __init__(self, path, busy_timeout_ms=5000, cached_statements=256):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._conexiones = []
+        self._lock = threading.Lock()
+        self._en_uso = 0
+        sqlite3.register_adapter(datetime, lambda fecha: fecha.isoformat(sep=' '))
+
+    def _conexion_del_hilo(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: las transacciones se abren explícitamente en connection()
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                   isolation_level=None, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+            conn.row_factory = _fila_como_dict
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+            self._local.conn = conn
+            with self._lock:
+                self._conexiones.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self, write=False):
+        """Abre una transacción en la conexión del hilo; commit al salir o rollback si hay error.
+        Las de lectura no bloquean a nadie (WAL); las de escritura (write=True) toman el bloqueo al inicio"""
+        conn = self._conexion_del_hilo()
+        # IMMEDIATE evita errores al pasar de lectura a escritura dentro de la transacción
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        with self._lock:
+            self._en_uso += 1
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            with self._lock:
+                self._en_uso -= 1
+
+    def cursor(self, conn):
+        return _SQLiteCursor(conn.cursor())
+
+    def ddl(self, sql):
+        sql = sql.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+        return sql.replace('ADD COLUMN IF NOT EXISTS', 'ADD COLUMN')
+
+    def lock_migrations(self, cursor, lock_id):
+        # Las migraciones abren la transacción con write=True: BEGIN IMMEDIATE ya garantiza un único escritor
+        pass
+
+    def execute_values(self, cursor, sql, rows):
+        """Equivalente de execute_values: un executemany con la sentencia preparada una vez"""
+        rows = list(rows)
+        if not rows:
+            return
+        valores = '(' + ', '.join(['%s'] * len(rows[0])) + ')'
+        cursor.executemany(re.sub(r'VALUES\s+%s', f'VALUES {valores}', sql, count=1), rows)
+
+    def execute_prepared(self, cursor, nombre, sql, params=()):
+        # sqlite3 ya mantiene preparadas las sentencias recientes (cached_statements) por conexión
+        cursor.execute(sql, params)
+
+    def is_transient(self, error):
+        return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+    def stats(self):
+        return {'backend': self.dialect, 'connections': len(self._conexiones), 'pool_in_use': self._en_uso}
+
+    def close(self):
+        with self._lock:
+            for conn in self._conexiones:
+                conn.close()
+            self._conexiones.clear()
+        self._local = threading.local()
+
+
+def create_backend():
+    """Crea el motor indicado por DB_BACKEND (por defecto PostgreSQL; SQLite solo si se pide explícitamente)"""
+    nombre = os.environ.get('DB_BACKEND', 'postgres').lower()
+    if nombre in ('postgres', 'postgresql'):
+        return PostgresBackend(
+            os.environ.get('DATABASE_URL'),
+            pool_min=int(os.environ.get('DB_POOL_MIN', 1)),
+            pool_max=int(os.environ.get('DB_POOL_MAX', 5)),
+            statement_timeout_ms=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000)),
+            connect_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 10)),
+            # Segundos que una conexión puede estar inactiva antes de verificarla con SELECT 1
+            healthcheck_idle=int(os.environ.get('DB_HEALTHCHECK_IDLE', 30)),
+        )
+    if nombre == 'sqlite':
+        return SQLiteBackend(
+            os.environ.get('DB_PATH', 'reclutador.db'),
+            busy_timeout_ms=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000)),
+        )
+    raise ValueError(f"DB_BACKEND desconocido: {nombre} (usa 'postgres' o 'sqlite')")
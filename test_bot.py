@@ -8,6 +8,9 @@ import asyncio
 import logging
 from datetime import datetime
 
+# Las pruebas locales usan SQLite salvo que se indique otro motor
+os.environ.setdefault('DB_BACKEND', 'sqlite')
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -98,6 +101,1137 @@ def test_health_check():
         logger.error(f"❌ Error en health check: {e}")
         return False
 
+def test_member_index():
+    """Prueba el índice de miembros usado para resolver etiquetas"""
+    try:
+        from types import SimpleNamespace
+        from member_index import MemberIndex
+
+        class FakeMember(SimpleNamespace):
+            def __str__(self):
+                return self.tag
+
+        guild = SimpleNamespace(id=1, members=[])
+        staff = SimpleNamespace(id=100, guild=guild)
+        ana = FakeMember(id=10, guild=guild, name='ana', tag='ana#1234', display_name='Ana', roles=[staff])
+        luis = FakeMember(id=11, guild=guild, name='luis', tag='luis', display_name='luis', roles=[])
+        guild.members = [ana, luis]
+
+        index = MemberIndex()
+        assert index.find(guild, 'ana#1234') is ana
+        assert index.find(guild, 'luis') is luis
+        assert index.find(guild, 'ana#9999') is ana  # nombre antes del discriminador
+
+        assert index.members_with_role(guild, staff.id) == [ana]
+
+        # Cambio de nombre y de roles en el mismo evento
+        luis_nuevo = FakeMember(id=11, guild=guild, name='luis2', tag='luis2', display_name='luis2', roles=[staff])
+        index.update(luis, luis_nuevo)
+        assert index.find(guild, 'luis') is None
+        assert index.find(guild, 'luis2') is luis_nuevo
+        # Por ID se encuentra aunque la etiqueta guardada sea la anterior
+        assert index.get(guild, 11) is luis_nuevo and index.get(guild, 99) is None
+        assert sorted(m.id for m in index.members_with_role(guild, staff.id)) == [10, 11]
+
+        index.remove(ana)
+        assert index.find(guild, 'ana#1234') is None
+        assert index.members_with_role(guild, staff.id) == [luis_nuevo]
+
+        index.remove_role(staff)
+        assert index.members_with_role(guild, staff.id) == []
+
+        logger.info("✅ Índice de miembros funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en índice de miembros: {e}")
+        return False
+
+def test_cache():
+    """Prueba la caché de lecturas con TTL e invalidación"""
+    try:
+        from cache import TTLCache
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        llamadas = []
+
+        @cache.cached('miembro', key=lambda etiqueta: etiqueta)
+        def buscar(etiqueta):
+            llamadas.append(etiqueta)
+            return {'etiqueta': etiqueta}
+
+        buscar('ana')
+        buscar('ana')
+        assert llamadas == ['ana'], "La segunda lectura debería salir de la caché"
+
+        cache.invalidate('miembro', 'ana')
+        buscar('ana')
+        assert llamadas == ['ana', 'ana'], "La invalidación debería forzar una nueva lectura"
+
+        buscar('luis')
+        buscar('eva')  # Supera maxsize y expulsa la entrada menos usada
+        assert cache.stats()['entries'] == 2
+        assert cache.stats()['hits'] == 1
+
+        logger.info("✅ Caché funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en caché: {e}")
+        return False
+
+def test_write_queue():
+    """Prueba la cola de escrituras diferidas y su archivo de respaldo"""
+    try:
+        import json
+        import tempfile
+        from write_queue import WriteBehindQueue
+
+        class ErrorTransitorio(Exception):
+            pass
+
+        aplicadas = []
+        fallar = [True]
+
+        async def aplicar(lote):
+            if fallar[0]:
+                raise ErrorTransitorio('base de datos no disponible')
+            aplicadas.extend(e['datos']['etiqueta_miembro'] for e in lote)
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            spill = os.path.join(carpeta, 'pendientes.jsonl')
+            cola = WriteBehindQueue(aplicar, lambda e: isinstance(e, ErrorTransitorio), spill)
+            cola.enqueue('miembro', {'etiqueta_miembro': 'ana', 'etiqueta_reclutador': 'luis'})
+            cola.enqueue('miembro', {'etiqueta_miembro': 'eva', 'etiqueta_reclutador': 'luis'})
+            assert cola.miembro_pendiente(0, 'ana') and not cola.miembro_pendiente(7, 'ana')
+            # La fecha se guarda en UTC, como CURRENT_TIMESTAMP
+            from datetime import datetime, timezone
+            fecha = datetime.fromisoformat(cola._pendientes[0]['datos']['fecha'])
+            assert abs((datetime.now(timezone.utc).replace(tzinfo=None) - fecha).total_seconds()) < 5
+
+            # Un error transitorio deja todo pendiente y persistido
+            assert asyncio.run(cola.flush()) is False
+            assert len(cola) == 2 and cola.stats['reintentos'] == 1
+
+            # Un reinicio recupera las escrituras desde el archivo
+            recuperada = WriteBehindQueue(aplicar, lambda e: isinstance(e, ErrorTransitorio), spill)
+            assert recuperada.cargar_spill() == 2
+
+            fallar[0] = False
+            assert asyncio.run(recuperada.flush()) is True
+            assert aplicadas == ['ana', 'eva']
+            assert not os.path.exists(spill)
+
+            # flush(esperar=True) espera al flush en curso en lugar de volver enseguida
+            async def barrera():
+                liberar = asyncio.Event()
+
+                async def aplicar_lento(lote):
+                    await liberar.wait()
+                    aplicadas.extend(e['datos']['etiqueta_miembro'] for e in lote)
+
+                lenta = WriteBehindQueue(aplicar_lento, lambda e: False, spill)
+                lenta.enqueue('miembro', {'etiqueta_miembro': 'ivo', 'etiqueta_reclutador': 'luis'})
+                en_curso = asyncio.create_task(lenta.flush())
+                await asyncio.sleep(0)
+                lenta.enqueue('miembro', {'etiqueta_miembro': 'leo', 'etiqueta_reclutador': 'luis'})
+                assert await lenta.flush() is False
+                esperando = asyncio.create_task(lenta.flush(esperar=True))
+                await asyncio.sleep(0)
+                assert not esperando.done()
+                liberar.set()
+                await en_curso
+                assert await esperando is True and len(lenta) == 0
+
+                # Durante la espera de reintento, esperar=True reintenta en lugar de devolver False
+                fallar[0] = True
+                recuperada.enqueue('miembro', {'etiqueta_miembro': 'ema', 'etiqueta_reclutador': 'luis'})
+                assert await recuperada.flush() is False
+                fallar[0] = False
+                assert await recuperada.flush() is False
+                assert await recuperada.flush(esperar=True) is True
+
+            asyncio.run(barrera())
+            assert aplicadas[-3:] == ['ivo', 'leo', 'ema'], aplicadas
+
+            # Una escritura rechazada de forma permanente no se pierde: queda en el archivo de descartadas
+            async def rechazar(lote):
+                if any(e['datos']['etiqueta_miembro'] == 'mal' for e in lote):
+                    raise ValueError('Miembro mal no encontrado para la actividad')
+                aplicadas.extend(e['datos']['etiqueta_miembro'] for e in lote)
+
+            descartadas = os.path.join(carpeta, 'descartadas.jsonl')
+            estricta = WriteBehindQueue(rechazar, lambda e: False, spill, descartadas_path=descartadas)
+            estricta.enqueue('actividad', {'etiqueta_miembro': 'mal', 'detalle': 'ZvZ'})
+            estricta.enqueue('miembro', {'etiqueta_miembro': 'bien', 'etiqueta_reclutador': 'luis'})
+            assert asyncio.run(estricta.flush()) is True
+            assert aplicadas[-1] == 'bien' and estricta.stats['descartadas'] == 1
+            with open(descartadas, encoding='utf-8') as f:
+                guardada = json.loads(f.readline())
+            assert guardada['datos']['etiqueta_miembro'] == 'mal' and 'no encontrado' in guardada['error']
+
+        logger.info("✅ Cola de escrituras funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en cola de escrituras: {e}")
+        return False
+
+def test_sqlite_backend():
+    """Prueba las consultas de database.py sobre el motor SQLite local"""
+    try:
+        import tempfile
+        import database
+        from storage import SQLiteBackend, create_backend
+
+        # Sin DATABASE_URL ni DB_BACKEND no se cae a SQLite en silencio
+        entorno = {clave: os.environ.pop(clave, None) for clave in ('DATABASE_URL', 'DB_BACKEND')}
+        try:
+            try:
+                create_backend()
+                raise AssertionError("create_backend no falló sin DATABASE_URL")
+            except ValueError:
+                pass
+        finally:
+            for clave, valor in entorno.items():
+                if valor is not None:
+                    os.environ[clave] = valor
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'prueba.db'), busy_timeout_ms=500))
+            try:
+                database.create_tables()
+                database.add_miembro(1, 'ana#1', 'luis#2', 11, 22)
+                database.add_miembro(1, 'eva#3', 'luis#2', 33, 22)
+                miembro = database.get_miembro_by_etiqueta(1, 'ana#1', 11)
+                database.add_actividad(miembro['id'], 'ZvZ')
+                registrados, faltantes = database.add_actividades_bulk(1, [('ana#1', 11), ('eva#3', 33), ('nadie', None)], 'Gank')
+                assert sorted(registrados) == ['ana#1', 'eva#3'] and faltantes == ['nadie']
+
+                pagina = database.get_reclutados_page(1, 'luis#2', 22, limite=1)
+                assert len(pagina) == 1 and pagina[0]['actividades'] == 2
+                siguiente = database.get_reclutados_page(1, 'luis#2', 22, (pagina[0]['fecha_registro'], pagina[0]['id']), limite=1)
+                assert siguiente[0]['etiqueta_miembro'] == 'eva#3'
+
+                stats = database.get_reclutador_stats(1, 'luis#2', 22)
+                assert stats['reclutados_activos'] == 2 and stats['total_actividades'] == 3
+
+                # Las actividades se borran en cascada y los contadores se descuentan
+                assert database.delete_miembro(1, 'ana#1', 11)
+                assert database.count_actividades_by_miembro(miembro['id']) == 0
+                assert database.get_reclutador_stats(1, 'luis#2', 22)['total_actividades'] == 1
+
+                # Con una escritura en curso, las lecturas de otros hilos no esperan el bloqueo
+                import threading
+                import time
+                lecturas = []
+                leer = lambda: lecturas.append(database.count_reclutados.uncached(1, 'luis#2', 22))
+                with database.get_cursor(write=True) as cursor:
+                    cursor.execute("UPDATE reclutadores SET total_actividades = 5 WHERE etiqueta_reclutador = 'luis#2'")
+                    inicio = time.monotonic()
+                    hilo = threading.Thread(target=leer)
+                    hilo.start()
+                    hilo.join()
+                    assert lecturas == [1] and time.monotonic() - inicio < 0.4, lecturas
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Motor SQLite funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en motor SQLite: {e}")
+        return False
+
+def test_postgres_preparadas():
+    """Prueba el registro de sentencias preparadas por conexión del motor PostgreSQL"""
+    try:
+        import gc
+        import storage
+        if storage.psycopg2 is None:
+            logger.info("⚠️ psycopg2 no está instalado, se omite la prueba de sentencias preparadas")
+            return True
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+        class Conexion:
+            """Sesión falsa: guarda las sentencias preparadas del lado del servidor"""
+            def __init__(self):
+                self.en_servidor = set()
+                self.estado = TRANSACTION_STATUS_IDLE
+                self.enviadas = []
+
+            def get_transaction_status(self):
+                return self.estado
+
+            def rollback(self):
+                self.estado = TRANSACTION_STATUS_IDLE
+
+        class Cursor:
+            def __init__(self, connection):
+                self.connection = connection
+
+            def execute(self, sql, params=()):
+                conn = self.connection
+                palabra, nombre = sql.split()[:2]
+                conn.enviadas.append(palabra)
+                if palabra == 'PREPARE':
+                    conn.en_servidor.add(nombre)
+                elif nombre not in conn.en_servidor:
+                    raise storage.InvalidSqlStatementName(f'prepared statement "{nombre}" does not exist')
+
+        backend = storage.PostgresBackend('postgresql://sin-conexion/prueba')
+        sql = 'SELECT * FROM miembros WHERE id = %s'
+        conn = Conexion()
+        backend.execute_prepared(Cursor(conn), 'q_miembro', sql, (1,))
+        backend.execute_prepared(Cursor(conn), 'q_miembro', sql, (2,))
+        assert conn.enviadas == ['PREPARE', 'EXECUTE', 'EXECUTE'], conn.enviadas
+        assert backend.stats()['prepared'] == 1
+
+        # La sesión perdió la sentencia: fuera de una transacción se prepara de nuevo sin error
+        conn.en_servidor.clear()
+        conn.enviadas.clear()
+        backend.execute_prepared(Cursor(conn), 'q_miembro', sql, (3,))
+        assert conn.enviadas == ['EXECUTE', 'PREPARE', 'EXECUTE'], conn.enviadas
+
+        # Dentro de una transacción el error sube (es transitorio) y la próxima vez se prepara
+        conn.en_servidor.clear()
+        conn.estado = TRANSACTION_STATUS_INTRANS
+        try:
+            backend.execute_prepared(Cursor(conn), 'q_miembro', sql, (4,))
+            assert False, 'se esperaba InvalidSqlStatementName'
+        except storage.InvalidSqlStatementName as e:
+            assert backend.is_transient(e)
+        conn.enviadas.clear()
+        backend.execute_prepared(Cursor(conn), 'q_miembro', sql, (4,))
+        assert conn.enviadas == ['PREPARE', 'EXECUTE'], conn.enviadas
+
+        # Una conexión cerrada por el pool no deja estado para la siguiente
+        del conn
+        gc.collect()
+        assert len(backend._preparadas) == 0 and backend.stats()['prepared'] == 0
+        nueva = Conexion()
+        backend.execute_prepared(Cursor(nueva), 'q_miembro', sql, (5,))
+        assert nueva.enviadas == ['PREPARE', 'EXECUTE'], nueva.enviadas
+
+        logger.info("✅ Sentencias preparadas de PostgreSQL funcionan correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en sentencias preparadas de PostgreSQL: {e}")
+        return False
+
+def test_pool_en_uso():
+    """Prueba que las conexiones en uso que informan los motores no se desvían con varios hilos"""
+    try:
+        import tempfile
+        import threading
+        import storage
+
+        def prestar_desde_hilos(backend, hilos=8, veces=300):
+            maximos = []
+
+            def trabajar():
+                maximo = 0
+                for _ in range(veces):
+                    with backend.connection():
+                        maximo = max(maximo, backend.stats()['pool_in_use'])
+                maximos.append(maximo)
+
+            trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+            for hilo in trabajadores:
+                hilo.start()
+            for hilo in trabajadores:
+                hilo.join()
+            return max(maximos)
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            backend = storage.SQLiteBackend(os.path.join(carpeta, 'en_uso.db'))
+            try:
+                assert 1 <= prestar_desde_hilos(backend) <= 8
+                assert backend.stats()['pool_in_use'] == 0, backend.stats()
+            finally:
+                backend.close()
+
+        if storage.psycopg2 is not None:
+            class Conexion:
+                closed = 0
+
+                def commit(self):
+                    pass
+
+                def rollback(self):
+                    pass
+
+            class Pool:
+                """Pool falso: la prueba solo mide el préstamo de conexiones"""
+                def getconn(self):
+                    return Conexion()
+
+                def putconn(self, conn, close=False):
+                    pass
+
+            backend = storage.PostgresBackend('postgresql://sin-conexion/prueba', pool_max=4)
+            backend._pool = Pool()
+            backend.healthcheck_idle = float('inf')
+            assert 1 <= prestar_desde_hilos(backend) <= 4
+            assert backend.stats()['pool_in_use'] == 0, backend.stats()
+
+        logger.info("✅ Conexiones en uso de los motores son correctas")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en conexiones en uso de los motores: {e}")
+        return False
+
+def test_workload():
+    """Prueba que el generador de carga siembre datos coherentes con el servidor falso"""
+    try:
+        import tempfile
+        import database
+        from storage import SQLiteBackend
+        from workload import Workload, ROL_STAFF_ID
+
+        carga = Workload(reclutadores=5, reclutados=200, actividades=1000, extra=10)
+        assert len(carga.guild.members) == 215
+        assert len(carga.guild.get_role(ROL_STAFF_ID).members) == 5
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'carga.db')))
+            try:
+                database.create_tables()
+                ids = carga.sembrar()
+                assert len(ids) == 200
+                stats = database.get_reclutadores_stats(carga.guild.id)
+                assert sum(fila['reclutados_activos'] for fila in stats) == 200
+                assert sum(fila['total_actividades'] for fila in stats) == 1000
+                reclutador = carga.reclutadores[0]
+                assert database.count_reclutados(carga.guild.id, str(reclutador), reclutador.id) == \
+                    database.get_reclutador_stats(carga.guild.id, str(reclutador), reclutador.id)['reclutados_activos']
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Generador de carga funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en generador de carga: {e}")
+        return False
+
+def test_run_db_cola():
+    """Prueba el executor de base de datos: cola llena, tiempo agotado y contadores de get_executor_stats"""
+    import threading
+    import database
+    liberar = threading.Event()
+    cola_maxima = database.DB_QUEUE_MAX
+    try:
+        def bloquear():
+            liberar.wait(5)
+            return 'ok'
+
+        async def esperar_contadores(queued, running):
+            for _ in range(200):
+                stats = database.get_executor_stats()
+                if stats['queued'] == queued and stats['running'] == running:
+                    return stats
+                await asyncio.sleep(0.01)
+            raise AssertionError(f'contadores inesperados: {database.get_executor_stats()}')
+
+        async def prueba():
+            hilos = database.DB_POOL_MAX
+            database.DB_QUEUE_MAX = 3
+            antes = database.get_executor_stats()
+            # Todos los hilos ocupados y dos trabajos esperando
+            trabajos = [asyncio.ensure_future(database.run_db(bloquear)) for _ in range(hilos + 2)]
+            await esperar_contadores(2, hilos)
+
+            # Se agota el tiempo mientras espera en la cola: se cancela y deja de contar como encolado
+            try:
+                await database.run_db(bloquear, timeout=0.05)
+                raise AssertionError('se esperaba asyncio.TimeoutError')
+            except asyncio.TimeoutError:
+                pass
+            stats = await esperar_contadores(2, hilos)
+            assert stats['timeouts'] == antes['timeouts'] + 1, stats
+
+            # Con la cola llena se rechaza sin encolar
+            trabajos.append(asyncio.ensure_future(database.run_db(bloquear)))
+            await esperar_contadores(3, hilos)
+            try:
+                await database.run_db(bloquear)
+                raise AssertionError('se esperaba DatabaseBusyError')
+            except database.DatabaseBusyError as e:
+                assert database.es_error_transitorio(e)
+            stats = database.get_executor_stats()
+            assert stats['rejected'] == antes['rejected'] + 1 and stats['max_queued'] >= 3, stats
+
+            liberar.set()
+            assert await asyncio.gather(*trabajos) == ['ok'] * (hilos + 3)
+            stats = await esperar_contadores(0, 0)
+            assert stats['completed'] == antes['completed'] + hilos + 3, stats
+
+        asyncio.run(prueba())
+        logger.info("✅ Executor de base de datos funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en executor de base de datos: {e}")
+        return False
+    finally:
+        liberar.set()
+        database.DB_QUEUE_MAX = cola_maxima
+
+def test_metrics():
+    """Prueba el decorador de métricas de los comandos y el formato de /metrics"""
+    try:
+        import tempfile
+        from types import SimpleNamespace
+        import database
+        from storage import SQLiteBackend
+        from metrics import instrumentar, registro
+
+        class Respuesta:
+            async def send_message(self, mensaje):
+                self.mensaje = mensaje
+
+        @instrumentar
+        async def comando_prueba(interaction):
+            total = await database.run_db(database.count_reclutados, 1, 'luis#2')
+            await interaction.response.send_message(f'{total} reclutados')
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'metricas.db')))
+            try:
+                database.create_tables()
+                interaction = SimpleNamespace(response=Respuesta(), followup=None)
+                asyncio.run(comando_prueba(interaction))
+                assert interaction.response.mensaje == '0 reclutados'
+            finally:
+                database.set_backend(None)
+
+        texto = registro.render()
+        assert 'bot_command_duration_seconds_count{command="comando_prueba"} 1' in texto
+        assert 'bot_command_queries_bucket{command="comando_prueba",le="1"} 1' in texto
+        assert 'bot_db_call_duration_seconds_count{function="count_reclutados"}' in texto
+
+        logger.info("✅ Métricas funcionan correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en métricas: {e}")
+        return False
+
+def test_member_cache():
+    """Prueba la caché LRU de miembros del modo de carga diferida"""
+    try:
+        from member_cache import MemberCache
+        from workload import Workload, ROL_STAFF_ID
+
+        carga = Workload(reclutadores=5, reclutados=300, actividades=0)
+        guild = carga.guild
+        guild.cache_completa = False
+        cache = MemberCache(maxsize=100, chunk=50)
+
+        ids = [m.id for m in carga.reclutados[:120]] + [123]  # 123 no está en el servidor
+        encontrados = asyncio.run(cache.fetch(guild, ids))
+        assert len(encontrados) == 120
+        assert guild.solicitudes == 3  # lotes de 50
+        assert len(cache) == 100  # acotada: se descartan los menos usados
+        assert cache.get(guild, carga.reclutados[119].id) is not None
+        assert cache.get(guild, carga.reclutados[0].id) is None
+
+        antes = guild.solicitudes
+        asyncio.run(cache.fetch(guild, [carga.reclutados[119].id]))
+        assert guild.solicitudes == antes  # ya estaba en caché
+
+        # Listar un rol: recorrida por HTTP acotada, más los miembros del rol que ya están en caché
+        staff = guild.get_role(ROL_STAFF_ID)
+        antes = guild.solicitudes
+        miembros, completo = asyncio.run(cache.miembros_con_rol(guild, staff))
+        assert len(miembros) == 5 and completo and guild.solicitudes == antes + 1
+        chica = MemberCache(maxsize=100, limite_rol=3)
+        chica.put(carga.reclutadores[4])
+        miembros, completo = asyncio.run(chica.miembros_con_rol(guild, staff))
+        assert not completo and carga.reclutadores[4] in miembros, miembros
+        # Con la caché de discord.py completa no hay solicitudes
+        guild.cache_completa = True
+        antes = guild.solicitudes
+        assert asyncio.run(cache.miembros_con_rol(guild, staff)) == (staff.members, True)
+        assert guild.solicitudes == antes
+        guild.cache_completa = False
+        assert asyncio.run(cache.buscar_etiqueta(guild, str(carga.reclutadores[3]))) is carga.reclutadores[3]
+
+        logger.info("✅ Caché de miembros funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en caché de miembros: {e}")
+        return False
+
+def test_preparar_base():
+    """Prueba que un arranque con el esquema al día omita la preparación de la base"""
+    try:
+        import tempfile
+        import database
+        from storage import SQLiteBackend
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'arranque.db')))
+            try:
+                assert not database.schema_al_dia()
+                assert database.preparar_base_de_datos() is True
+                assert database.schema_al_dia()
+                assert database.preparar_base_de_datos() is False
+
+                # La carga de reclutadores es una sola sentencia y respeta el marcador de versión
+                with database.get_cursor(write=True) as cursor:
+                    cursor.executemany(
+                        'INSERT INTO miembros (etiqueta_miembro, etiqueta_reclutador, fecha_registro) VALUES (%s, %s, %s)',
+                        [('a#1', 'ana#1', '2024-01-01 10:00:00'), ('b#1', 'ana#1', '2024-02-01 10:00:00'),
+                         ('c#1', 'luis#2', '2024-03-01 10:00:00')])
+                assert database.initialize_reclutadores_table() is False
+                assert database.initialize_reclutadores_table(forzar=True) is True
+                with database.get_cursor() as cursor:
+                    cursor.execute('SELECT etiqueta_reclutador, total_reclutados, reclutados_activos FROM reclutadores ORDER BY etiqueta_reclutador')
+                    filas = [(f['etiqueta_reclutador'], f['total_reclutados'], f['reclutados_activos']) for f in cursor.fetchall()]
+                assert filas == [('ana#1', 2, 2), ('luis#2', 1, 1)], filas
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Preparación de la base funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en preparación de la base: {e}")
+        return False
+
+def test_servidores():
+    """Prueba que los datos y la configuración de cada servidor estén separados"""
+    try:
+        import tempfile
+        import database
+        from storage import SQLiteBackend
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'servidores.db')))
+            try:
+                database.preparar_base_de_datos()
+                # Datos guardados antes de separar por servidor
+                with database.get_cursor(write=True) as cursor:
+                    cursor.execute("INSERT INTO miembros (etiqueta_miembro, etiqueta_reclutador) VALUES ('viejo#1', 'luis#2')")
+                database.initialize_reclutadores_table(forzar=True)
+
+                # El mismo reclutador y reclutado en dos servidores no se mezclan
+                database.add_miembro(1, 'ana#1', 'luis#2', 11, 22)
+                database.add_miembro(2, 'ana#1', 'luis#2', 11, 22)
+                database.add_miembro(2, 'eva#3', 'luis#2', 33, 22)
+                miembro = database.get_miembro_by_etiqueta(2, 'ana#1', 11)
+                database.add_actividad(miembro['id'], 'ZvZ')
+                assert database.count_reclutados(1, 'luis#2', 22) == 1
+                assert database.count_reclutados(2, 'luis#2', 22) == 2
+                assert database.get_reclutador_stats(1, 'luis#2', 22)['total_actividades'] == 0
+                assert [f['reclutados_activos'] for f in database.get_reclutadores_stats(2)] == [2]
+
+                assert database.delete_miembro(1, 'ana#1', 11)
+                assert database.get_miembro_by_etiqueta(1, 'ana#1', 11) is None
+                assert database.get_miembro_by_etiqueta(2, 'ana#1', 11) is not None
+                assert database.clear_reclutador(1, 'luis#2', 22) == 0
+                assert database.count_reclutados(2, 'luis#2', 22) == 2
+
+                # Configuración por servidor
+                assert database.get_servidor_config(1) is None
+                database.set_rol_staff(1, 555)
+                database.set_rol_staff(1, 777)
+                assert database.get_servidor_config(1)['rol_staff_id'] == 777
+                assert database.get_servidor_config(2) is None
+
+                # Los datos antiguos pasan al servidor que los reclama
+                assert database.asignar_datos_sin_servidor(1) == 1
+                assert database.count_reclutados(1, 'luis#2') == 1
+                assert database.get_reclutador_stats(1, 'luis#2', 22)['reclutados_activos'] == 1
+                assert database.asignar_datos_sin_servidor(2) == 0
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Datos por servidor funcionan correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en datos por servidor: {e}")
+        return False
+
+def test_ranking():
+    """Prueba que el ranking semanal y mensual se mantenga en cada escritura y coincida con la recarga"""
+    try:
+        import tempfile
+        from datetime import date
+        import database
+        from storage import SQLiteBackend
+
+        assert database.inicio_periodo('semana', '2024-01-10 12:00:00') == date(2024, 1, 8)
+        assert database.inicio_periodo('mes', date(2024, 1, 10)) == date(2024, 1, 1)
+        assert database.retroceder_periodo('mes', date(2024, 1, 1), 2) == date(2023, 11, 1)
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'ranking.db')))
+            try:
+                database.preparar_base_de_datos()
+                database.add_miembro(1, 'a#1', 'ana#1', 11, 1, '2024-01-08 10:00:00')
+                database.add_miembro(1, 'b#1', 'ana#1', 12, 1, '2024-01-09 10:00:00')
+                database.add_miembro(1, 'c#1', 'luis#2', 13, 2, '2024-01-20 10:00:00')
+                database.add_actividad(database.get_miembro_by_etiqueta(1, 'a#1', 11)['id'], 'ZvZ', '2024-01-10 10:00:00')
+                database.add_actividad(database.get_miembro_by_etiqueta(1, 'c#1', 13)['id'], 'ZvZ', '2024-01-21 10:00:00')
+                database.add_actividad(database.get_miembro_by_etiqueta(1, 'c#1', 13)['id'], 'ZvZ', '2024-01-22 10:00:00')
+
+                def filas():
+                    with database.get_cursor() as cursor:
+                        cursor.execute('''SELECT periodo, inicio, etiqueta_reclutador, reclutados, retenidos, actividades,
+                                                 actividades_reclutados
+                                          FROM ranking_reclutadores ORDER BY periodo, inicio, etiqueta_reclutador''')
+                        return [tuple(f.values()) for f in cursor.fetchall()]
+
+                incremental = filas()
+                assert ('mes', '2024-01-01', 'ana#1', 2, 2, 1, 1) in incremental, incremental
+                # Las actividades de c#1 cuentan en la semana de cada una y las dos en la de su registro
+                assert ('semana', '2024-01-15', 'luis#2', 1, 1, 1, 2) in incremental, incremental
+                assert ('semana', '2024-01-22', 'luis#2', 0, 0, 1, 0) in incremental, incremental
+                # La recarga desde miembros y actividades llega a lo mismo
+                assert database.initialize_ranking_table() is False
+                assert database.initialize_ranking_table(forzar=True) is True
+                assert filas() == incremental, filas()
+
+                # Al eliminar un reclutado se descuentan sus períodos; reclutados queda como histórico
+                assert database.delete_miembro(1, 'a#1', 11)
+                assert ('mes', '2024-01-01', 'ana#1', 2, 1, 0, 0) in filas(), filas()
+
+                # Período actual según el reloj de la base, ordenado por el criterio
+                database.add_miembro(1, 'd#1', 'luis#2', 14, 2)
+                database.add_actividades_bulk(1, [('d#1', 14), ('c#1', 13)], 'GvG')
+                for _ in range(3):
+                    database.add_actividad(database.get_miembro_by_etiqueta(1, 'c#1', 13)['id'], 'ZvZ')
+                # ana#1 no tiene reclutados esta semana, solo actividad de uno anterior
+                database.add_actividad(database.get_miembro_by_etiqueta(1, 'b#1', 12)['id'], 'ZvZ')
+                inicio, ranking = database.get_ranking(1, 'semana', 'actividades')
+                # Las 4 actividades de c#1 (de otra semana) no cuentan para el promedio del reclutado de esta semana
+                assert [(f['etiqueta_reclutador'], f['reclutados'], f['actividades'], f['actividades_reclutados'])
+                        for f in ranking] == [('luis#2', 1, 5, 1)], ranking
+                assert ranking[0]['actividades_por_reclutado'] == 1.0
+                assert [f['etiqueta_reclutador'] for f in database.get_ranking(1, 'semana', 'reclutados')[1]] == ['luis#2']
+                # La recarga llega a lo mismo salvo los reclutados históricos ya eliminados (a#1)
+                sin_historicos = lambda: [f[:3] + f[4:] for f in filas()]
+                antes = sin_historicos()
+                assert database.initialize_ranking_table(forzar=True) is True
+                assert sin_historicos() == antes, filas()
+                assert database.get_ranking(2, 'semana')[1] == []
+                assert database.get_ranking(1, 'mes', anteriores=1)[0] < inicio
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Ranking de reclutadores funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en ranking de reclutadores: {e}")
+        return False
+
+def test_borrado_masivo():
+    """Prueba clear_reclutadores con varios reclutadores y delete_miembros con varios IDs"""
+    try:
+        import tempfile
+        import database
+        from storage import SQLiteBackend
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteBackend(os.path.join(carpeta, 'borrado.db')))
+            try:
+                database.preparar_base_de_datos()
+                fecha = '2024-01-10 10:00:00'
+                for etiqueta, reclutador, id_miembro, id_reclutador in (
+                        ('a#1', 'ana#1', 11, 1), ('b#1', 'ana#1', 12, 1), ('c#1', 'luis#2', 13, 2),
+                        ('d#1', 'eva#3', 14, 3), ('e#1', 'eva#3', 15, 3), ('f#1', 'eva#3', 16, 3)):
+                    database.add_miembro(1, etiqueta, reclutador, id_miembro, id_reclutador, fecha)
+                ids = {etiqueta: database.get_miembro_by_etiqueta(1, etiqueta, id_discord)['id']
+                       for etiqueta, id_discord in (('a#1', 11), ('c#1', 13), ('d#1', 14), ('e#1', 15))}
+                for etiqueta in ('a#1', 'a#1', 'c#1', 'd#1', 'e#1', 'e#1'):
+                    database.add_actividad(ids[etiqueta], 'ZvZ', fecha)
+
+                def ranking(etiqueta):
+                    with database.get_cursor() as cursor:
+                        cursor.execute('''SELECT periodo, reclutados, retenidos, actividades, actividades_reclutados
+                                          FROM ranking_reclutadores WHERE guild_id = 1 AND etiqueta_reclutador = %s
+                                          ORDER BY periodo''', (etiqueta,))
+                        return [tuple(f.values()) for f in cursor.fetchall()]
+
+                eva = ranking('eva#3')
+                assert eva == [('mes', 3, 3, 3, 3), ('semana', 3, 3, 3, 3)], eva
+
+                # Dos reclutadores en una llamada (ana#1 también por etiqueta): cuentas y ranking fuera
+                conteos = database.clear_reclutadores(1, [('ana#1', 1), ('luis#2', 2), ('ana#1', None)])
+                assert conteos == {'ana#1': 2, 'luis#2': 1}, conteos
+                assert ranking('ana#1') == [] and ranking('luis#2') == []
+                assert ranking('eva#3') == eva
+                stats = {f['etiqueta_reclutador']: f for f in database.get_reclutadores_stats(1)}
+                assert stats['ana#1']['reclutados_activos'] == 0 and stats['luis#2']['total_actividades'] == 0
+                assert database.count_reclutados(1, 'eva#3', 3) == 3
+
+                # Varios IDs a la vez: se descuentan una sola vez de su reclutador y del ranking
+                assert database.delete_miembros([ids['d#1'], ids['e#1'], ids['a#1']]) == 2
+                assert ranking('eva#3') == [('mes', 3, 1, 0, 0), ('semana', 3, 1, 0, 0)], ranking('eva#3')
+                eva_stats = database.get_reclutador_stats(1, 'eva#3', 3)
+                assert eva_stats['reclutados_activos'] == 1 and eva_stats['total_actividades'] == 0, eva_stats
+                assert database.delete_miembros([ids['d#1']]) == 0 and database.delete_miembros([]) == 0
+                assert ranking('eva#3')[0] == ('mes', 3, 1, 0, 0)
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Borrado masivo funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en borrado masivo: {e}")
+        return False
+
+def test_actividad_diaria():
+    """Prueba la actividad diaria por miembro y las consultas de reclutados inactivos"""
+    try:
+        import re
+        import tempfile
+        from datetime import datetime, timedelta, timezone
+        import database
+        from storage import SQLiteBackend
+
+        enviadas = []
+
+        class CursorRegistrado:
+            """Guarda el SQL de cada consulta para revisarlo aparte del motor"""
+            def __init__(self, cursor):
+                self._cursor = cursor
+
+            def execute(self, sql, params=()):
+                enviadas.append(sql)
+                return self._cursor.execute(sql, params)
+
+            def __getattr__(self, nombre):
+                return getattr(self._cursor, nombre)
+
+        class SQLiteRegistrado(SQLiteBackend):
+            def cursor(self, conn):
+                return CursorRegistrado(super().cursor(conn))
+
+        def alias_en_expresiones_del_order_by(sql):
+            """Alias de la salida usados dentro de expresiones del ORDER BY externo: PostgreSQL solo
+            los acepta como nombre suelto (SQLite los acepta siempre)"""
+            nivel, externo = 0, []
+            for caracter in sql:
+                nivel += caracter == '('
+                externo.append(caracter if nivel == 0 else ' ')
+                nivel -= caracter == ')'
+            externo = ''.join(externo)
+            posicion = externo.upper().rfind('ORDER BY')
+            if posicion < 0:
+                return set()
+            alias = set(re.findall(r'\bAS\s+(\w+)', externo[:posicion], re.IGNORECASE))
+            usados = set()
+            for expresion in re.split(r',(?![^()]*\))', sql[posicion + len('ORDER BY'):]):
+                expresion = re.sub(r'\s+(ASC|DESC)\s*$', '', expresion.strip(), flags=re.IGNORECASE)
+                if not re.fullmatch(r'\w+(\.\w+)?', expresion):
+                    usados |= alias & set(re.findall(r'\w+', expresion))
+            return usados
+
+        assert alias_en_expresiones_del_order_by('SELECT MAX(x) AS u FROM t ORDER BY u IS NOT NULL, u') == {'u'}
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            database.set_backend(SQLiteRegistrado(os.path.join(carpeta, 'actividad.db')))
+            try:
+                database.preparar_base_de_datos()
+                # Fechas relativas a hoy en UTC, el reloj de SQLite
+                hoy = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+                hace = lambda dias: (hoy - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+                database.add_miembro(1, 'a#1', 'ana#1', 11, 1, hace(60))
+                database.add_miembro(1, 'b#1', 'ana#1', 12, 1, hace(60))
+                database.add_miembro(1, 'c#1', 'luis#2', 13, 2, hace(60))
+                database.add_miembro(1, 'nuevo#1', 'luis#2', 14, 2, hace(2))
+                a = database.get_miembro_by_etiqueta(1, 'a#1', 11)['id']
+                b = database.get_miembro_by_etiqueta(1, 'b#1', 12)['id']
+                database.add_actividad(a, 'ZvZ', hace(20))
+                database.add_actividad(a, 'ZvZ', hace(20))
+                database.add_actividad(b, 'ZvZ', hace(10))
+                database.add_actividades_bulk(1, [('b#1', 12)], 'GvG')
+
+                with database.get_cursor() as cursor:
+                    cursor.execute('SELECT id_miembro, dia, actividades FROM actividad_diaria ORDER BY id_miembro, dia')
+                    incremental = [tuple(f.values()) for f in cursor.fetchall()]
+                assert [(f[0], f[2]) for f in incremental] == [(a, 2), (b, 1), (b, 1)], incremental
+                # La recarga desde actividades llega a lo mismo
+                assert database.initialize_actividad_diaria_table() is False
+                assert database.initialize_actividad_diaria_table(forzar=True) is True
+                with database.get_cursor() as cursor:
+                    cursor.execute('SELECT id_miembro, dia, actividades FROM actividad_diaria ORDER BY id_miembro, dia')
+                    assert [tuple(f.values()) for f in cursor.fetchall()] == incremental
+
+                ultimo_dia, por_ventana = database.get_resumen_actividad(b)
+                assert ultimo_dia == hoy.date() and por_ventana == {7: 1, 14: 2, 30: 2}, por_ventana
+                assert database.get_resumen_actividad(a)[1] == {7: 0, 14: 0, 30: 2}
+
+                # Nunca activos primero; el reclutado de hace 2 días todavía no cuenta
+                inactivos = [(f['etiqueta_reclutador'], f['etiqueta_miembro']) for f in database.get_reclutados_inactivos(1, 7)]
+                assert inactivos == [('ana#1', 'a#1'), ('luis#2', 'c#1')], inactivos
+                assert [f['etiqueta_miembro'] for f in database.get_reclutados_inactivos(1, 30, 'ana#1', 1)] == []
+                assert [f['etiqueta_miembro'] for f in database.get_reclutados_inactivos(1, 1, 'ana#1', 1)] == ['a#1']
+                assert database.get_reclutados_inactivos(2, 7) == []
+                consulta = next(sql for sql in reversed(enviadas) if 'NOT EXISTS' in sql)
+                assert not alias_en_expresiones_del_order_by(consulta), consulta
+
+                # Escrituras reintentadas con fechas anteriores no hacen retroceder las últimas fechas
+                stats = database.get_reclutador_stats(1, 'ana#1', 1)
+                database.add_actividad(a, 'Reintento', hace(40))
+                database.add_miembro(1, 'viejo#1', 'ana#1', 15, 1, hace(90))
+                nuevas = database.get_reclutador_stats(1, 'ana#1', 1)
+                # La última sigue siendo la de la actividad grupal de hoy
+                assert nuevas['ultima_actividad'] == stats['ultima_actividad'] > hace(1), nuevas
+                assert nuevas['ultimo_reclutamiento'] == stats['ultimo_reclutamiento'] == hace(60), nuevas
+                assert nuevas['total_actividades'] == stats['total_actividades'] + 1
+                # Dentro de un reclutador, primero los que nunca tuvieron actividad
+                assert [f['etiqueta_miembro'] for f in database.get_reclutados_inactivos(1, 7, 'ana#1', 1)] == ['viejo#1', 'a#1']
+
+                # Se borra en cascada con el miembro
+                assert database.delete_miembro(1, 'a#1', 11)
+                with database.get_cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) AS n FROM actividad_diaria WHERE id_miembro = %s', (a,))
+                    assert cursor.fetchone()['n'] == 0
+            finally:
+                database.set_backend(None)
+
+        logger.info("✅ Actividad diaria funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en actividad diaria: {e}")
+        return False
+
+def test_health():
+    """Prueba el canal de salud entre el bot y run_bot.py"""
+    try:
+        import time
+        from health import HealthReporter, HealthMonitor, crear_canal
+
+        monitor = HealthMonitor(lag_maximo=0.5)
+        lectura, escritura = crear_canal()
+        monitor.hijo_iniciado(lectura)
+        assert monitor.evaluar()['vivo'] and not monitor.evaluar()['listo']
+
+        reporter = HealthReporter(None, fd=escritura)
+        reporter._enviar({'gateway_conectado': True, 'db_ok': True, 'lag_loop': 0.01})
+        for _ in range(50):
+            if monitor._reporte is not None:
+                break
+            time.sleep(0.01)
+        monitor._evaluaciones.clear()
+        evaluacion = monitor.evaluar()
+        assert evaluacion['vivo'] and evaluacion['listo'], evaluacion
+
+        reporter._enviar({'gateway_conectado': True, 'db_ok': False, 'db_error': 'sin conexión', 'lag_loop': 0.01})
+        time.sleep(0.1)
+        monitor._evaluaciones.clear()
+        evaluacion = monitor.evaluar()
+        assert evaluacion['vivo'] and not evaluacion['listo'], evaluacion
+
+        os.close(escritura)
+        monitor.hijo_terminado()
+        monitor.gracia_caido = 0
+        assert not monitor.evaluar()['vivo']
+
+        # Durante un backoff largo del supervisor sigue vivo (no se reinicia el contenedor) pero no listo
+        monitor.reinicio_programado(300, 'rate_limit')
+        evaluacion = monitor.evaluar()
+        assert evaluacion['vivo'] and not evaluacion['listo'], evaluacion
+        assert 'rate_limit' in evaluacion['problemas'][0]
+        monitor.reinicio_programado(-1, 'rate_limit')
+        assert not monitor.evaluar()['vivo']
+
+        logger.info("✅ Health checks funcionan correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en health checks: {e}")
+        return False
+
+def test_errores_comandos():
+    """Prueba que un comando que captura su propio error cuenta en la tasa de errores y /ready da 503"""
+    try:
+        import threading
+        import time
+        import urllib.error
+        import urllib.request
+        from http.server import HTTPServer
+        from types import SimpleNamespace
+        from health import HealthReporter, HealthMonitor, crear_canal
+        from metrics import instrumentar, marcar_error, registro
+        import run_bot
+
+        class Respuesta:
+            def is_done(self):
+                return False
+
+            async def send_message(self, mensaje):
+                self.mensaje = mensaje
+
+        @instrumentar
+        async def comando_fallido(interaction):
+            try:
+                raise RuntimeError('base de datos caída')
+            except Exception as e:
+                marcar_error()
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(f'Error al consultar datos: {str(e)}')
+
+        comandos_antes = registro.total('bot_command_duration_seconds')
+        errores_antes = registro.total('bot_command_errors_total')
+        for _ in range(5):
+            interaction = SimpleNamespace(response=Respuesta(), followup=None)
+            asyncio.run(comando_fallido(interaction))
+            assert interaction.response.mensaje.startswith('Error al consultar datos')
+        comandos = registro.total('bot_command_duration_seconds') - comandos_antes
+        errores = registro.total('bot_command_errors_total') - errores_antes
+        assert comandos == 5 and errores == 5, (comandos, errores)
+
+        monitor = HealthMonitor()
+        lectura, escritura = crear_canal()
+        monitor.hijo_iniciado(lectura)
+        reporter = HealthReporter(None, fd=escritura)
+        reporter._enviar({'gateway_conectado': True, 'db_ok': True, 'lag_loop': 0.01,
+                          'comandos_5m': comandos, 'tasa_errores_5m': errores / comandos})
+        for _ in range(50):
+            if monitor._reporte is not None:
+                break
+            time.sleep(0.01)
+
+        procesos = run_bot.procesos_bot[:]
+        run_bot.procesos_bot[:] = [SimpleNamespace(monitor=monitor)]
+        servidor = HTTPServer(('127.0.0.1', 0), run_bot.HealthCheckHandler)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{servidor.server_address[1]}'
+            with urllib.request.urlopen(url + '/health') as respuesta:
+                assert respuesta.status == 200
+            try:
+                urllib.request.urlopen(url + '/ready')
+                raise AssertionError('/ready respondió 200 con todos los comandos fallando')
+            except urllib.error.HTTPError as e:
+                assert e.code == 503, e.code
+                assert 'con error' in e.read().decode('utf-8')
+        finally:
+            servidor.shutdown()
+            servidor.server_close()
+            run_bot.procesos_bot[:] = procesos
+            os.close(escritura)
+            monitor.hijo_terminado()
+
+        logger.info("✅ Errores de comandos cuentan para /ready")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en errores de comandos: {e}")
+        return False
+
+def test_reinicios():
+    """Prueba la clasificación de las salidas de bot.py y la espera antes de reiniciarlo"""
+    try:
+        import random
+        import run_bot
+        from exit_codes import EXIT_DATABASE, EXIT_RATE_LIMITED, EXIT_CONFIG
+
+        assert run_bot.causa_salida(EXIT_DATABASE) == 'base_de_datos'
+        assert run_bot.causa_salida(EXIT_RATE_LIMITED) == 'rate_limit'
+        assert run_bot.causa_salida(EXIT_CONFIG) == 'configuracion'
+        assert run_bot.causa_salida(1) == 'crash'
+        assert run_bot.causa_salida(-9) == 'senal'
+
+        random.seed(7)
+        for causa, (base, maximo) in run_bot.BACKOFF.items():
+            esperas = {fallos: [run_bot.calcular_espera(causa, fallos) for _ in range(50)] for fallos in range(1, 16)}
+            # Nunca menos que la base ni más que el máximo
+            assert all(base <= espera <= maximo for lista in esperas.values() for espera in lista), causa
+            # Crece con los fallos consecutivos hasta llegar al máximo
+            assert max(esperas[1]) < min(esperas[3]) or base * 4 > maximo, causa
+            assert all(espera >= maximo / 2 for espera in esperas[15]), causa
+        assert run_bot.calcular_espera('crash', 1) == run_bot.BACKOFF['crash'][0]
+
+        # Un fallo tras un rato estable vuelve a contar desde uno
+        assert run_bot.fallos_tras_salida(0, 1) == 1
+        assert run_bot.fallos_tras_salida(4, run_bot.STABLE_SECONDS - 1) == 5
+        assert run_bot.fallos_tras_salida(4, run_bot.STABLE_SECONDS) == 1
+
+        logger.info("✅ Reinicios del supervisor funcionan correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en reinicios del supervisor: {e}")
+        return False
+
+def test_shards():
+    """Prueba el reparto de shards entre procesos, su salud y la unión de sus métricas"""
+    try:
+        import time
+        import shards
+        from health import HealthMonitor
+        from metrics import combinar
+
+        assert shards.parsear_ids('0-3, 8') == [0, 1, 2, 3, 8]
+        assert shards.formatear_ids([8, 0, 1, 2, 3, 5]) == '0-3,5,8'
+        assert shards.planificar(8, 3) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+        assert shards.planificar(2, 5) == [[0], [1]]
+        assert shards.planificar(16, rangos='0-3;8-9') == [[0, 1, 2, 3], [8, 9]]
+        for rangos in ('0-3;3-4', '0-16'):
+            try:
+                shards.planificar(16, rangos=rangos)
+                assert False, rangos
+            except ValueError:
+                pass
+
+        # Un shard caído no quita la disponibilidad de los otros shards del proceso
+        monitor = HealthMonitor()
+        monitor._hijo_activo = True
+        monitor._recibido = time.monotonic()
+        monitor._reporte = {'gateway_conectado': False, 'db_ok': True,
+                            'shards': [[4, True, 0.05], [5, False, None]]}
+        assert monitor.evaluar(4)['listo'] and monitor.evaluar(4)['shard'] == [4, True, 0.05]
+        assert not monitor.evaluar(5)['listo'] and not monitor.evaluar()['listo']
+
+        texto = combinar({
+            'shards 0-1': '# HELP bot_db_queries_total Consultas\n# TYPE bot_db_queries_total counter\nbot_db_queries_total 3\n',
+            'shards 2-3': '# HELP bot_db_queries_total Consultas\n# TYPE bot_db_queries_total counter\n'
+                          'bot_db_queries_total 5\n# TYPE bot_command_rows histogram\nbot_command_rows_bucket{le="1"} 2\n',
+        })
+        assert texto.count('# TYPE bot_db_queries_total counter') == 1
+        assert 'bot_db_queries_total{proceso="shards 2-3"} 5' in texto
+        assert 'bot_command_rows_bucket{proceso="shards 2-3",le="1"} 2' in texto
+
+        logger.info("✅ Reparto de shards funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en reparto de shards: {e}")
+        return False
+
+def test_loop_monitor():
+    """Prueba que el perfilador del event loop detecte un callback bloqueante"""
+    try:
+        import time
+        import json
+        import tempfile
+        from loop_monitor import LoopMonitor
+
+        async def bloquear():
+            time.sleep(0.3)
+
+        async def escenario(monitor):
+            tarea = asyncio.create_task(monitor.ejecutar())
+            await asyncio.sleep(0.1)
+            await bloquear()
+            await asyncio.sleep(0.2)
+            tarea.cancel()
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            reportes = os.path.join(carpeta, 'bloqueos.jsonl')
+            pilas = os.path.join(carpeta, 'pilas.folded')
+            monitor = LoopMonitor(intervalo=0.02, umbral=0.1, reportes_path=reportes, pilas_path=pilas)
+            asyncio.run(escenario(monitor))
+            assert monitor.bloqueos == 1
+            assert monitor.tomar_lag_maximo() >= 0.2
+            with open(reportes, encoding='utf-8') as f:
+                reporte = json.loads(f.readline())
+            assert reporte['origen'].startswith('bloquear (test_bot.py:'), reporte
+            assert 150 <= reporte['duracion_ms'] <= 400, reporte
+            with open(pilas, encoding='utf-8') as f:
+                assert 'escenario (test_bot.py:' in f.read()
+
+        logger.info("✅ Monitor del event loop funciona correctamente")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error en monitor del event loop: {e}")
+        return False
+
 async def test_bot_initialization():
     """Prueba la inicialización del bot (sin conectar)"""
     try:
@@ -128,6 +1262,26 @@ def main():
         ("Base de datos", test_database),
         ("Variables de entorno", test_environment),
         ("Health check", test_health_check),
+        ("Índice de miembros", test_member_index),
+        ("Caché", test_cache),
+        ("Cola de escrituras", test_write_queue),
+        ("Motor SQLite", test_sqlite_backend),
+        ("Sentencias preparadas de PostgreSQL", test_postgres_preparadas),
+        ("Conexiones en uso de los motores", test_pool_en_uso),
+        ("Generador de carga", test_workload),
+        ("Métricas", test_metrics),
+        ("Caché de miembros", test_member_cache),
+        ("Preparación de la base", test_preparar_base),
+        ("Varios servidores", test_servidores),
+        ("Ranking de reclutadores", test_ranking),
+        ("Borrado masivo", test_borrado_masivo),
+        ("Actividad diaria", test_actividad_diaria),
+        ("Health checks", test_health),
+        ("Errores de comandos en /ready", test_errores_comandos),
+        ("Executor de base de datos", test_run_db_cola),
+        ("Reinicios del supervisor", test_reinicios),
+        ("Monitor del event loop", test_loop_monitor),
+        ("Shards", test_shards),
     ]
 
     passed = 0
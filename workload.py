@@ -0,0 +1,155 @@
+"""
+Generador de cargas sintéticas para los benchmarks.
+Crea un servidor de Discord falso (miembros, roles) y siembra la base de datos con
+reclutadores, reclutados y actividades coherentes con ese servidor.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import database
+
+# Rol de staff que consulta /ver_staff
+ROL_STAFF_ID = 1404279446780772422
+
+
+class FakeRole:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.members = []
+
+
+class FakeMember:
+    """Miembro con los atributos que usan bot.py y member_index.py"""
+
+    def __init__(self, id, name, guild, roles=(), display_name=None, bot=False):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.roles = list(roles)
+        self.display_name = display_name or name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+    def get_role(self, rol_id):
+        return next((rol for rol in self.roles if rol.id == rol_id), None)
+
+
+class FakeGuild:
+    def __init__(self, id, name='Servidor de prueba'):
+        self.id = id
+        self.name = name
+        self.members = []
+        self.roles = []
+        self._por_id = {}
+        # False simula MEMBER_LOADING=lazy: get_member no encuentra a nadie y hay que pedirlos
+        self.cache_completa = True
+        # Solicitudes de miembros hechas a "Discord" (query_members y páginas de fetch_members)
+        self.solicitudes = 0
+
+    def add_role(self, rol):
+        self.roles.append(rol)
+        return rol
+
+    def add_member(self, member):
+        self.members.append(member)
+        self._por_id[member.id] = member
+        for rol in member.roles:
+            rol.members.append(member)
+        return member
+
+    def get_role(self, rol_id):
+        return next((rol for rol in self.roles if rol.id == rol_id), None)
+
+    @property
+    def chunked(self):
+        return self.cache_completa
+
+    def get_member(self, member_id):
+        return self._por_id.get(member_id) if self.cache_completa else None
+
+    async def query_members(self, query=None, *, limit=5, user_ids=None, presences=False, cache=True):
+        self.solicitudes += 1
+        if user_ids is not None:
+            return [self._por_id[i] for i in user_ids[:100] if i in self._por_id]
+        return [m for m in self.members if m.name.startswith(query)][:limit]
+
+    async def fetch_members(self, limit=1000):
+        for inicio in range(0, len(self.members) if limit is None else min(limit, len(self.members)), 1000):
+            self.solicitudes += 1
+            for member in self.members[inicio:inicio + 1000]:
+                yield member
+
+
+class Workload:
+    """Servidor falso y datos de reclutamiento generados con una semilla fija"""
+
+    def __init__(self, reclutadores=50, reclutados=5000, actividades=25000, extra=0, seed=1):
+        rng = random.Random(seed)
+        self.guild = FakeGuild(1)
+        everyone = self.guild.add_role(FakeRole(1, '@everyone'))
+        staff = self.guild.add_role(FakeRole(ROL_STAFF_ID, 'Staff'))
+        for i in range(20):
+            self.guild.add_role(FakeRole(10 + i, f'Rol {i}'))
+
+        # IDs de Discord separados por tipo para que no choquen
+        self.reclutadores = [
+            self.guild.add_member(FakeMember(10_000_000 + i, f'reclutador{i}', self.guild, (everyone, staff),
+                                             display_name=f'Reclutador {i}'))
+            for i in range(reclutadores)
+        ]
+        self.reclutados = [
+            self.guild.add_member(FakeMember(20_000_000 + i, f'reclutado{i}', self.guild, (everyone,)))
+            for i in range(reclutados)
+        ]
+        for i in range(extra):
+            self.guild.add_member(FakeMember(30_000_000 + i, f'visitante{i}', self.guild, (everyone,)))
+
+        inicio = datetime(2024, 1, 1)
+        # Reclutados: (reclutado, reclutador, fecha_registro); pocos reclutadores concentran la mayoría
+        pesos = [1 / (i + 1) for i in range(reclutadores)]
+        asignados = rng.choices(self.reclutadores, weights=pesos, k=reclutados)
+        self.altas = [(reclutado, reclutador, inicio + timedelta(minutes=i * 7))
+                      for i, (reclutado, reclutador) in enumerate(zip(self.reclutados, asignados))]
+        # Actividades: (índice del reclutado, detalle, fecha)
+        self.actividades = []
+        for n in range(actividades):
+            i = rng.randrange(reclutados)
+            self.actividades.append((i, f'Actividad {n % 40}', self.altas[i][2] + timedelta(hours=rng.randrange(1, 2000))))
+
+    def sembrar(self):
+        """Inserta los datos en la base configurada en database.py y devuelve los IDs internos de los reclutados"""
+        backend = database.get_backend()
+        with database.get_cursor(write=True) as cursor:
+            backend.execute_values(cursor, '''
+                INSERT INTO miembros (guild_id, etiqueta_miembro, etiqueta_reclutador, id_discord_miembro, id_discord_reclutador, fecha_registro)
+                VALUES %s''', [(self.guild.id, str(m), str(r), m.id, r.id, fecha) for m, r, fecha in self.altas])
+            cursor.execute('SELECT id, id_discord_miembro FROM miembros WHERE guild_id = %s', (self.guild.id,))
+            por_discord = {fila['id_discord_miembro']: fila['id'] for fila in cursor.fetchall()}
+            ids = [por_discord[m.id] for m, _, _ in self.altas]
+            backend.execute_values(cursor, 'INSERT INTO actividades (id_miembro, detalle, fecha) VALUES %s',
+                                   [(ids[i], detalle, fecha) for i, detalle, fecha in self.actividades])
+
+            # Estadísticas de reclutadores calculadas aquí para no depender de la inicialización
+            actividades = {}
+            for i, _, fecha in self.actividades:
+                r = self.altas[i][1]
+                total, ultima = actividades.get(r.id, (0, None))
+                actividades[r.id] = (total + 1, max(ultima, fecha) if ultima else fecha)
+            reclutados = {}
+            for _, r, fecha in self.altas:
+                cantidad, ultimo = reclutados.get(r.id, (0, None))
+                reclutados[r.id] = (cantidad + 1, max(ultimo, fecha) if ultimo else fecha)
+            backend.execute_values(cursor, '''
+                INSERT INTO reclutadores (guild_id, etiqueta_reclutador, id_discord, ultimo_reclutamiento, total_reclutados,
+                                          reclutados_activos, total_actividades, ultima_actividad)
+                VALUES %s''', [(self.guild.id, str(r), r.id, reclutados[r.id][1], reclutados[r.id][0], reclutados[r.id][0],
+                                 *actividades.get(r.id, (0, None)))
+                               for r in self.reclutadores if r.id in reclutados])
+        database.initialize_ranking_table(forzar=True)
+        database.initialize_actividad_diaria_table(forzar=True)
+        database.cache.clear()
+        return ids
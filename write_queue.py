@@ -0,0 +1,204 @@
+"""
+Cola de escrituras diferidas (write-behind) para altas de miembros y actividades.
+Los comandos encolan la escritura y responden enseguida; un bucle en segundo plano
+aplica las escrituras en lotes, reintenta ante errores transitorios y mantiene un
+archivo local con las pendientes para no perderlas si el bot se reinicia. Las que la base
+rechaza de forma permanente se guardan en un archivo de descartadas para revisarlas a mano.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger('write_queue')
+
+
+class WriteBehindQueue:
+    """Cola de escrituras en memoria respaldada por un archivo JSONL"""
+
+    def __init__(self, aplicar, es_transitorio, spill_path, intervalo=0.5, lote_max=200, espera_max=60,
+                 descartadas_path=None):
+        # aplicar: corrutina que recibe una lista de escrituras y las aplica en una transacción
+        self.aplicar = aplicar
+        self.es_transitorio = es_transitorio
+        self.spill_path = spill_path
+        self.descartadas_path = descartadas_path
+        self.intervalo = intervalo
+        self.lote_max = lote_max
+        self.espera_max = espera_max
+        self._pendientes = []
+        self._evento = None
+        self._tarea = None
+        self._fallos_seguidos = 0
+        # Un solo flush a la vez; flush(esperar=True) espera al que esté en curso
+        self._lock = asyncio.Lock()
+        self._reintentar_en = 0.0
+        self.stats = {'encoladas': 0, 'aplicadas': 0, 'lotes': 0, 'reintentos': 0, 'descartadas': 0}
+
+    # --- Persistencia local ---
+
+    def cargar_spill(self):
+        """Recupera las escrituras que quedaron pendientes en una ejecución anterior"""
+        if not os.path.exists(self.spill_path):
+            return 0
+        with open(self.spill_path, encoding='utf-8') as f:
+            for linea in f:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    self._pendientes.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    logger.warning(f'Línea inválida en {self.spill_path} ignorada')
+        if self._pendientes:
+            logger.info(f'Recuperadas {len(self._pendientes)} escrituras pendientes de {self.spill_path}')
+        return len(self._pendientes)
+
+    def _anexar_spill(self, escritura):
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(escritura, ensure_ascii=False) + '\n')
+
+    def _guardar_descartada(self, escritura, error):
+        if not self.descartadas_path:
+            return
+        registro = dict(escritura, error=str(error)[:500],
+                        descartada=datetime.now(timezone.utc).replace(tzinfo=None).isoformat(sep=' ', timespec='seconds'))
+        try:
+            with open(self.descartadas_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            logger.error(f'No se pudo guardar la escritura descartada en {self.descartadas_path}: {e}')
+
+    def _reescribir_spill(self):
+        if not self._pendientes:
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            return
+        temporal = f'{self.spill_path}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            for escritura in self._pendientes:
+                f.write(json.dumps(escritura, ensure_ascii=False) + '\n')
+        os.replace(temporal, self.spill_path)
+
+    # --- API para los comandos ---
+
+    def enqueue(self, tipo, datos):
+        """Encola una escritura y la deja persistida en el archivo local; devuelve su ID"""
+        datos = dict(datos)
+        # En UTC y sin zona, como CURRENT_TIMESTAMP en la base (ver storage.py)
+        datos.setdefault('fecha', datetime.now(timezone.utc).replace(tzinfo=None).isoformat(sep=' ', timespec='seconds'))
+        escritura = {'id': uuid.uuid4().hex, 'tipo': tipo, 'datos': datos}
+        self._anexar_spill(escritura)
+        self._pendientes.append(escritura)
+        self.stats['encoladas'] += 1
+        if self._evento is not None and len(self._pendientes) >= self.lote_max:
+            self._evento.set()
+        return escritura['id']
+
+    def miembro_pendiente(self, guild_id, etiqueta, id_discord=None):
+        """Indica si hay un alta de miembro del servidor encolada todavía sin aplicar"""
+        for escritura in self._pendientes:
+            if escritura['tipo'] != 'miembro':
+                continue
+            datos = escritura['datos']
+            if datos.get('guild_id', 0) != guild_id:
+                continue
+            if (id_discord is not None and datos.get('id_discord_miembro') == id_discord) or datos['etiqueta_miembro'] == etiqueta:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    # --- Aplicación en segundo plano ---
+
+    def start(self):
+        self._evento = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def stop(self):
+        """Detiene el bucle intentando aplicar lo pendiente; lo que falle queda en el archivo"""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self.flush(esperar=True)
+
+    async def _bucle(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._evento.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._evento.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f'Error inesperado aplicando escrituras: {e}')
+
+    async def flush(self, esperar=False):
+        """Aplica las escrituras pendientes en lotes; devuelve True si la cola quedó vacía.
+        Sin esperar, no hace nada si ya hay un flush en curso o si se está esperando para reintentar.
+        Con esperar=True sirve de barrera antes de borrar o leer lo encolado: espera al flush en curso
+        y reintenta enseguida; devuelve False solo si un error transitorio dejó escrituras pendientes"""
+        if self._lock.locked() and not esperar:
+            return False
+        async with self._lock:
+            while self._pendientes:
+                if not esperar and time.monotonic() < self._reintentar_en:
+                    return False
+                lote = self._pendientes[:self.lote_max]
+                if not await self._aplicar_lote(lote):
+                    return False
+                # Solo se agregan escrituras al final, así que el lote sigue al principio
+                del self._pendientes[:len(lote)]
+                self._reescribir_spill()
+            return True
+
+    async def _aplicar_lote(self, lote):
+        try:
+            await self.aplicar(lote)
+            self.stats['aplicadas'] += len(lote)
+            self.stats['lotes'] += 1
+            self._fallos_seguidos = 0
+            return True
+        except Exception as e:
+            if self.es_transitorio(e):
+                self._programar_reintento(e)
+                return False
+            logger.warning(f'Lote de {len(lote)} escrituras rechazado ({e}); aplicando una por una')
+
+        # Error permanente: aislar las escrituras inválidas aplicándolas de a una
+        for escritura in lote:
+            try:
+                await self.aplicar([escritura])
+                self.stats['aplicadas'] += 1
+            except Exception as e:
+                if self.es_transitorio(e):
+                    self._programar_reintento(e)
+                    # Quitar las que ya se aplicaron para no depender solo de la deduplicación
+                    aplicadas = lote.index(escritura)
+                    del self._pendientes[:aplicadas]
+                    self._reescribir_spill()
+                    return False
+                self.stats['descartadas'] += 1
+                self._guardar_descartada(escritura, e)
+                logger.error(f"Escritura {escritura['tipo']} descartada: {e} - {escritura['datos']}"
+                             f" (guardada en {self.descartadas_path})")
+        self._fallos_seguidos = 0
+        return True
+
+    def _programar_reintento(self, error):
+        self._fallos_seguidos += 1
+        self.stats['reintentos'] += 1
+        espera = min(2 ** self._fallos_seguidos, self.espera_max)
+        self._reintentar_en = time.monotonic() + espera
+        logger.warning(f'Error transitorio aplicando escrituras ({error}); reintento en {espera}s '
+                       f'({len(self._pendientes)} pendientes)')